@@ -16,9 +16,28 @@
 
 from ctypes import *
 from dwfconstants import *
+from background_writer import BackgroundWriter
+from capture_window import AdaptiveWindow
+from checkpoint import RunCheckpoint, resume_checkpoint
+from edge_log import EDGE_LOG_EXTENSION
+from multiprocessing.sharedctypes import RawArray
+from sketch import LatencySketch, QuantileStoppingRule
+from stimulus import DigitalOutStimulus, PressLog, PressSchedule
+from stream_reader import StreamReader
+from telemetry import TelemetryLog, monotonic
+from watchdog import RECOVERY_REARM, RECOVERY_REOPEN, STALL_DIO_TIMEOUT, STALL_NO_SAMPLES, STALL_NO_TRIGGER, StallWatchdog
+from timeit import default_timer
+import numpy as np
+import argparse
+import edge_log
 import errno
+import json
 import logging
+import multiprocessing
+import Queue
+import signal
 import sys
+import threading
 import time
 import random
 import os
@@ -38,10 +57,617 @@ class Network:
 		self.num_packets = num_packets_to_send
 
 
+class CaptureBufferPool:
+	"""Fixed set of zeroed capture buffers that are reused across packets.
+
+	A buffer handed out by acquire() is all zeros. When it is released, only the prefix
+	that _copy_buffer_samples wrote is zeroed again, so samples skipped over as lost
+	still read as 0 next time, exactly like a freshly allocated buffer.
+
+	With shared=True the buffers live in shared memory, so worker processes started
+	after the pool can read them without a copy (see _init_dump_worker).
+	Buffers may be released from a different thread than the one that acquired them.
+	"""
+
+	def __init__(self, num_samples, num_buffers, shared=False):
+		# samples in the largest buffer (see grow)
+		self.num_samples = num_samples
+		self.num_buffers = num_buffers
+		self.shared = shared
+
+		# time (s) spent allocating buffers and re-zeroing released prefixes
+		self.alloc_time = 0
+		self.zero_time = 0
+		self.samples_zeroed = 0
+		self._stats_lock = threading.Lock()
+
+		alloc_start = default_timer()
+		if shared:
+			self.buffers = [RawArray(c_uint16, num_samples) for i in range(num_buffers)]
+		else:
+			self.buffers = [(c_uint16 * num_samples)() for i in range(num_buffers)]
+		self.alloc_time = default_timer() - alloc_start
+
+		self._free = Queue.Queue()
+		for buf in self.buffers:
+			self._free.put(buf)
+
+	def acquire(self):
+		"""Returns a zeroed buffer of num_samples samples.
+		Waits for a buffer to be released if all of them are in use.
+		"""
+		while True:
+			# a timeout keeps the wait interruptible by KeyboardInterrupt
+			try:
+				return self._free.get(timeout=0.1)
+			except Queue.Empty:
+				pass
+
+	def release(self, buf, num_written):
+		"""Zeroes the first num_written samples of buf and returns it to the pool."""
+		num_written = min(num_written, len(buf))
+		zero_start = default_timer()
+		memset(buf, 0, 2 * num_written)
+		zero_time = default_timer() - zero_start
+		with self._stats_lock:
+			self.zero_time += zero_time
+			self.samples_zeroed += num_written
+		self._free.put(buf)
+
+	def index(self, buf):
+		"""Position of buf in self.buffers."""
+		return self.buffers.index(buf)
+
+	def grow(self, buf, num_samples):
+		"""Returns a zeroed buffer of num_samples samples holding the contents of buf, and puts it
+		in buf's place in the pool; returns buf itself if it is big enough already.
+		Only buffers that are not shared can grow.
+		"""
+		if len(buf) >= num_samples:
+			return buf
+		assert not self.shared, "shared capture buffers cannot grow"
+		alloc_start = default_timer()
+		bigger = (c_uint16 * num_samples)()
+		memmove(bigger, buf, sizeof(buf))
+		self.alloc_time += default_timer() - alloc_start
+		self.buffers[self.buffers.index(buf)] = bigger
+		self.num_samples = max(self.num_samples, num_samples)
+		return bigger
+
+
+class PacketCapture:
+	"""Everything run() learns about one button press.
+	The samples are either left in a capture buffer (samples, from buffer_pool)
+	or already reduced to edges (edges = (offsets, samples)).
+	"""
+
+	def __init__(self, attempt_number):
+		self.attempt_number = attempt_number
+
+		self.received = False
+		self.broke_early = False
+		self.ack_missed = False
+		# why a capture that broke early stalled (see watchdog.py); None if it did not stall
+		self.stall = None
+
+		#csamples, lost, corrupted
+		self.buffer_info = [0, 0, 0]
+		# (start, end) of every range of record samples the device lost; a capture buffer holds zeros there
+		self.lost_ranges = []
+		# polled: number of samples taken in the record; an edge at or past it is the capture
+		# buffer's zeros after them (see extract_edges), None in the other capture modes
+		self.num_valid = None
+		# one-to-many networks: the packet reached some of the receivers but not all of them (it
+		# counts as missed)
+		self.partial = False
+
+		self.samples = None
+		self.buffer_pool = None
+		self.edges = None
+
+		# hardware-timed presses: seconds between starting the DigitalOut instrument and the press
+		self.press_wait = 0
+
+		# monotonic host timestamps (see telemetry.py) around the random wait before the press and
+		# the reconfiguration of the instruments; of the press (press_wait after the press call with
+		# hardware-timed presses) and the end of the press call; and of the end of the capture loop.
+		# None where the capture made no such call
+		self.wait_requested = 0
+		self.wait_start = None
+		self.wait_end = None
+		self.reconfigure_start = None
+		self.reconfigure_end = None
+		self.press_time = None
+		self.press_end = None
+		self.detect_time = None
+		# AD2 sample index of the button press mirror edge, in the record (polled, terminated) or in
+		# the stream (streaming); -1 if there was none
+		self.mirror_index = -1
+		# streaming: number of the stream record the press went into
+		self.stream_record = 0
+
+	def release(self):
+		"""Returns the capture buffer (if any) to its pool."""
+		if self.buffer_pool is not None:
+			self.buffer_pool.release(self.samples, self.buffer_info[0])
+			self.samples = None
+			self.buffer_pool = None
+
+
+class NetworkRun:
+	"""Per-network state of AnalogDiscoveryUtils.run_networks: the network's channels as bit masks,
+	its segmenter, data file and counters, and the packet in progress.
+	"""
+
+	def __init__(self, index, network, window):
+		self.index = index
+		self.network = network
+
+		self.button_press_bit = 1 << network.input_channels[0]
+		self.button_press_mirror_bit = 1 << network.output_channels[0]
+		self.packet_created_bit = 1 << network.output_channels[1]
+		self.packet_received_bits = 0
+		for ch in network.output_channels[2:]:
+			self.packet_received_bits |= 1 << ch
+		self.one_to_many = len(network.output_channels[2:]) > 1
+		self.bits_to_monitor = self.button_press_mirror_bit | self.packet_created_bit | self.packet_received_bits
+
+		# the button press channel is kept so the press shows up in the data, like in a single-network run
+		self.segmenter = StreamSegmenter(self.button_press_mirror_bit, self.packet_created_bit, self.packet_received_bits, window,
+			mask=self.bits_to_monitor | self.button_press_bit, wait_for_all=self.one_to_many)
+
+		self.data_file = None
+		self.sketch_file = None
+		# ReceiverLog of a one-to-many network
+		self.receivers = None
+		self.sketch = LatencySketch()
+		# set when the stopping rule ends this network early
+		self.stop_reason = None
+		self.num_tries = 0
+		self.num_packets_received = 0
+		self.num_packets_missed = 0
+		# missed packets that reached some of the receivers
+		self.num_packets_partial = 0
+		# packet in progress, and host time (monotonic) of the next press
+		self.capture = None
+		self.next_press_time = 0
+
+	def done(self):
+		if self.capture is not None:
+			return False
+		return self.num_tries >= self.network.num_packets or self.stop_reason is not None
+
+	def channel_map(self):
+		return {
+			"button_press_bit": self.button_press_bit,
+			"button_press_mirror_bit": self.button_press_mirror_bit,
+			"packet_created_bit": self.packet_created_bit,
+			"packet_received_bits": self.packet_received_bits,
+		}
+
+
+class ReceiverLog:
+	"""Per-receiver side file of a one-to-many network: one line per packet with the latency (ms)
+	of every receiver's first edge, -1 for receivers that did not get the packet.
+	Also counts, per receiver, the packets it got and the ones it lost.
+	"""
+
+	def __init__(self, path, channels, period_ms):
+		self.path = path
+		self.channels = list(channels)
+		self.period_ms = period_ms
+		self.num_received = [0] * len(self.channels)
+		self.num_lost = [0] * len(self.channels)
+
+		with open(path, "w") as f:
+			f.write("Packet, " + ", ".join("DIO {} latency (ms)".format(ch) for ch in self.channels) + ", Receivers\n")
+
+	def log(self, attempt_number, offsets, samples, end=None):
+		"""Appends the line of one packet, from its edges (see receiver_first_edges)."""
+		first_edges = receiver_first_edges(offsets, samples, self.channels, end)
+		got = first_edges >= 0
+		for i, received in enumerate(got.tolist()):
+			if received:
+				self.num_received[i] += 1
+			else:
+				self.num_lost[i] += 1
+
+		latencies = ["{}".format(offset * self.period_ms) if offset >= 0 else "-1" for offset in first_edges.tolist()]
+		with open(self.path, "a") as f:
+			f.write("{}, {}, {}\n".format(attempt_number, ", ".join(latencies), int(got.sum())))
+
+	def summary(self):
+		"""Per-receiver counts, as written to summary_*.json."""
+		return [{
+			"channel": ch,
+			"num_packets_received": received,
+			"num_packets_lost": lost,
+		} for ch, received, lost in zip(self.channels, self.num_received, self.num_lost)]
+
+
+class StreamSegmenter:
+	"""Cuts the continuous DigitalIn stream of streaming mode into packets.
+
+	After press(), the first rising edge of mirror_bit starts a packet. The packet ends at the first
+	sample where a received_bits channel differs from its state before the press (received),
+	or window samples after the start (missed). With wait_for_all (one-to-many networks) it ends
+	only once every received_bits channel has differed, or at the window; a packet that reached
+	some of the receivers is still received.
+	Offsets are relative to the sample before the mirror edge, the same as in a triggered capture.
+	Only the edges of the current packet are kept, so memory does not grow with the stream.
+	Samples are ANDed with mask first, so channels outside it (another network's) are ignored.
+	"""
+
+	def __init__(self, mirror_bit, created_bit, received_bits, window, mask=0xFFFF, wait_for_all=False):
+		self.mirror_bit = mirror_bit
+		self.created_bit = created_bit
+		self.received_bits = received_bits
+		self.window = window
+		self.mask = mask
+		self.wait_for_all = wait_for_all
+
+		# stream index of the next sample fed in, and the value of the sample before it
+		self.stream_index = 0
+		self.prev_sample = 0
+		# totals over the whole stream
+		self.stream_lost = 0
+		self.stream_corrupted = 0
+
+		# stream index at press(); -1 when no packet is in progress
+		self.press_index = -1
+		# stream index of the sample before the mirror edge; -1 until the edge is seen
+		self.packet_start = -1
+		self.packet_end = -1
+		self.start_sample = 0
+
+		self.offsets = []
+		self.samples = []
+		self.lost = 0
+		self.corrupted = 0
+		self.received = False
+		self.ack_missed = False
+		self.failed = False
+		# received_bits channels that differed from their state at the start
+		self.toggled_bits = 0
+		# (stream index after, length) of the last samples lost
+		self._gap = (-1, 0)
+
+	def press(self):
+		"""Starts looking for the next packet. Call right before pressing the button."""
+		self.press_index = self.stream_index
+		self.packet_start = -1
+		self.packet_end = -1
+		self.offsets = []
+		self.samples = []
+		self.lost = 0
+		self.corrupted = 0
+		self.received = False
+		self.ack_missed = False
+		self.failed = False
+		self.toggled_bits = 0
+
+	def abort(self):
+		"""Gives up on the packet in progress."""
+		self.failed = True
+		self.press_index = -1
+
+	def in_progress(self):
+		return self.press_index >= 0
+
+	def packet_length(self):
+		"""Number of samples from the start of the last packet to its end."""
+		return self.packet_end - self.packet_start
+
+	def packet_edges(self):
+		"""Returns (offsets, samples) of the last packet, like extract_edges."""
+		return np.array(self.offsets, dtype=np.int64), np.array(self.samples, dtype=np.uint16)
+
+	def feed(self, chunk, count, lost, corrupted):
+		"""Consumes the first count samples of chunk.
+		lost samples were dropped by the device right before them; since their values are
+		unknown, the state before the gap is carried across it.
+		"""
+		self.stream_lost += lost
+		self.stream_corrupted += corrupted
+		if self.packet_start >= 0 and self.in_progress():
+			self.lost += lost
+			self.corrupted += corrupted
+		self.stream_index += lost
+		if lost:
+			self._gap = (self.stream_index, lost)
+
+		if count > 0:
+			view = np.ctypeslib.as_array(chunk)[:count]
+			if self.mask != 0xFFFF:
+				view = view & self.mask
+			changed = np.empty(count, dtype=bool)
+			changed[0] = view[0] != self.prev_sample
+			np.not_equal(view[1:], view[:-1], out=changed[1:])
+
+			# the state only changes at edges, so only edges are looked at
+			before = self.prev_sample
+			for i in np.flatnonzero(changed).tolist():
+				if not self.in_progress():
+					break
+				sample = int(view[i])
+				self._edge(self.stream_index + i, before, sample)
+				before = sample
+			self.prev_sample = int(view[-1])
+
+		self.stream_index += count
+		self._check_window(self.stream_index)
+
+	def _check_window(self, index):
+		"""Ends the packet in progress if the stream reached index without it finishing."""
+		if not self.in_progress():
+			return
+		if self.packet_start < 0:
+			if index - self.press_index > self.window:
+				# the mirror edge never showed up
+				self.abort()
+		elif index - self.packet_start > self.window:
+			self._finish(self.packet_start + self.window)
+
+	def _edge(self, index, before, sample):
+		"""Handles a change from before to sample at stream index index."""
+		self._check_window(index)
+		if not self.in_progress():
+			return
+
+		if self.packet_start < 0:
+			if (sample & self.mirror_bit) and not (before & self.mirror_bit):
+				self.packet_start = index - 1
+				self.start_sample = before
+				if before != 0:
+					self.offsets.append(0)
+					self.samples.append(before)
+				self.offsets.append(1)
+				self.samples.append(sample)
+			return
+
+		self.offsets.append(index - self.packet_start)
+		self.samples.append(sample)
+		toggled = (sample ^ self.start_sample) & self.received_bits
+		if toggled:
+			if index == self._gap[0]:
+				# the receiver toggled somewhere within the lost samples
+				self.corrupted += self._gap[1]
+			if not self.received:
+				self.received = True
+				if (sample ^ self.start_sample) & self.created_bit:
+					self.ack_missed = True
+			self.toggled_bits |= toggled
+			if not self.wait_for_all or self.toggled_bits == self.received_bits:
+				self._finish(index)
+
+	def _finish(self, index):
+		self.packet_end = index
+		self.press_index = -1
+
+
+class EdgeAccumulator:
+	"""Reduces a record to its edges chunk by chunk, as the samples are read off the device, so the
+	raw samples never get a buffer of their own: memory is one chunk plus the edges, whatever the
+	sampling frequency and window.
+
+	The edges are the ones extract_edges finds in the whole record (the sample before the first
+	one is taken to be 0). Samples the device lost are skipped over with the state before the gap
+	carried across it, instead of reading as zeros.
+	The chunk must hold every sample one status read can return (the device buffer).
+	"""
+
+	def __init__(self, chunk_samples):
+		# recycled for every read
+		self.chunk = (c_uint16 * chunk_samples)()
+		self.reset()
+
+	def reset(self):
+		"""Starts a new record."""
+		self._offsets = []
+		self._samples = []
+		self.prev_sample = 0
+		# record index of the next sample expected, and the gaps (see skip_lost_samples)
+		self._next = 0
+		self.gaps = {}
+
+	def feed(self, start, count):
+		"""Reduces the first count samples of chunk, which are samples start... of the record."""
+		view = np.ctypeslib.as_array(self.chunk)[:count]
+		if start > self._next and view[0] != self.prev_sample:
+			# the samples before start were lost; the change happened somewhere within them
+			self.gaps[start] = start - self._next
+		self._next = start + count
+		changed = np.empty(count, dtype=bool)
+		changed[0] = view[0] != self.prev_sample
+		np.not_equal(view[1:], view[:-1], out=changed[1:])
+		index = np.flatnonzero(changed)
+		if len(index) > 0:
+			self._offsets.append(index + start)
+			self._samples.append(view[index])
+		self.prev_sample = int(view[-1])
+
+	def edges(self, end=None):
+		"""Returns (offsets, samples) of the record so far, like extract_edges.
+		With end, an edge to 0 is added at offset end if the last sample was not 0, the way a zeroed
+		capture buffer reads one past the last sample written (see postprocess).
+		"""
+		offsets = self._offsets
+		samples = self._samples
+		if end is not None and self.prev_sample != 0:
+			offsets = offsets + [np.array([end], dtype=np.int64)]
+			samples = samples + [np.zeros(1, dtype=np.uint16)]
+		if not offsets:
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16)
+		return np.concatenate(offsets).astype(np.int64), np.concatenate(samples)
+
+
+class DigitalInPoller:
+	"""The dwf calls made on every iteration of the acquisition loop, with as little Python overhead as possible.
+
+	The ctypes out-parameters and the byref() pointers to them are allocated once, and each dwf
+	function is looked up once with its argtypes set, so a poll does not build new ctypes objects.
+	Also counts loop iterations and the time spent in each kind of call.
+	"""
+
+	def __init__(self, interface_handler, poll_interval=0):
+		self.interface_handler = interface_handler
+		# seconds to sleep at the end of every loop iteration (0: spin)
+		self.poll_interval = poll_interval
+
+		self._read_data = c_int(1)
+		self._status = c_byte()
+		self._status_ref = byref(self._status)
+		self._available = c_int()
+		self._available_ref = byref(self._available)
+		self._lost = c_int()
+		# read_stream: samples available at the last read that did not fit in its array
+		self._stream_unread = 0
+		self._lost_ref = byref(self._lost)
+		self._corrupted = c_int()
+		self._corrupted_ref = byref(self._corrupted)
+		self._dio_pins = c_uint16()
+		self._dio_pins_ref = byref(self._dio_pins)
+
+		self._FDwfDigitalInStatus = _bind_dwf_function("FDwfDigitalInStatus", [c_int, c_int, POINTER(c_byte)])
+		self._FDwfDigitalInStatusRecord = _bind_dwf_function("FDwfDigitalInStatusRecord", [c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int)])
+		self._FDwfDigitalInStatusData = _bind_dwf_function("FDwfDigitalInStatusData", [c_int, c_void_p, c_int])
+		self._FDwfDigitalIOStatus = _bind_dwf_function("FDwfDigitalIOStatus", [c_int])
+		self._FDwfDigitalIOInputStatus = _bind_dwf_function("FDwfDigitalIOInputStatus", [c_int, POINTER(c_uint16)])
+
+		# statistics
+		self.iterations = 0
+		self.loop_time = 0
+		self.num_buffer_reads = 0
+		self.buffer_read_time = 0
+		self.max_buffer_read_time = 0
+		self.num_dio_reads = 0
+		self.dio_read_time = 0
+		self.last_dio_read_time = 0
+		self._loop_start = 0
+
+	def _fetch_status(self):
+		"""Fetches DigitalIn data and its record info. Returns the instrument state."""
+		self._FDwfDigitalInStatus(self.interface_handler, self._read_data, self._status_ref)
+		self._FDwfDigitalInStatusRecord(self.interface_handler, self._available_ref, self._lost_ref, self._corrupted_ref)
+		return self._status.value
+
+	def copy_buffer_samples(self, buffer_info, nSamples, arr, lost_ranges=None):
+		"""Same as AnalogDiscoveryUtils._copy_buffer_samples, but updates buffer_info in place.
+		The range of samples skipped over as lost, if any, is appended to lost_ranges.
+		"""
+		read_start = default_timer()
+		self._fetch_status()
+
+		cSamples = buffer_info[0] + self._lost.value
+		if self._lost.value and lost_ranges is not None:
+			lost_ranges.append((buffer_info[0], cSamples))
+		cAvailable = max(0, min(self._available.value, nSamples - cSamples))
+
+		# copy samples to arr on computer
+		self._FDwfDigitalInStatusData(self.interface_handler, byref(arr, 2*cSamples), 2*cAvailable)
+
+		buffer_info[0] = cSamples + cAvailable
+		buffer_info[1] += self._lost.value
+		buffer_info[2] += self._corrupted.value
+
+		read_time = default_timer() - read_start
+		self.buffer_read_time += read_time
+		if read_time > self.max_buffer_read_time:
+			self.max_buffer_read_time = read_time
+		self.num_buffer_reads += 1
+		return buffer_info
+
+	def reduce_buffer_samples(self, buffer_info, nSamples, accumulator):
+		"""Same as copy_buffer_samples, but the samples are read into accumulator's chunk and
+		reduced to edges right away (see EdgeAccumulator).
+		"""
+		read_start = default_timer()
+		self._fetch_status()
+
+		cSamples = buffer_info[0] + self._lost.value
+		cAvailable = max(0, min(self._available.value, nSamples - cSamples, len(accumulator.chunk)))
+		if cAvailable > 0:
+			self._FDwfDigitalInStatusData(self.interface_handler, accumulator.chunk, 2*cAvailable)
+
+		read_time = default_timer() - read_start
+		self.buffer_read_time += read_time
+		if read_time > self.max_buffer_read_time:
+			self.max_buffer_read_time = read_time
+		self.num_buffer_reads += 1
+
+		if cAvailable > 0:
+			accumulator.feed(cSamples, cAvailable)
+		buffer_info[0] = cSamples + cAvailable
+		buffer_info[1] += self._lost.value
+		buffer_info[2] += self._corrupted.value
+		return buffer_info
+
+	def read_stream(self, arr):
+		"""Copies the samples available from a running record acquisition to the start of arr
+		(at most len(arr) of them).
+		Returns [samples copied, cLost, cCorrupted, instrument state].
+		"""
+		read_start = default_timer()
+		state = self._fetch_status()
+
+		count = min(self._available.value, len(arr))
+		if count > 0:
+			self._FDwfDigitalInStatusData(self.interface_handler, arr, 2*count)
+		# the device does not keep the samples left unread; they are lost before the next read's
+		lost = self._lost.value + self._stream_unread
+		self._stream_unread = self._available.value - count
+
+		read_time = default_timer() - read_start
+		self.buffer_read_time += read_time
+		if read_time > self.max_buffer_read_time:
+			self.max_buffer_read_time = read_time
+		self.num_buffer_reads += 1
+		return [count, lost, self._corrupted.value, state]
+
+	def rearm(self, configure):
+		"""Starts reading a new record, armed by configure() (see StreamReader.rearm)."""
+		configure()
+
+	def state(self):
+		"""Instrument state fetched by the last buffer read."""
+		return self._status.value
+
+	def get_DIO_values(self):
+		"""Same as AnalogDiscoveryUtils._get_DIO_values."""
+		read_start = default_timer()
+		self._FDwfDigitalIOStatus(self.interface_handler)
+		self._FDwfDigitalIOInputStatus(self.interface_handler, self._dio_pins_ref)
+		self.last_dio_read_time = default_timer() - read_start
+		self.dio_read_time += self.last_dio_read_time
+		self.num_dio_reads += 1
+		return self._dio_pins.value
+
+	def start_loop(self):
+		self._loop_start = default_timer()
+
+	def end_loop(self):
+		self.loop_time += default_timer() - self._loop_start
+
+	def end_iteration(self):
+		"""Called at the end of every loop iteration; sleeps for poll_interval."""
+		self.iterations += 1
+		if self.poll_interval > 0:
+			time.sleep(self.poll_interval)
+
+	def summary(self):
+		"""One line describing the poll rate and per-call cost."""
+		return "Poll loop: {} iterations, {:.0f} iterations/s, buffer read {:.1f} us/call, DIO read {:.1f} us/call".format(
+			self.iterations,
+			self.iterations / max(self.loop_time, 1e-9),
+			1e6 * self.buffer_read_time / max(self.num_buffer_reads, 1),
+			1e6 * self.dio_read_time / max(self.num_dio_reads, 1))
+
+
 class AnalogDiscoveryUtils:
 
 	def __init__(self, sampling_freq_user_input):
 		self.interface_handler = None
+		self.device_index = -1
 
 		self.internal_clock_freq = 0
 		self.sampling_freq = sampling_freq_user_input
@@ -67,33 +693,135 @@ class AnalogDiscoveryUtils:
 		self.packet_created_bit = -1
 
 		self.packet_received_bits = -1
+		self.packet_received_channels = []
 
 		# when post-processing we only care about changes to these bits
 		self.bits_to_monitor = -1
 		self.num_channels_to_monitor = -1
 
+		# more than one reception channel: a packet is captured until every receiver got it (or the
+		# window ends), and each receiver's first-edge latency goes to a receivers_*.csv side file
 		self.one_to_many = False
 
+		# number of capture buffers run() keeps and reuses across packets
+		self.num_capture_buffers = 1
+
+		# "csv" for the text data file, "bin" for a binary edge log (see edge_log.py)
+		self.data_format = "csv"
+
+		# background writer: postprocessing and file writes happen on a worker thread
+		self.background_writer = False
+		# captures that may wait for the writer before run() blocks
+		self.writer_queue_size = 8
+		# worker processes that extract the edges of missed-packet dumps
+		self.dump_processes = 1
+
+		# seconds the acquisition loop sleeps between polls of the device (0: poll as fast as possible)
+		self.poll_interval = 0
+
+		# how each packet is captured:
+		#	"polled": trigger on the button press mirror, poll the DIO pins for the packet reception toggle
+		#	"streaming": one record acquisition for the whole experiment, segmented on the host
+		#	"terminated": the AD2 ends the record on the packet reception toggle by itself
+		self.capture_mode = "polled"
+
+		# adaptive capture window (see capture_window.py): each packet starts with a window estimated
+		# from the packets before it and is extended in chunks up to at most window_ceiling seconds,
+		# instead of always reserving window_ceiling seconds
+		self.adaptive_window = False
+		self.window_ceiling = 1.5
+		self._window = None
+
+		# chunked capture (polled and terminated modes): every chunk read off the device is reduced to
+		# edges right away (see EdgeAccumulator) instead of being kept in a per-packet buffer
+		self.chunked_capture = False
+		self._accumulator = None
+
+		# samples per stream record; the record is re-armed when it runs out
+		self.stream_record_samples = (2 ** 31) - 1
+		# samples per host-side read of the stream (and of a chunked capture)
+		self.stream_chunk_samples = 1 << 16
+		# reader thread (see stream_reader.py): a thread of its own drains the stream into a ring of
+		# reader_ring_samples samples, and the acquisition loop reads the stream from the ring
+		self.reader_thread = False
+		self.reader_ring_samples = 1 << 22
+		# hardware-terminated records: samples before the trigger is armed, and after it fires
+		self.terminated_prefill_samples = 16
+		self.terminated_tail_samples = 16
+
+		# hardware-timed button presses (see stimulus.py): the jitter before every press comes from a
+		# seeded schedule and the DigitalOut instrument plays the press out, instead of the host
+		# sleeping and setting the DIO pins
+		self.hardware_press = False
+		# seed of the press schedule (None: a random one, recorded in the press log)
+		self.press_seed = None
+		# seconds the button press channel is held high
+		self.press_pulse_width = 100e-6
+		# extra seconds to wait for a scheduled press to trigger DigitalIn before giving up
+		self.press_trigger_timeout = 0.1
+		self._stimulus = None
+
+		# stall watchdog (see watchdog.py): a capture that stalls is classified and recovered from by
+		# re-arming DigitalIn, resetting the instruments or reopening the device, with backoff
+		self.watchdog = False
+		# seconds without new samples, and seconds a DIO read may take, before a capture has stalled
+		self.stall_timeout = 0.5
+		self.dio_read_timeout = 0.1
+		self._watchdog = None
+
+		# per-packet telemetry side file (see telemetry.py), and seconds between console summaries (0: none)
+		self.telemetry = False
+		self.telemetry_interval = 0
+		# stream records started so far (streaming mode)
+		self._stream_records = 0
+
+		# packets between live latency quantile and PDR prints (0: none); the latency sketch of every
+		# run (see sketch.py) is written to sketch_*.json either way
+		self.quantile_interval = 0
+		# optional QuantileStoppingRule (see sketch.py): the experiment ends before num_packets once
+		# the rule is met, and why it ended goes to the run summary
+		self.stopping_rule = None
+		self.stop_reason = None
+		# reason passed to stop(), which ends the run in progress from another thread
+		self._stop_requested = None
+		# optional packet_listener(data_file, capture, latency), called for every packet written
+		# (latency in ms, of the packet's last edge); acq_daemon.py streams packets to its clients with it
+		self.packet_listener = None
+
+		# packets between checkpoints of run() (see checkpoint.py), and the checkpoint file the next
+		# run() resumes from (None: it starts a new run)
+		self.checkpoint_interval = 100
+		self.resume_from = None
+
+		# counters of the last run() or run_networks(), also written to summary_*.json
+		self.run_summary = None
+
 		# boolean that keeps track of AD2's DIO interface with network
 		self.network_added = False
 
-	def open_device(self):
+	def open_device(self, device_index=-1):
 		"""Opens the connection to AD2.
 		   Sets the class attribute post-connection dwf interface_handler
 			   object, as well as the internal clock frequency.
+		   device_index is the device's index in enumerate_devices(); -1 opens the first one available.
 		"""
+		print "\nOpening device"
+		if not self._open_device(device_index):
+			print "failed to open device"
+			quit()
+
+	def _open_device(self, device_index):
+		"""Opens the device (see open_device). Returns False if it could not be opened."""
 		# open device
 		# declare ctype variables
 		hdwf = c_int()
-
-		print "\nOpening device"
-		dwf.FDwfDeviceOpen(c_int(-1), byref(hdwf))
+		dwf.FDwfDeviceOpen(c_int(device_index), byref(hdwf))
 
 		if hdwf.value == 0:
-			print "failed to open device"
-			quit()
+			return False
 
 		self.interface_handler = hdwf
+		self.device_index = device_index
 
 		hzSysIn = c_double()
 		#max_buffer_size_in = c_int()
@@ -105,6 +833,7 @@ class AnalogDiscoveryUtils:
 
 		#print "internal digital in frequency is " + str(hzSysIn.value)
 		#print "digital in max buffer size: " + str(max_buffer_size_in.value)
+		return True
 
 	def close_device(self):
 		"""Resets instruments and closes the connection to AD2."""
@@ -113,11 +842,30 @@ class AnalogDiscoveryUtils:
 		dwf.FDwfDigitalIOReset()
 
 		#reset DigitalIn instrument
-		dwf.FDwfDigitalInReset(ad_utils.interface_handler)
+		dwf.FDwfDigitalInReset(self.interface_handler)
 
-		dwf.FDwfDeviceCloseAll()
+		if self.device_index == -1:
+			dwf.FDwfDeviceCloseAll()
+		else:
+			# other processes may have the other devices open
+			dwf.FDwfDeviceClose(self.interface_handler)
 		print "device closed\n"
 
+	def stop(self, reason):
+		"""Ends the run in progress (run or run_networks), and any later one, as if it had stopped
+		early for reason. May be called from any thread. In run() the packet being captured is still
+		finished; run_networks drops the packets in progress.
+		"""
+		self._stop_requested = reason
+
+	def use_device(self, other):
+		"""Takes over the device other (an AnalogDiscoveryUtils) has open, instead of opening it again.
+		Lets several experiments run back to back on one device handle (see queue_runner.py).
+		"""
+		self.interface_handler = other.interface_handler
+		self.device_index = other.device_index
+		self.internal_clock_freq = other.internal_clock_freq
+
 	def add_network(self, network):
 		"""sets network outputs to be AD2 input channels
 		sets all other AD2 channels to be outputs. 
@@ -138,8 +886,8 @@ class AnalogDiscoveryUtils:
 		self.packet_created_bit = 1 << self.packet_created_pos
 
 		self.packet_received_bits = 0
-		if (len(network.output_channels[2:]) > 1):
-			self.one_to_many = True
+		self.packet_received_channels = network.output_channels[2:]
+		self.one_to_many = len(self.packet_received_channels) > 1
 		# get all packet reception inputs
 		for ch in network.output_channels[2:]:
 			self.packet_received_bits = self.packet_received_bits|(1 << ch)
@@ -165,6 +913,15 @@ class AnalogDiscoveryUtils:
 		print "AD2 enabled outputs: {}".format(binary_num_str(self.output_channels_bit_rep))
 		print "AD2 inputs: {}\n".format(binary_num_str(self.input_channels_bit_rep))	
 
+	def channel_map(self):
+		"""Returns the bit masks of the network's channels, as stored in an edge log header."""
+		return {
+			"button_press_bit": self.button_press_bit,
+			"button_press_mirror_bit": self.button_press_mirror_bit,
+			"packet_created_bit": self.packet_created_bit,
+			"packet_received_bits": self.packet_received_bits,
+		}
+
 	def _get_DIO_values(self, print_vals=False):
 		"""Returns an int containing the DIO channel values.
 		"""
@@ -231,6 +988,42 @@ class AnalogDiscoveryUtils:
 
 		#print "Configured DigitalIn."
 
+	def _configure_DigitalIn_terminated(self, num_samples):
+		"""configure DigitalIn for hardware-terminated capture: a record that the instrument itself
+		ends on the first toggle of any packet_received_bits channel.
+
+		The record starts with terminated_prefill_samples taken before the trigger is armed and
+		keeps recording until the trigger, then takes terminated_tail_samples more and stops.
+		The host only has to drain it; num_samples bounds how much of it is kept.
+
+		The trigger cannot wait for every channel of a one-to-many network, so there the record
+		goes on for num_samples after the first toggle and the host stops it (see _capture_terminated).
+		"""
+
+		#reset DigitalIn instrument
+		dwf.FDwfDigitalInReset(self.interface_handler)
+
+		dwf.FDwfDigitalInAcquisitionModeSet(self.interface_handler, acqmodeRecord)
+		# set clock divider so 100 MHz / self.sampling_freq = divider
+		dwf.FDwfDigitalInDividerSet(self.interface_handler, c_int((int) (100000000 / self.sampling_freq)))
+		# take 16 bits per sample
+		dwf.FDwfDigitalInSampleFormatSet(self.interface_handler, c_int(16))
+
+		# samples recorded before the trigger is armed; the press happens after them
+		dwf.FDwfDigitalInTriggerPrefillSet(self.interface_handler, c_int(self.terminated_prefill_samples))
+		# samples taken after the trigger before the record stops
+		tail_samples = self.terminated_tail_samples
+		if self.one_to_many:
+			tail_samples = num_samples
+		dwf.FDwfDigitalInTriggerPositionSet(self.interface_handler, c_int(tail_samples))
+		# set trigger source to AD2 DigitalIn channels
+		dwf.FDwfDigitalInTriggerSourceSet(self.interface_handler, trigsrcDetectorDigitalIn)
+		# trigger on a rising or a falling edge of any packet reception channel
+		dwf.FDwfDigitalInTriggerSet(self.interface_handler, c_int(0), c_int(0), c_int(self.packet_received_bits), c_int(self.packet_received_bits))
+
+		# start acquisition
+		dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(1))
+
 	def _get_DigitalIn_status(self, read_data=False):
 		"""Returns the c_ubyte() object corresponding to the instrument state.
 		"""
@@ -272,6 +1065,35 @@ class AnalogDiscoveryUtils:
 		buffer_info = [cSamples, buffer_info[1] + cLost.value, buffer_info[2] + cCorrupted.value]
 		return buffer_info
 
+	def _configure_DigitalIn_stream(self):
+		"""configure DigitalIn for streaming mode: one record acquisition that starts immediately
+		and runs for stream_record_samples samples, however many packets that spans.
+		"""
+
+		#reset DigitalIn instrument
+		dwf.FDwfDigitalInReset(self.interface_handler)
+
+		dwf.FDwfDigitalInAcquisitionModeSet(self.interface_handler, acqmodeRecord)
+		# set clock divider so 100 MHz / self.sampling_freq = divider
+		dwf.FDwfDigitalInDividerSet(self.interface_handler, c_int((int) (100000000 / self.sampling_freq)))
+		# take 16 bits per sample
+		dwf.FDwfDigitalInSampleFormatSet(self.interface_handler, c_int(16))
+
+		# no trigger: the record starts as soon as the instrument is armed
+		dwf.FDwfDigitalInTriggerSourceSet(self.interface_handler, trigsrcNone)
+		dwf.FDwfDigitalInTriggerPositionSet(self.interface_handler, c_int(self.stream_record_samples))
+
+		# start acquisition
+		dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(1))
+		self._stream_records += 1
+
+	def _rearm_DigitalIn_stream(self):
+		"""Starts a new streaming record with the configuration of _configure_DigitalIn_stream,
+		without resetting the instrument.
+		"""
+		dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(1))
+		self._stream_records += 1
+
 	def run(self, experiment_directory):
 		"""The main function of the experiment.
 		Our test harness consists of two parts:
@@ -287,41 +1109,143 @@ class AnalogDiscoveryUtils:
 			(Python): increment number of packets sent
 			repeat above steps until number of packets sent = number of packets in experiment
 
-		Returns the path to the data file (csv)
+		In streaming mode (self.capture_mode) the AD2 records continuously for the whole experiment
+		instead of being reconfigured and triggered for every packet; see _capture_streaming.
+		In terminated mode the AD2 stops each record on the packet reception toggle; see _capture_terminated.
+
+		The state of the run is checkpointed every self.checkpoint_interval packets (see checkpoint.py).
+		If self.resume_from is set, the run goes on from that checkpoint, in its directory, instead
+		of starting a new one; side files (presses, telemetry, ...) and the run summary get the
+		timestamp of this session.
+
+		Returns the path to the data file (csv, or binary edge log if self.data_format is "bin")
 		"""
 		run_start_timestamp = time.clock()
-		experiment_start_time = time.strftime("%H_%M_%S_%m_%d_%Y", time.localtime())
-		print "starting dataset at {}\n".format(experiment_start_time)
-		data_file = experiment_directory + "/data_" + experiment_start_time + ".csv"
-		with open(data_file, 'a') as f:
-			f.write("Packet, Sample offset, Latency (ms), Sample, ack_missed=1\n")
+		run_start_wall_time = time.time()
+		session_start_time = time.strftime("%H_%M_%S_%m_%d_%Y", time.localtime())
+		if self.resume_from is not None:
+			experiment_directory = os.path.dirname(self.resume_from)
+			checkpoint = resume_checkpoint(self.resume_from, self.sampling_freq, self.data_format)
+			checkpoint.interval = self.checkpoint_interval
+			experiment_start_time = checkpoint.start_time
+			data_file = checkpoint.data_file
+			print "resuming dataset {} after packet {} (session {})\n".format(experiment_start_time, checkpoint.num_tries, checkpoint.num_sessions)
+		else:
+			experiment_start_time = session_start_time
+			print "starting dataset at {}\n".format(experiment_start_time)
+			if self.data_format == "bin":
+				data_file = experiment_directory + "/data_" + experiment_start_time + EDGE_LOG_EXTENSION
+				edge_log.write_header(data_file, self.sampling_freq, self.channel_map())
+			else:
+				data_file = experiment_directory + "/data_" + experiment_start_time + ".csv"
+				with open(data_file, 'a') as f:
+					f.write("Packet, Sample offset, Latency (ms), Sample, ack_missed=1\n")
+			checkpoint = RunCheckpoint(experiment_directory + "/checkpoint_" + experiment_start_time + ".json", data_file, experiment_start_time,
+				self.sampling_freq, self.data_format, self.checkpoint_interval)
+		# the checkpoint's sketch (saved to sketch_file) holds the latencies of the packets written so
+		# far, for the live quantiles and the stopping rule
+		sketch_file = experiment_directory + "/sketch_" + experiment_start_time + ".json"
 
 		##### EXPERIMENT SETUP #####
-		# sample for a max of 1.5 seconds
-		# approximate number of samples assuming ~500ms latency per packet
-		nSamples = (int) (1.5 * self.sampling_freq)
+		poller = DigitalInPoller(self.interface_handler, self.poll_interval)
 
-		#csamples, lost, corrupted
-		buffer_info = [0, 0, 0]
-
-		num_packets_received = 0
-		num_packets_missed = 0
-		num_acks_missed = 0
-
-		# array to hold indices of packets missed
-		packet_number_missed = []
-
-		# num_packets_received + num_packets_missed must equal num_tries
-		num_tries = 0
-
-		# ready for next button press if previous packet has been handled
-		# and if instruments, variables are configured for next packet
-		last_packet_handled = True
-		# keep track of if current packet has been received
-		packet_received = True
+		# sample for a max of 1.5 seconds (window_ceiling)
+		# approximate number of samples assuming ~500ms latency per packet
+		nSamples = (int) (self.window_ceiling * self.sampling_freq)
+		self._window = None
+		if self.adaptive_window:
+			self._window = AdaptiveWindow(self.sampling_freq, self.window_ceiling)
+			# the checkpoint keeps the history of the packets written; the window goes on from it
+			if checkpoint.window_history is None:
+				checkpoint.window_history = LatencySketch()
+			self._window.history.merge(checkpoint.window_history)
+
+		buffer_pool = None
+		if self.capture_mode == "streaming":
+			# host-side chunk the stream is read into; recycled for every read
+			streamChunk = (c_uint16 * self.stream_chunk_samples)()
+			segmenter = StreamSegmenter(self.button_press_mirror_bit, self.packet_created_bit, self.packet_received_bits, nSamples,
+				wait_for_all=self.one_to_many)
+
+			# DigitalIO and DigitalIn are configured once for the whole experiment
+			steady_state_DIO = self._configure_DigitalIO()
+			self._configure_DigitalIn_stream()
+		else:
+			self._accumulator = None
+			# capture buffers are allocated once and reused for every packet
+			if self.chunked_capture:
+				# no capture buffers: one chunk, recycled for every read
+				self._accumulator = EdgeAccumulator(self.stream_chunk_samples)
+			elif self.background_writer:
+				# one buffer being captured, one being written, the rest waiting in the writer queue
+				buffer_pool = CaptureBufferPool(nSamples, self.writer_queue_size + 2, shared=True)
+			elif self._window is not None:
+				# buffers start at the initial window and grow as packets need more of it
+				buffer_pool = CaptureBufferPool(self._window.initial, self.num_capture_buffers)
+			else:
+				buffer_pool = CaptureBufferPool(nSamples, self.num_capture_buffers)
+			# "trash" array to clear all buffer samples before starting button press
+			# this must be able to hold 4096 samples, 2 bytes each. its contents are never read
+			trashSamples = (c_uint16 * 4096)()
 
-		#keep track of previous packet acknowledgment
-		ack_missed = False
+		if self.hardware_press:
+			press_seed = self.press_seed
+			if press_seed is None:
+				press_seed = random.randint(0, (2 ** 32) - 1)
+			press_schedule = PressSchedule(press_seed)
+			press_log = PressLog(experiment_directory + "/presses_" + session_start_time + ".csv", press_seed, self.press_pulse_width)
+			self._stimulus = DigitalOutStimulus(dwf, self.interface_handler, self.button_press_pos, self.press_pulse_width)
+			self._stimulus.configure()
+			print "hardware-timed presses, schedule seed {}\n".format(press_seed)
+		num_presses = 0
+
+		telemetry = None
+		if self.telemetry:
+			telemetry = TelemetryLog(experiment_directory + "/telemetry_" + session_start_time + ".csv", self.sampling_freq, self.capture_mode, self.telemetry_interval)
+
+		receivers = None
+		if self.one_to_many:
+			receivers = ReceiverLog(experiment_directory + "/receivers_" + session_start_time + ".csv", self.packet_received_channels, self.period_ms)
+
+		watchdog = None
+		if self.watchdog:
+			watchdog = StallWatchdog(experiment_directory + "/recoveries_" + session_start_time + ".csv", self.stall_timeout, self.dio_read_timeout)
+		self._watchdog = watchdog
+
+		# packets pressed for so far; the packets written are counted by checkpoint, which goes on
+		# from its counts when resuming
+		num_tries = checkpoint.num_tries
+
+		writer = None
+		dump_pool = None
+		if self.background_writer and buffer_pool is not None:
+			# started before the writer thread, so the workers are forked from a single-threaded process
+			dump_pool = multiprocessing.Pool(self.dump_processes, _init_dump_worker, (buffer_pool.buffers,))
+
+		def write_capture(capture):
+			"""Writes capture to the data file and counts it; on the writer thread with the background writer."""
+			latency = self._postprocess_capture(capture, data_file, dump_pool, receivers)
+			window_samples = None
+			if self._window is not None:
+				window_samples = self._window.packet_samples(capture)
+			# the size right after the packet's lines, so a checkpoint never covers a packet it did not count
+			checkpoint.packet_written(capture, os.path.getsize(data_file), latency, window_samples)
+			self._print_quantiles(checkpoint.sketch)
+			# with the background writer, the packets still in its queue are captured past the stop
+			self._check_stopping_rule(checkpoint.sketch)
+			if checkpoint.save_due():
+				# without the stop reason: the packets captured before the stop may not all be written yet
+				checkpoint.save()
+		if self.background_writer:
+			writer = BackgroundWriter(write_capture, self.writer_queue_size)
+
+		reader = None
+		if self.capture_mode == "streaming":
+			stream = poller
+			if self.reader_thread:
+				# started last, so it is stopped (in the finally below) whatever happens from here on
+				reader = StreamReader(poller, self.reader_ring_samples, self.stream_chunk_samples)
+				stream = reader
 
 		##### END SETUP #####
 
@@ -329,128 +1253,811 @@ class AnalogDiscoveryUtils:
 		# runs for the duration of the experiment
 		#note: openmote toggles its pins every packet creation and reception
 
-		while num_tries < self.num_packets_experiment:
-			#print "initialize"
-			# initialize "trash" array to clear all buffer samples before starting button press
-			# this must be able to hold 4096 samples, 2 bytes each
-			wait = random.randint(0, 110)
-			time.sleep(wait * 0.001)
-			trashSamples = (c_uint16 * 4096)()
-
-			#clear buffer
-			buffer_info = self._copy_buffer_samples(buffer_info, nSamples, trashSamples, copy_all_samples=True)
-
-			# clear rgwSamples for next packet
-			rgwSamples = (c_uint16 * nSamples)()
-
-			# reset and configure DigitalIO
-			steady_state_DIO = self._configure_DigitalIO()
-
-			# reset and configure DigitalIn to take nSamples on trigger
-			# set DigitalIn trigger when button_press_mirror_bit channel is raised (this should start sampling)
-			self._configure_DigitalIn(nSamples, self.button_press_mirror_bit)
+		# a run the stopping rule ended stays stopped when resumed
+		self.stop_reason = checkpoint.stop_reason or self._stop_requested
+		try:
+			while num_tries < self.num_packets_experiment and self.stop_reason is None:
+				num_tries += 1
+				capture = PacketCapture(num_tries)
+
+				num_presses += 1
+				if self._stimulus is not None:
+					# the instrument waits before pressing; the host does not sleep
+					capture.press_wait = press_schedule.wait(num_presses)
+					capture.wait_requested = capture.press_wait
+					press_log.log(num_presses, num_tries, capture.press_wait)
+				else:
+					#print "initialize"
+					wait = random.randint(0, 110)
+					capture.wait_requested = wait * 0.001
+					capture.wait_start = monotonic()
+					time.sleep(wait * 0.001)
+					capture.wait_end = monotonic()
+
+				if telemetry is not None:
+					telemetry.start_packet(poller)
+				if self.capture_mode == "streaming":
+					self._capture_streaming(capture, poller, stream, segmenter, streamChunk, steady_state_DIO)
+				elif self.capture_mode == "terminated":
+					self._capture_terminated(capture, poller, nSamples, buffer_pool, trashSamples)
+				else:
+					self._capture_polled(capture, poller, nSamples, buffer_pool, trashSamples)
+				if telemetry is not None:
+					telemetry.end_packet(capture, poller)
+
+				if capture.broke_early:
+					num_tries -= 1
+					if watchdog is not None and capture.stall is not None:
+						if reader is not None:
+							# nothing may read the device while it is recovered
+							reader.close()
+						watchdog.recover(capture, lambda action: self._recover(action, poller))
+						if reader is not None:
+							reader = StreamReader(poller, self.reader_ring_samples, self.stream_chunk_samples)
+							stream = reader
+					continue
+				if watchdog is not None:
+					watchdog.capture_ok()
+				if self._window is not None:
+					self._window.record(capture)
+				if capture.buffer_info[1] or capture.buffer_info[2]:
+					print "packet {}: {} samples lost, {} corrupted".format(num_tries, capture.buffer_info[1], capture.buffer_info[2])
+
+				# reach here if packet was received OR if 1.5 million samples have been taken
+				if writer is not None:
+					writer.submit(capture)
+				else:
+					write_capture(capture)
+		finally:
+			if reader is not None:
+				reader.close()
+			# on KeyboardInterrupt too: everything already captured still gets written
+			if writer is not None:
+				writer.close()
+			if dump_pool is not None:
+				dump_pool.close()
+				dump_pool.join()
+
+			if self.capture_mode == "streaming":
+				# stop sampling
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+			if self._stimulus is not None:
+				self._stimulus.stop()
+				self._stimulus = None
+				press_log.close()
+			if telemetry is not None:
+				telemetry.close()
+			if watchdog is not None:
+				watchdog.close()
+			# everything captured is written by now. A run stop() ended (a daemon client, a shutdown)
+			# is not finished, so resuming it goes on
+			final_stop_reason = self.stop_reason
+			if self._stop_requested is not None and self.stop_reason == self._stop_requested:
+				final_stop_reason = None
+			checkpoint.save(final_stop_reason)
+			checkpoint.sketch.save(sketch_file)
 
-			ready_for_next_button_press = True
-			broke_early = False
+		run_end_timestamp = time.clock()
+		print "Done with experiment"
+		#print all packets sent, lost, total info
+		print "Number of tries: {}".format(checkpoint.num_tries)
+		print "Number of received packets: {}".format(checkpoint.num_packets_received)
+		print "Number of missed packets: {}".format(checkpoint.num_packets_missed)
+		if self.one_to_many:
+			print "Missed packets that reached some receivers: {}".format(checkpoint.num_packets_partial)
+		print
+		print "Total duration: {} seconds".format(run_end_timestamp - run_start_timestamp)
+		print "Checkpoints: {} written to {}".format(checkpoint.num_saved, checkpoint.path)
+		print poller.summary()
+		if reader is not None:
+			print reader.summary()
+		print "Samples lost: {}, corrupted: {}, in {} packets".format(checkpoint.num_samples_lost, checkpoint.num_samples_corrupted, len(checkpoint.packets_lost_samples))
+		if self.capture_mode == "streaming":
+			print "Stream: {} samples read, {} lost, {} corrupted\n".format(segmenter.stream_index - segmenter.stream_lost, segmenter.stream_lost, segmenter.stream_corrupted)
+		elif self._accumulator is not None:
+			print "Chunked capture: {} sample chunk\n".format(len(self._accumulator.chunk))
+		else:
+			print "Capture buffers: {} x {} samples allocated in {} seconds".format(buffer_pool.num_buffers, buffer_pool.num_samples, buffer_pool.alloc_time)
+			print "Capture buffers: {} samples re-zeroed in {} seconds\n".format(buffer_pool.samples_zeroed, buffer_pool.zero_time)
+		if writer is not None:
+			print "Background writer: {} captures handed off, {} ms average, {} ms max\n".format(writer.num_jobs, 1000.0 * writer.handoff_time / max(writer.num_jobs, 1), 1000.0 * writer.max_handoff_time)
+		print checkpoint.sketch.summary() + "\n"
+		if self.stop_reason is not None:
+			print "Stopped early: {}\n".format(self.stop_reason)
+		if watchdog is not None and watchdog.num_stalls:
+			watchdog_summary = watchdog.summary()
+			print "Stalls: {}, recoveries: {}, {:.1f} s of testbed time lost\n".format(
+				watchdog_summary["stalls"], watchdog_summary["recoveries"], watchdog_summary["testbed_time_lost_s"])
+		if receivers is not None:
+			for receiver in receivers.summary():
+				print "Receiver DIO {}: {} received, {} lost".format(receiver["channel"], receiver["num_packets_received"], receiver["num_packets_lost"])
+			print ""
+
+		self.run_summary = {
+			"data_file": data_file,
+			"start_time": experiment_start_time,
+			"session_start_time": session_start_time,
+			"checkpoint_file": checkpoint.path,
+			"resumed_from": self.resume_from,
+			"num_sessions": checkpoint.num_sessions,
+			"duration_s": time.time() - run_start_wall_time,
+			"capture_mode": self.capture_mode,
+			"sampling_freq": self.sampling_freq,
+			"num_tries": checkpoint.num_tries,
+			"num_packets_received": checkpoint.num_packets_received,
+			"num_packets_missed": checkpoint.num_packets_missed,
+			"num_packets_partial": checkpoint.num_packets_partial,
+			"num_acks_missed": checkpoint.num_acks_missed,
+			"packets_missed": checkpoint.packets_missed,
+			"num_samples_lost": checkpoint.num_samples_lost,
+			"num_samples_corrupted": checkpoint.num_samples_corrupted,
+			"packets_lost_samples": checkpoint.packets_lost_samples,
+			"reader_thread": reader is not None,
+			"sketch_file": sketch_file,
+			"latency_quantiles": checkpoint.sketch.quantiles(),
+			"stop_reason": self.stop_reason or "sent num_packets ({})".format(self.num_packets_experiment),
+		}
+		if self._window is not None:
+			self.run_summary["capture_window"] = self._window.summary()
+		if watchdog is not None:
+			self.run_summary["watchdog"] = watchdog.summary()
+		if telemetry is not None:
+			self.run_summary["telemetry"] = telemetry.summary()
+		if receivers is not None:
+			self.run_summary["receivers_file"] = receivers.path
+			self.run_summary["receivers"] = receivers.summary()
+		_write_json(experiment_directory + "/summary_" + session_start_time + ".json", self.run_summary)
+		return data_file
 
-			#print "begin acquisition {}".format(num_tries + 1)
-			prev_csamples, curr_csamples = 0, 0
+	def run_networks(self, experiment_directory, networks):
+		"""Runs the experiment on several networks at once, each on its own DIO channels.
+		One DigitalIn stream (as in streaming mode) records every network. Each network's button is
+		pressed on its own schedule, a random 0-110 ms after its previous packet ended, and a
+		StreamSegmenter per network finds its packets, looking only at that network's channels.
 
+		Every network gets its own data file, data_<time>_net<index>.csv (or .bin).
+		Postprocessing happens in the acquisition loop; the background writer, hardware-timed
+		presses and telemetry are not used.
 
-			# inner loop: runs from button press until packet received.
-			while buffer_info[0] < nSamples:
+		Returns the list of data file paths, in the order of networks.
+		"""
+		# a single window for all networks: nSamples as in run()
+		nSamples = (int) (1.5 * self.sampling_freq)
+		runs = [NetworkRun(i, network, nSamples) for i, network in enumerate(networks)]
 
-				# button press
-				if last_packet_handled and ready_for_next_button_press:
-					# we can send the next packet because the last packet was handled (received or understood to be missed)
-					# and instruments are configured
-					# button press -> set value on enabled AD2 output pins (digital_out_channels_bits)
-					# AD2 output is hard wired to button press input which triggers acquisition
+		used_bits = 0
+		for run in runs:
+			run_bits = run.bits_to_monitor | run.button_press_bit
+			assert used_bits & run_bits == 0, "networks must use disjoint DIO channels"
+			used_bits |= run_bits
 
-					#get current value of packet_received_pin; when packet is received this will toggle
-					curr_DIO = self._get_DIO_values()
-					packet_received_pins_state = curr_DIO & self.packet_received_bits
-					packet_created_pin_state = curr_DIO & self.packet_created_bit
+		run_start_wall_time = time.time()
+		experiment_start_time = time.strftime("%H_%M_%S_%m_%d_%Y", time.localtime())
+		print "starting dataset at {}\n".format(experiment_start_time)
+		for run in runs:
+			if self.data_format == "bin":
+				run.data_file = experiment_directory + "/data_" + experiment_start_time + "_net{}".format(run.index) + EDGE_LOG_EXTENSION
+				edge_log.write_header(run.data_file, self.sampling_freq, run.channel_map())
+			else:
+				run.data_file = experiment_directory + "/data_" + experiment_start_time + "_net{}".format(run.index) + ".csv"
+				with open(run.data_file, 'a') as f:
+					f.write("Packet, Sample offset, Latency (ms), Sample, ack_missed=1\n")
+			run.sketch_file = experiment_directory + "/sketch_" + experiment_start_time + "_net{}".format(run.index) + ".json"
+			if run.one_to_many:
+				run.receivers = ReceiverLog(experiment_directory + "/receivers_" + experiment_start_time + "_net{}".format(run.index) + ".csv",
+					run.network.output_channels[2:], self.period_ms)
 
-					last_packet_handled = False
-					ready_for_next_button_press = False
-					packet_received = False
-					ack_missed = False
+		##### EXPERIMENT SETUP #####
+		poller = DigitalInPoller(self.interface_handler, self.poll_interval)
+		streamChunk = (c_uint16 * self.stream_chunk_samples)()
+
+		# every channel that is not an output of some network is an AD output;
+		# all of them high except the button press channels
+		input_channels_bit_rep = 0
+		button_press_bits = 0
+		for run in runs:
+			input_channels_bit_rep |= run.bits_to_monitor
+			button_press_bits |= run.button_press_bit
+		dwf.FDwfDigitalIOReset()
+		dwf.FDwfDigitalIOOutputEnableSet(self.interface_handler, c_int(((2 ** 16) - 1) ^ input_channels_bit_rep))
+		steady_state_DIO = c_uint16(~button_press_bits)
+		dwf.FDwfDigitalIOOutputSet(self.interface_handler, steady_state_DIO)
+
+		self._configure_DigitalIn_stream()
+		stream = poller
+		reader = None
+		if self.reader_thread:
+			reader = StreamReader(poller, self.reader_ring_samples, self.stream_chunk_samples)
+			stream = reader
+
+		now = monotonic()
+		for run in runs:
+			run.next_press_time = now + random.randint(0, 110) * 0.001
+		##### END SETUP #####
 
-					# press the button. all other outputs go low.
-					dwf.FDwfDigitalIOOutputSet(self.interface_handler, c_uint16(self.button_press_bit))
-					#reset all enabled digital out channels back to steady state (all high except button press)
+		try:
+			poller.start_loop()
+			while not all(run.done() for run in runs):
+				count, lost, corrupted, state = stream.read_stream(streamChunk)
+				for run in runs:
+					run.segmenter.feed(streamChunk, count, lost, corrupted)
+
+				if state == DwfStateDone.value:
+					# the record ran out of samples; start a new one and retry the packets in progress
+					print "stream record done, re-arming"
+					stream.rearm(self._rearm_DigitalIn_stream)
+					for run in runs:
+						if run.segmenter.in_progress():
+							run.segmenter.abort()
+
+				if self._stop_requested is not None:
+					for run in runs:
+						if run.stop_reason is None:
+							run.stop_reason = self._stop_requested
+
+				now = monotonic()
+				press_bits = 0
+				for run in runs:
+					if run.capture is not None and not run.segmenter.in_progress():
+						self._finish_network_capture(run)
+						run.next_press_time = now + random.randint(0, 110) * 0.001
+
+					if run.capture is None and not run.done() and now >= run.next_press_time:
+						run.num_tries += 1
+						run.capture = PacketCapture(run.num_tries)
+						run.capture.press_time = now
+						run.segmenter.press()
+						press_bits |= run.button_press_bit
+
+				if press_bits:
+					# press the buttons of every network whose turn it is, then return to steady state
+					dwf.FDwfDigitalIOOutputSet(self.interface_handler, c_uint16(steady_state_DIO.value | press_bits))
 					dwf.FDwfDigitalIOOutputSet(self.interface_handler, steady_state_DIO)
-					
-					#print "button pressed"
-					num_tries += 1
-
-				# copy buffer samples to memory and flush
-				#print "Before: {}".format(buffer_info)
-				buffer_info = self._copy_buffer_samples(buffer_info, nSamples, rgwSamples)
-				#print "After: {}".format(buffer_info)
-				#buffer_flush_stop = time.clock()
-
-				curr_csamples = buffer_info[0]
-				if curr_csamples == prev_csamples:
-					print "broke early"
-					print buffer_info
-					num_tries -= 1
-					broke_early = True
-
-					# stop sampling
-					dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
-					break
 
-				# manually stop sampling once packet_received_bit is not equal to its pin state
-				curr_DIO = self._get_DIO_values()
-				if ((curr_DIO & self.packet_received_bits) != packet_received_pins_state):
-					#copy last buffer samples to memory
-					buffer_info = self._copy_buffer_samples(buffer_info, nSamples, rgwSamples, last_read=True)
+				poller.end_iteration()
+			poller.end_loop()
+		finally:
+			if reader is not None:
+				reader.close()
+			# stop sampling
+			dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+			for run in runs:
+				run.sketch.save(run.sketch_file)
 
-					# packet_received_bit toggled; stop sampling
-					dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
-
-					curr_DIO = self._get_DIO_values()
-					if not self.one_to_many:
-						if (curr_DIO & self.packet_created_bit) != packet_created_pin_state:
-							ack_missed = True
-							print("missed ack")
-
-					packet_received = True
-					num_packets_received += 1
-					#print "received packet {}".format(num_tries)
+		print "Done with experiment"
+		for run in runs:
+			print "Network {}: {} tries, {} received, {} missed".format(run.index, run.num_tries, run.num_packets_received, run.num_packets_missed)
+			print "Network {} {}".format(run.index, run.sketch.summary())
+		print poller.summary()
+		if reader is not None:
+			print reader.summary()
+		segmenter = runs[0].segmenter
+		print "Stream: {} samples read, {} lost, {} corrupted\n".format(segmenter.stream_index - segmenter.stream_lost, segmenter.stream_lost, segmenter.stream_corrupted)
+
+		self.run_summary = {
+			"start_time": experiment_start_time,
+			"duration_s": time.time() - run_start_wall_time,
+			"capture_mode": "streaming",
+			"sampling_freq": self.sampling_freq,
+			"reader_thread": reader is not None,
+			"networks": [{
+				"data_file": run.data_file,
+				"num_tries": run.num_tries,
+				"num_packets_received": run.num_packets_received,
+				"num_packets_missed": run.num_packets_missed,
+				"num_packets_partial": run.num_packets_partial,
+				"receivers": run.receivers.summary() if run.receivers is not None else None,
+				"sketch_file": run.sketch_file,
+				"latency_quantiles": run.sketch.quantiles(),
+				"stop_reason": run.stop_reason or "sent num_packets ({})".format(run.network.num_packets),
+			} for run in runs],
+		}
+		_write_json(experiment_directory + "/summary_" + experiment_start_time + ".json", self.run_summary)
+		return [run.data_file for run in runs]
+
+	def _finish_network_capture(self, run):
+		"""Records the packet run just finished (see run_networks)."""
+		capture, run.capture = run.capture, None
+		capture.detect_time = monotonic()
+		self._finish_stream_capture(capture, run.segmenter, run.one_to_many)
+		if capture.broke_early:
+			run.num_tries -= 1
+			return
+
+		if capture.received:
+			run.num_packets_received += 1
+		else:
+			run.num_packets_missed += 1
+			if capture.partial:
+				run.num_packets_partial += 1
+		self._postprocess_capture(capture, run.data_file, receivers=run.receivers, sketch=run.sketch)
+		if self.stopping_rule is not None and run.stop_reason is None:
+			run.stop_reason = self.stopping_rule.check(run.sketch)
+			if run.stop_reason is not None:
+				print "Network {} stopped early: {}".format(run.index, run.stop_reason)
+
+	def _press(self, capture, steady_state_DIO):
+		"""Starts the button press of capture: played out by the DigitalOut instrument after
+		capture.press_wait seconds with hardware-timed presses, otherwise pressed right away.
+		"""
+		capture.press_time = monotonic() + capture.press_wait
+		if self._stimulus is not None:
+			self._stimulus.press(capture.press_wait)
+		else:
+			self._press_button(steady_state_DIO)
+		capture.press_end = monotonic()
+
+	def _press_button(self, steady_state_DIO):
+		"""Presses the button: sets only the button press output high, then returns all outputs to steady state."""
+		# press the button. all other outputs go low.
+		dwf.FDwfDigitalIOOutputSet(self.interface_handler, c_uint16(self.button_press_bit))
+		#reset all enabled digital out channels back to steady state (all high except button press)
+		dwf.FDwfDigitalIOOutputSet(self.interface_handler, steady_state_DIO)
+
+	def _capture_polled(self, capture, poller, nSamples, buffer_pool, trashSamples):
+		"""Captures one packet by arming DigitalIn on the button press mirror and polling the
+		DIO pins until a packet_received_bits channel toggles (or nSamples have been taken).
+		With an adaptive window, the packet is given the window's samples instead of nSamples.
+		The samples are left in a buffer from buffer_pool (capture.samples).
+		"""
+		#clear buffer
+		buffer_info = self._copy_buffer_samples([0, 0, 0], nSamples, trashSamples, copy_all_samples=True)
+
+		# samples taken before the packet is missed; an adaptive window may extend it (see _extend_window)
+		window = nSamples
+		if self._window is not None:
+			window = self._window.start()
+			nSamples = self._window.ceiling
+
+		accumulator = self._accumulator
+		rgwSamples = None
+		if accumulator is not None:
+			accumulator.reset()
+		else:
+			# zeroed buffer for next packet
+			rgwSamples = buffer_pool.acquire()
+			capture.samples = rgwSamples
+			capture.buffer_pool = buffer_pool
+
+		# reset and configure DigitalIO
+		capture.reconfigure_start = monotonic()
+		steady_state_DIO = self._configure_DigitalIO()
+
+		# reset and configure DigitalIn to take nSamples on trigger
+		# set DigitalIn trigger when button_press_mirror_bit channel is raised (this should start sampling)
+		self._configure_DigitalIn(nSamples, self.button_press_mirror_bit)
+		capture.reconfigure_end = monotonic()
+
+		#print "begin acquisition {}".format(capture.attempt_number)
+		prev_csamples, curr_csamples = 0, 0
+		watchdog = self._watchdog
+
+		# button press -> set value on enabled AD2 output pins (digital_out_channels_bits)
+		# AD2 output is hard wired to button press input which triggers acquisition
+
+		#get current value of packet_received_pin; when packet is received this will toggle
+		curr_DIO = poller.get_DIO_values()
+		packet_received_pins_state = curr_DIO & self.packet_received_bits
+		packet_created_pin_state = curr_DIO & self.packet_created_bit
+		# one-to-many: reception channels seen toggled so far; sampling goes on until all of them have
+		toggled_bits = 0
+
+		self._press(capture, steady_state_DIO)
+		#print "button pressed"
+
+		# a hardware-timed press may not have happened yet; DigitalIn stays armed until it does
+		trigger_deadline = default_timer()
+		if self._stimulus is not None:
+			trigger_deadline += capture.press_wait + self.press_trigger_timeout
+
+		if watchdog is not None:
+			watchdog.start_capture()
+		# inner loop: runs from button press until packet received.
+		poller.start_loop()
+		while True:
+			if buffer_info[0] >= window:
+				window = self._extend_window(capture, window)
+				if window is None:
 					break
+				rgwSamples = capture.samples
 
-				prev_csamples = curr_csamples
-				# end of the inner loop
-
-			#set this so we can push button again
-			last_packet_handled = True
+			# copy buffer samples to memory and flush
+			#print "Before: {}".format(buffer_info)
+			if accumulator is not None:
+				poller.reduce_buffer_samples(buffer_info, window, accumulator)
+			else:
+				poller.copy_buffer_samples(buffer_info, window, rgwSamples, capture.lost_ranges)
+			#print "After: {}".format(buffer_info)
 
-			if broke_early:
+			curr_csamples = buffer_info[0]
+			if curr_csamples == 0 and poller.state() == DwfStateArmed.value and default_timer() < trigger_deadline:
+				# waiting for the scheduled press to trigger sampling
+				poller.end_iteration()
 				continue
-
-			# reach here if packet was received OR if 1.5 million samples have been taken
-			if packet_received == True:
-				self.postprocess(num_tries, ack_missed, buffer_info, rgwSamples, data_file)
-
+			if curr_csamples == prev_csamples:
+				if watchdog is not None and not watchdog.no_progress(curr_csamples):
+					# stalled only once no samples came for stall_timeout
+					poller.end_iteration()
+					continue
+				print "broke early"
+				print buffer_info
+				capture.broke_early = True
+				if curr_csamples == 0:
+					capture.stall = STALL_NO_TRIGGER
+				else:
+					capture.stall = STALL_NO_SAMPLES
+
+				# stop sampling
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+				break
+
+			# manually stop sampling once packet_received_bit is not equal to its pin state
+			curr_DIO = poller.get_DIO_values()
+			if watchdog is not None and watchdog.dio_timed_out(poller.last_dio_read_time):
+				print "DIO read took {:.1f} ms".format(1000.0 * poller.last_dio_read_time)
+				capture.broke_early = True
+				capture.stall = STALL_DIO_TIMEOUT
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+				break
+			if self.one_to_many:
+				toggled_bits |= (curr_DIO & self.packet_received_bits) ^ packet_received_pins_state
+				packet_done = toggled_bits == self.packet_received_bits
 			else:
-				# we took 1.5 million samples and supposedly missed the packet
-				num_packets_missed += 1
-				packet_number_missed.append(num_tries)
-				self.postprocess(num_tries, ack_missed, buffer_info, rgwSamples, data_file, missed_packet=True)
-				# set last_packet_handled to True to try button press again
-
-
-		run_end_timestamp = time.clock()
-		print "Done with experiment"
-		#print all packets sent, lost, total info
-		print "Number of tries: {}".format(num_tries)
-		print "Number of received packets: {}".format(num_packets_received)
-		print "Number of missed packets: {}\n".format(num_packets_missed)
-		print "Total duration: {} seconds".format(run_end_timestamp - run_start_timestamp)
-		return data_file
+				packet_done = (curr_DIO & self.packet_received_bits) != packet_received_pins_state
+			if packet_done:
+				#copy last buffer samples to memory
+				if accumulator is not None:
+					poller.reduce_buffer_samples(buffer_info, window, accumulator)
+				else:
+					poller.copy_buffer_samples(buffer_info, window, rgwSamples, capture.lost_ranges)
+
+				# packet_received_bit toggled; stop sampling
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+
+				curr_DIO = poller.get_DIO_values()
+				if not self.one_to_many:
+					if (curr_DIO & self.packet_created_bit) != packet_created_pin_state:
+						capture.ack_missed = True
+						print("missed ack")
+
+				capture.received = True
+				#print "received packet {}".format(capture.attempt_number)
+				break
+
+			prev_csamples = curr_csamples
+			poller.end_iteration()
+			# end of the inner loop
+		poller.end_loop()
+		capture.detect_time = monotonic()
+
+		if toggled_bits and not capture.broke_early:
+			# the window ended with some of the receivers still waiting; the others got the packet
+			capture.partial = True
+
+		capture.buffer_info = buffer_info
+		if capture.broke_early:
+			capture.release()
+			return
+		capture.num_valid = buffer_info[0]
+		# sampling is triggered by the mirror edge
+		capture.mirror_index = 0
+		if accumulator is not None:
+			# like a capture buffer, which reads 0 one past the last sample unless it is full
+			end = None
+			if buffer_info[0] < window:
+				end = buffer_info[0]
+			capture.edges = accumulator.edges(end)
+
+	def _capture_streaming(self, capture, poller, stream, segmenter, streamChunk, steady_state_DIO):
+		"""Captures one packet out of the continuous record started by _configure_DigitalIn_stream.
+		Presses the button, then reads the stream into streamChunk and lets segmenter find the
+		button press mirror edge and the packet reception edge. No instrument is reconfigured.
+		stream is poller, or the StreamReader draining it on a reader thread.
+		The edges of the packet are left in capture.edges.
+		"""
+		# read whatever accumulated since the last packet so the press edge is searched for in fresh samples
+		count, lost, corrupted, state = stream.read_stream(streamChunk)
+		segmenter.feed(streamChunk, count, lost, corrupted)
+		if state == DwfStateDone.value:
+			# the record ran out of samples since the last packet; a reader thread reports it only once
+			print "stream record done, re-arming"
+			stream.rearm(self._rearm_DigitalIn_stream)
+
+		if self._window is not None:
+			# the stream keeps no per-packet buffer, so the packet may take the whole limit at once
+			self._window.start()
+			segmenter.window = self._window.ceiling
+
+		segmenter.press()
+		self._press(capture, steady_state_DIO)
+		capture.stream_record = self._stream_records
+
+		watchdog = self._watchdog
+		if watchdog is not None:
+			watchdog.start_capture()
+		rearmed = False
+		poller.start_loop()
+		while segmenter.in_progress():
+			count, lost, corrupted, state = stream.read_stream(streamChunk)
+			segmenter.feed(streamChunk, count, lost, corrupted)
+
+			if state == DwfStateDone.value:
+				# the record ran out of samples; start a new one, and retry this packet if it was not done yet
+				print "stream record done, re-arming"
+				stream.rearm(self._rearm_DigitalIn_stream)
+				if segmenter.in_progress():
+					segmenter.abort()
+					rearmed = True
+			elif watchdog is not None and segmenter.in_progress() and watchdog.no_progress(segmenter.stream_index):
+				segmenter.abort()
+				capture.stall = STALL_NO_SAMPLES
+
+			poller.end_iteration()
+		poller.end_loop()
+		capture.detect_time = monotonic()
+		if segmenter.failed and capture.stall is None and not rearmed:
+			# the button press mirror edge never showed up
+			capture.stall = STALL_NO_TRIGGER
+
+		self._finish_stream_capture(capture, segmenter, self.one_to_many)
+
+	def _finish_stream_capture(self, capture, segmenter, one_to_many):
+		"""Fills capture in from a segmenter whose packet is no longer in progress."""
+		if segmenter.failed:
+			print "broke early"
+			capture.broke_early = True
+			return
+
+		capture.received = segmenter.received
+		if one_to_many and segmenter.toggled_bits != segmenter.received_bits:
+			# the window ended with some of the receivers still waiting
+			capture.partial = segmenter.received
+			capture.received = False
+		capture.ack_missed = segmenter.ack_missed
+		if capture.ack_missed and not one_to_many:
+			print("missed ack")
+		capture.buffer_info = [segmenter.packet_length(), segmenter.lost, segmenter.corrupted]
+		capture.edges = segmenter.packet_edges()
+		capture.mirror_index = segmenter.packet_start + 1
+
+	def _capture_terminated(self, capture, poller, nSamples, buffer_pool, trashSamples):
+		"""Captures one packet with a record that the AD2 stops by itself on the packet reception toggle
+		(see _configure_DigitalIn_terminated). The host never reads the DIO pins; it drains the record
+		until the instrument reports it done, or until nSamples (or an adaptive window's samples)
+		have been taken (missed packet).
+		The samples are left in a buffer from buffer_pool and the edges in capture.edges.
+		For a one-to-many network the host also reads the DIO pins, and stops the record once every
+		reception channel has toggled.
+		"""
+		#clear buffer
+		buffer_info = self._copy_buffer_samples([0, 0, 0], nSamples, trashSamples, copy_all_samples=True)
+
+		window = nSamples
+		if self._window is not None:
+			window = self._window.start()
+			nSamples = self._window.ceiling
+
+		accumulator = self._accumulator
+		rgwSamples = None
+		if accumulator is not None:
+			accumulator.reset()
+		else:
+			# zeroed buffer for next packet
+			rgwSamples = buffer_pool.acquire()
+			capture.samples = rgwSamples
+			capture.buffer_pool = buffer_pool
+
+		capture.reconfigure_start = monotonic()
+		steady_state_DIO = self._configure_DigitalIO()
+		self._configure_DigitalIn_terminated(nSamples)
+		capture.reconfigure_end = monotonic()
+
+		if self.one_to_many:
+			packet_received_pins_state = poller.get_DIO_values() & self.packet_received_bits
+			toggled_bits = 0
+
+		self._press(capture, steady_state_DIO)
+
+		watchdog = self._watchdog
+		if watchdog is not None:
+			watchdog.start_capture()
+		poller.start_loop()
+		while True:
+			if buffer_info[0] >= window:
+				window = self._extend_window(capture, window)
+				if window is None:
+					break
+				rgwSamples = capture.samples
+			if accumulator is not None:
+				poller.reduce_buffer_samples(buffer_info, window, accumulator)
+			else:
+				poller.copy_buffer_samples(buffer_info, window, rgwSamples, capture.lost_ranges)
+			if poller.state() == DwfStateDone.value:
+				break
+			if watchdog is not None and watchdog.no_progress(buffer_info[0]):
+				if buffer_info[0] == 0:
+					capture.stall = STALL_NO_TRIGGER
+				else:
+					capture.stall = STALL_NO_SAMPLES
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+				break
+			if self.one_to_many:
+				toggled_bits |= (poller.get_DIO_values() & self.packet_received_bits) ^ packet_received_pins_state
+				if toggled_bits == self.packet_received_bits:
+					if accumulator is not None:
+						poller.reduce_buffer_samples(buffer_info, window, accumulator)
+					else:
+						poller.copy_buffer_samples(buffer_info, window, rgwSamples, capture.lost_ranges)
+					dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+					break
+			poller.end_iteration()
+		poller.end_loop()
+		capture.detect_time = monotonic()
+
+		if buffer_info[0] >= nSamples:
+			# the record did not end within the window; stop sampling
+			dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+
+		capture.buffer_info = buffer_info
+		if accumulator is not None:
+			offsets, samples = accumulator.edges()
+			gaps = accumulator.gaps
+		else:
+			offsets, samples = extract_edges(rgwSamples, buffer_info[0] - 1)
+			offsets, samples, gaps = skip_lost_samples(offsets, samples, capture.lost_ranges, buffer_info[0] - 1)
+		self._find_packet_edges(capture, offsets, samples, gaps)
+		if capture.edges is None or capture.stall is not None:
+			print "broke early"
+			print buffer_info
+			capture.broke_early = True
+			if capture.stall is None:
+				# the record ended without a button press mirror edge
+				capture.stall = STALL_NO_TRIGGER
+			capture.release()
+		elif capture.ack_missed and not self.one_to_many:
+			print("missed ack")
+
+	def _recover(self, action, poller):
+		"""Carries out a StallWatchdog recovery action (see watchdog.py). Returns whether it succeeded."""
+		if action == RECOVERY_REARM:
+			if self.capture_mode == "streaming":
+				self._rearm_DigitalIn_stream()
+			else:
+				# the next capture arms DigitalIn again
+				dwf.FDwfDigitalInConfigure(self.interface_handler, c_bool(0), c_bool(0))
+			return True
+
+		if action == RECOVERY_REOPEN:
+			self.close_device()
+			print "Reopening device"
+			if not self._open_device(self.device_index):
+				return False
+			poller.interface_handler = self.interface_handler
+		else:
+			dwf.FDwfDigitalInReset(self.interface_handler)
+			dwf.FDwfDigitalIOReset(self.interface_handler)
+
+		# set up again what run() configures once
+		if self._stimulus is not None:
+			self._stimulus.interface_handler = self.interface_handler
+			self._stimulus.configure()
+		if self.capture_mode == "streaming":
+			self._configure_DigitalIO()
+			self._configure_DigitalIn_stream()
+		return True
+
+	def _extend_window(self, capture, window):
+		"""Extends the window of a packet that was not received within window samples, growing
+		capture's buffer to match. Returns the new window, or None if the packet is missed.
+		"""
+		if self._window is None:
+			return None
+		window = self._window.extend(window)
+		if window is not None and capture.samples is not None:
+			capture.samples = capture.buffer_pool.grow(capture.samples, window)
+		return window
+
+	def _find_packet_edges(self, capture, offsets, samples, gaps):
+		"""Finds the packet in a record that starts before the button press, from the edges
+		(offsets, samples) of the record, as returned by extract_edges without the lost samples
+		(see skip_lost_samples), and the gaps of the lost samples.
+		The packet starts at the sample before the first button press mirror rising edge and ends at
+		the first sample where a packet_received_bits channel differs from its state at the start
+		(received), or at the end of the record (missed). A one-to-many packet ends at the first
+		sample by which every packet_received_bits channel has differed, or at the end of the record.
+		Sets capture.received, capture.ack_missed and capture.edges, with offsets relative to the
+		start of the packet; capture.edges stays None if there is no mirror edge.
+		A packet whose reception edge comes right after lost samples was received somewhere within
+		them; the lost samples are counted as corrupted in capture.buffer_info.
+		"""
+		mirror_high = np.flatnonzero(samples & self.button_press_mirror_bit)
+		if len(mirror_high) == 0 or offsets[mirror_high[0]] == 0:
+			return
+
+		first = int(mirror_high[0])
+		start = int(offsets[first]) - 1
+		capture.mirror_index = start + 1
+		# the state at the start is the one set by the edge before the mirror edge
+		start_sample = 0
+		if first > 0:
+			start_sample = int(samples[first - 1])
+		differs = (samples[first:] ^ start_sample) & self.packet_received_bits
+		toggled = np.flatnonzero(differs)
+		# edges [first, last) belong to the packet
+		last = len(offsets)
+		if len(toggled) > 0:
+			last = first + int(toggled[0]) + 1
+			capture.received = True
+			capture.ack_missed = ((int(samples[last - 1]) ^ start_sample) & self.packet_created_bit) != 0
+			if self.one_to_many:
+				all_toggled = np.flatnonzero(np.bitwise_or.accumulate(differs) == self.packet_received_bits)
+				if len(all_toggled) > 0:
+					last = first + int(all_toggled[0]) + 1
+				else:
+					# the record ended with some of the receivers still waiting
+					last = len(offsets)
+					capture.received = False
+					capture.partial = True
+			reception = int(offsets[last - 1])
+			if reception in gaps:
+				print "packet {}: received within {} lost samples".format(capture.attempt_number, gaps[reception])
+				capture.buffer_info[2] += gaps[reception]
+
+		packet_offsets = offsets[first:last] - start
+		packet_samples = samples[first:last]
+		# the sample before the start is taken to be 0, so the start is always the first edge
+		if start_sample != 0:
+			packet_offsets = np.concatenate([[0], packet_offsets])
+			packet_samples = np.concatenate([np.array([start_sample], dtype=np.uint16), packet_samples])
+		capture.edges = (packet_offsets, packet_samples)
+
+	def _postprocess_capture(self, capture, data_file, dump_pool=None, receivers=None, sketch=None):
+		"""Writes the edges of a finished capture to data_file and releases its buffer.
+		If dump_pool is given, the edges of a missed packet's (full length) buffer are
+		extracted by one of its worker processes.
+		If receivers (a ReceiverLog) is given, the first edge of every receiver is logged to it.
+		If sketch (a LatencySketch) is given, the packet's latency is added to it.
+		Returns the latency (ms) of the packet's last edge.
+		"""
+		missed_packet = not capture.received
+		if missed_packet and dump_pool is not None and capture.edges is None:
+			buffer_index = capture.buffer_pool.index(capture.samples)
+			offsets, samples = dump_pool.apply(_extract_shared_edges, (buffer_index, capture.buffer_info[0]))
+			capture.edges = skip_lost_samples(offsets, samples, capture.lost_ranges, capture.buffer_info[0])[:2]
+		if capture.edges is None and (capture.lost_ranges or receivers is not None):
+			offsets, samples = extract_edges(capture.samples, capture.buffer_info[0])
+			capture.edges = skip_lost_samples(offsets, samples, capture.lost_ranges, capture.buffer_info[0])[:2]
+		if receivers is not None:
+			receivers.log(capture.attempt_number, capture.edges[0], capture.edges[1], capture.num_valid)
+
+		if capture.edges is None:
+			latency = self.postprocess(capture.attempt_number, capture.ack_missed, capture.buffer_info, capture.samples, data_file, missed_packet=missed_packet)
+		else:
+			offsets, samples = capture.edges
+			latency = self._record_edges(capture.attempt_number, capture.ack_missed, offsets, samples, data_file, missed_packet=missed_packet)
+		capture.release()
+
+		if sketch is not None:
+			if missed_packet:
+				sketch.add_missed()
+			else:
+				sketch.add(latency)
+			self._print_quantiles(sketch)
+		if self.packet_listener is not None:
+			self.packet_listener(data_file, capture, latency)
+		return latency
+
+	def _print_quantiles(self, sketch):
+		"""Prints the quantiles of sketch every quantile_interval packets."""
+		if self.quantile_interval > 0 and (sketch.count + sketch.num_missed) % self.quantile_interval == 0:
+			print sketch.summary()
+
+	def _check_stopping_rule(self, sketch):
+		"""Sets self.stop_reason once self.stopping_rule is met by sketch, or stop() was called."""
+		if self.stop_reason is None and self._stop_requested is not None:
+			self.stop_reason = self._stop_requested
+		if self.stopping_rule is not None and self.stop_reason is None:
+			self.stop_reason = self.stopping_rule.check(sketch)
 
 	def postprocess(self, attempt_number, ack_missed, buffer_info, data, data_file, missed_packet=False):
 		"""Only write a sample to the data file if any of the DIO bits change.
@@ -461,58 +2068,65 @@ class AnalogDiscoveryUtils:
 		If test harness thinks it's a missed packet, we still postprocess and write all the samples to the buffer for later analysis.
 		In order for the data processing script to discern packets that the test harness thinks are missed:
 			instead of writing attempt_number in the first column, we write -attempt_number.
+
+		Returns the latency (ms) of the last edge.
 		"""
 		#print "postprocessing {}".format(packet_number)
 
+		# find every sample that differs from the one before it in one vectorized pass
+		offsets, samples = extract_edges(data, buffer_info[0])
+		latency = self._record_edges(attempt_number, ack_missed, offsets, samples, data_file, missed_packet=missed_packet)
+
+		if buffer_info[0] < len(data) and latency == 4.096:
+			print "only took 4096 samples?"
+		#print "cSamples: {}, cLost: {}, cCorrupted: {}".format(buffer_info[0], buffer_info[1], buffer_info[2])
+		return latency
+
+	def _record_edges(self, attempt_number, ack_missed, offsets, samples, data_file, missed_packet=False):
+		"""Writes the edges of one packet to data_file (see postprocess for the format).
+		Returns the latency (ms) of the last edge.
+		"""
 		pp_start = time.clock()
 		if missed_packet:
 			print "supposedly missed packet {}".format(attempt_number)
 			attempt_number = -1 * attempt_number
 
-		with open(data_file, 'a') as f:
-			# postprocessing
-			index, prev_sample, latency = 0, 0, 0
-			for sample in data:
-				if (index > buffer_info[0]):
-					# we want to check every sample if test harness thinks packet was missed
-					if latency == 4.096:
-						print "only took 4096 samples?"
-					break
-
-				if ((prev_sample ^ sample) != 0):
-					# if sample is zero something wrong happened when reading from the buffer
-
-				#if ((prev_sample ^ sample) & self.bits_to_monitor) != 0:
-					# one or more of the bits to monitor have changed
-
-					#TODO: add check to see if sample is weird. every output bit other than button press must always be high.
-					#sample_output_str = str(get_bit(sample, self.packet_received_pos))
-					#sample_output_str += str(get_bit(sample, self.packet_created_pos))
-					#sample_output_str += str(get_bit(sample,  self.button_press_mirror_pos))
-					sample_output_str = binary_num_str(sample, split=True)
-					#print sample_output_str
-					latency = index * self.period_ms
-					pkt_ack_missed_code = 0
-
-					if ack_missed:
-						pkt_ack_missed_code = 1
-
-
-					f.write("{}, {}, {}, {}, {}\n".format(attempt_number, index, latency, sample_output_str, pkt_ack_missed_code))
-
-				index += 1
-				prev_sample = sample
+		latency = self._write_edges(attempt_number, ack_missed, offsets, samples, data_file)
 
 		pp_stop = time.clock()
 		if missed_packet:
 			print "postprocessing took {} seconds".format(pp_stop - pp_start)
 		else:		
 			print "{}  {}".format(attempt_number, latency)
-		#print "cSamples: {}, cLost: {}, cCorrupted: {}".format(buffer_info[0], buffer_info[1], buffer_info[2])
-		#print "took {} samples for packet {}".format(index, packet_number)
 		#print "postprocessing took {} seconds".format(pp_stop - pp_start)
 		#print "\n"
-		return
+		return latency
+
+	def _write_edges(self, attempt_number, ack_missed, offsets, samples, data_file):
+		"""Appends one line per edge to data_file.
+		offsets and samples are the parallel arrays returned by extract_edges.
+
+		Returns the latency (ms) of the last edge written, 0 if there were none.
+		"""
+		if data_file.endswith(EDGE_LOG_EXTENSION):
+			edge_log.append_edges(data_file, attempt_number, ack_missed, offsets, samples)
+			if len(offsets) == 0:
+				return 0
+			return int(offsets[-1]) * self.period_ms
+
+		pkt_ack_missed_code = 0
+		if ack_missed:
+			pkt_ack_missed_code = 1
+
+		latency = 0
+		lines = []
+		for index, sample in zip(offsets.tolist(), samples.tolist()):
+			latency = index * self.period_ms
+			lines.append("{}, {}, {}, {}, {}\n".format(attempt_number, index, latency, binary_num_str(sample, split=True), pkt_ack_missed_code))
+
+		with open(data_file, 'a') as f:
+			f.writelines(lines)
+		return latency
 
 	def test(self):
 		"""Miscellaneous testing."""
@@ -569,6 +2183,117 @@ def concatenate_bits(num, bit_mask):
 		out = (out << 1) | bit
 	return out
 
+def extract_edges(data, num_samples):
+	"""Finds every sample in data[0:num_samples + 1] that differs from the sample before it.
+	The sample before index 0 is taken to be 0, so a nonzero first sample is always an edge.
+
+	data may be a ctypes array; it is viewed in place, not copied.
+	Like the original per-sample loop, the sample one past the last written sample is included
+	(when it exists) so the end of the capture shows up as a final edge.
+
+	Returns (offsets, samples): two numpy arrays, the sample offset of each edge and its value.
+	"""
+	view = np.ctypeslib.as_array(data)[:num_samples + 1]
+	changed = np.empty(len(view), dtype=bool)
+	if len(view) > 0:
+		changed[0] = view[0] != 0
+		np.not_equal(view[1:], view[:-1], out=changed[1:])
+	offsets = np.flatnonzero(changed)
+	return offsets, view[offsets]
+
+def skip_lost_samples(offsets, samples, lost_ranges, num_samples):
+	"""Removes, from the edges extract_edges(data, num_samples) found in a capture buffer, the edges
+	of the zeros the buffer holds where the device lost samples: the state before each lost range is
+	carried across it instead, the way EdgeAccumulator skips lost samples.
+	lost_ranges: (start, end) of every range of lost samples, in order.
+
+	Returns (offsets, samples, gaps). gaps maps the offset of every edge right after a lost range to
+	the number of samples lost before it: the change it shows happened somewhere within them.
+	"""
+	gaps = {}
+	if not lost_ranges:
+		return offsets, samples, gaps
+
+	keep = np.ones(len(offsets), dtype=bool)
+	added_offsets, added_samples = [], []
+	for start, end in lost_ranges:
+		first = np.searchsorted(offsets, start)
+		after = np.searchsorted(offsets, end)
+		# the state before the range: the last edge kept before it, or added after an earlier range
+		kept = np.flatnonzero(keep[:first])
+		before = 0
+		if len(kept) > 0:
+			before = int(samples[kept[-1]])
+		if added_offsets and (len(kept) == 0 or added_offsets[-1] > offsets[kept[-1]]):
+			before = added_samples[-1]
+		keep[first:after] = False
+		if end > num_samples:
+			# nothing was sampled after the range
+			continue
+		if after < len(offsets) and offsets[after] == end:
+			sample = int(samples[after])
+			keep[after] = sample != before
+		else:
+			# the sample after the range is still 0, like the ones the range left in the buffer
+			sample = 0
+			if before != 0:
+				added_offsets.append(end)
+				added_samples.append(0)
+		if sample != before:
+			gaps[end] = end - start
+
+	offsets = offsets[keep]
+	samples = samples[keep]
+	if added_offsets:
+		offsets = np.concatenate([offsets, np.array(added_offsets, dtype=offsets.dtype)])
+		samples = np.concatenate([samples, np.array(added_samples, dtype=samples.dtype)])
+		order = np.argsort(offsets, kind="mergesort")
+		offsets, samples = offsets[order], samples[order]
+	return offsets, samples, gaps
+
+def receiver_first_edges(offsets, samples, channels, end=None):
+	"""Finds, in the edges of one packet (as returned by extract_edges, with the lost samples
+	skipped by skip_lost_samples), the first edge of every channel in channels: the first edge
+	where the channel differs from its state in the first edge. Edges at or past end (the number
+	of samples taken, if the edges come from a capture buffer holding zeros after them) are left
+	out. All channels are looked at in one pass over an edges x channels bit matrix.
+
+	Returns a numpy array with the sample offset of each channel's first edge, -1 if it never toggled.
+	"""
+	first_edges = np.full(len(channels), -1, dtype=np.int64)
+	if end is not None:
+		valid = np.asarray(offsets) < end
+		offsets, samples = np.asarray(offsets)[valid], np.asarray(samples)[valid]
+	if len(offsets) == 0:
+		return first_edges
+	bits = (np.asarray(samples, dtype=np.int64)[:, np.newaxis] >> np.array(channels, dtype=np.int64)) & 1
+	toggled = bits != bits[0]
+	got = toggled.any(axis=0)
+	first_edges[got] = np.asarray(offsets)[toggled.argmax(axis=0)[got]]
+	return first_edges
+
+def _bind_dwf_function(name, argtypes):
+	"""Looks up a dwf function as a new function object with argtypes set.
+	The attribute (dwf.name) used everywhere else is left untouched.
+	"""
+	function = dwf[name]
+	function.argtypes = argtypes
+	return function
+
+# capture buffers shared with the missed-packet worker processes
+_shared_capture_buffers = None
+
+def _init_dump_worker(buffers):
+	"""Initializer of the worker processes that extract edges from missed-packet dumps."""
+	global _shared_capture_buffers
+	_shared_capture_buffers = buffers
+	# KeyboardInterrupt is handled by the acquisition process, which drains the workers
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _extract_shared_edges(buffer_index, num_samples):
+	"""extract_edges on a shared capture buffer, run in a worker process."""
+	return extract_edges(_shared_capture_buffers[buffer_index], num_samples)
+
 def binary_num_str(num, split=True):
 	"""returns a string of num in binary form in chunks of 4.
 	Makes it easier to read.
@@ -583,6 +2308,35 @@ def binary_num_str(num, split=True):
 		output_str += "{} ".format(chunk)
 	return output_str
 
+def load_dwf():
+	"""Loads the WaveForms runtime (libdwf) for this platform."""
+	if sys.platform.startswith("win"):
+		return cdll.dwf
+	elif sys.platform.startswith("darwin"):
+		return cdll.LoadLibrary("/Library/Frameworks/dwf.framework/dwf")
+	else:
+		return cdll.LoadLibrary("libdwf.so")
+
+def enumerate_devices():
+	"""Returns a dict (index, name, serial, in_use) for every device connected to this host."""
+	num_devices = c_int()
+	dwf.FDwfEnum(enumfilterAll, byref(num_devices))
+
+	devices = []
+	for index in range(num_devices.value):
+		name = create_string_buffer(32)
+		serial = create_string_buffer(32)
+		in_use = c_int()
+		dwf.FDwfEnumDeviceName(c_int(index), name)
+		dwf.FDwfEnumSN(c_int(index), serial)
+		dwf.FDwfEnumDeviceIsOpened(c_int(index), byref(in_use))
+		devices.append({"index": index, "name": name.value, "serial": serial.value, "in_use": bool(in_use.value)})
+	return devices
+
+def _write_json(path, obj):
+	with open(path, "w") as f:
+		json.dump(obj, f, indent=2, sort_keys=True)
+
 def initialize_network(network_output_channels, network_input_channels, num_packets_to_send):
 	""" Initializes a network. """
 	assert len(network_input_channels) == 1
@@ -598,51 +2352,155 @@ def initialize_network(network_output_channels, network_input_channels, num_pack
 	list_of_networks.append(network)
 	return
 
-if __name__ == "__main__":
-	### Parse input to initialize variables ###
-
-	#TODO: use argparse/optparse to make this nice
-
-	"""
+def argument_parser():
+	"""The command line parser of acq.py; its options are applied by apply_options."""
 	file_input_format_info = "Input file format:\n"
 	file_input_format_info += "[button press mirror channel], [packet creation channel], [packet reception channel 1] ... [packet reception channel n]\n"
 	file_input_format_info += "[button press channel]\n"
 	file_input_format_info += "[number of packets to send]\n"
 	file_input_format_info += "[sampling frequency]\n\n"
-	"""
 
-	assert len(sys.argv) == 2
+	parser = argparse.ArgumentParser(epilog=file_input_format_info, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("input_files", nargs="+", metavar="input_file",
+		help="experiment parameter file, e.g. acq_experiment_inputs.txt; one per network")
+	capture_mode = parser.add_mutually_exclusive_group()
+	capture_mode.add_argument("--streaming", action="store_const", dest="capture_mode", const="streaming", default="polled",
+		help="keep one DigitalIn record running for the whole experiment and split packets on the host")
+	capture_mode.add_argument("--hardware-stop", action="store_const", dest="capture_mode", const="terminated",
+		help="let the AD2 end each record on the packet reception toggle instead of polling the DIO pins")
+	parser.add_argument("--reader-thread", action="store_true",
+		help="with --streaming or --concurrent, drain the AD2 buffer into a ring buffer on a thread of its own")
+	parser.add_argument("--background-writer", action="store_true",
+		help="postprocess and write packets on a worker thread instead of before the next button press")
+	parser.add_argument("--poll-interval", type=float, default=0,
+		help="milliseconds to sleep between polls of the device (default: poll continuously)")
+	parser.add_argument("--binary", action="store_true",
+		help="write the raw data as a binary edge log (data_*.bin) instead of a csv")
+	parser.add_argument("--hardware-press", action="store_true",
+		help="play the button presses out on the DigitalOut instrument from a seeded schedule (see stimulus.py)")
+	parser.add_argument("--press-seed", type=int,
+		help="seed of the hardware press schedule (default: random, recorded in presses_*.csv)")
+	parser.add_argument("--telemetry", action="store_true",
+		help="write per-packet poll loop telemetry and host press timestamps to telemetry_*.csv next to the data file (see telemetry.py)")
+	parser.add_argument("--telemetry-interval", type=float, default=0,
+		help="seconds between telemetry summaries on the console (default: none)")
+	parser.add_argument("--quantile-interval", type=int, default=0,
+		help="print live latency p50/p90/p99/p99.9 and PDR every this many packets (default: never)")
+	parser.add_argument("--chunked", action="store_true",
+		help="reduce every chunk read off the device to edges right away instead of keeping a buffer per packet")
+	parser.add_argument("--adaptive-window", action="store_true",
+		help="size each packet's capture window from the latencies so far and extend it as needed (see capture_window.py)")
+	parser.add_argument("--window-ceiling", type=float, default=1.5,
+		help="seconds a packet may take before it is missed (default: 1.5)")
+	parser.add_argument("--stop-quantile", type=float,
+		help="end the experiment early once this latency quantile (e.g. 0.99) has converged (see --stop-width)")
+	parser.add_argument("--stop-width", type=float, default=1.0,
+		help="confidence interval width (ms) at which the --stop-quantile has converged (default: 1)")
+	parser.add_argument("--stop-confidence", type=float, default=0.95,
+		help="confidence level of that interval (default: 0.95)")
+	parser.add_argument("--stop-min-packets", type=int, default=100,
+		help="packets received before the experiment may stop early (default: 100)")
+	parser.add_argument("--watchdog", action="store_true",
+		help="recover the device from stalled captures instead of only retrying them (see watchdog.py)")
+	parser.add_argument("--stall-timeout", type=float, default=0.5,
+		help="seconds without new samples before a capture has stalled (default: 0.5)")
+	parser.add_argument("--checkpoint-interval", type=int, default=100,
+		help="packets between checkpoints of the run state, checkpoint_*.json (default: 100)")
+	parser.add_argument("--resume", metavar="CHECKPOINT",
+		help="go on with the interrupted run of this checkpoint, in its folder (see checkpoint.py)")
+	parser.add_argument("--simulate", action="store_true",
+		help="run against a simulated AD2 and network (fake_dwf.py) instead of libdwf")
+	parser.add_argument("--record-trace", metavar="TRACE",
+		help="log every dwf call of the run to this trace file (see dwf_trace.py)")
+	parser.add_argument("--replay-trace", metavar="TRACE",
+		help="replay a trace recorded with --record-trace instead of using libdwf; pass the options of the recorded run")
+	parser.add_argument("--concurrent", action="store_true",
+		help="capture every network (input file) at once in one DigitalIn stream instead of one after another")
+	return parser
+
+def apply_options(ad_utils, args):
+	"""Sets the attributes of ad_utils (an AnalogDiscoveryUtils) from the options parsed by argument_parser."""
+	ad_utils.capture_mode = args.capture_mode
+	ad_utils.background_writer = args.background_writer
+	ad_utils.reader_thread = args.reader_thread
+	ad_utils.poll_interval = args.poll_interval * 0.001
+	if args.binary:
+		ad_utils.data_format = "bin"
+	ad_utils.hardware_press = args.hardware_press
+	ad_utils.press_seed = args.press_seed
+	ad_utils.telemetry = args.telemetry or args.telemetry_interval > 0
+	ad_utils.telemetry_interval = args.telemetry_interval
+	ad_utils.quantile_interval = args.quantile_interval
+	ad_utils.chunked_capture = args.chunked
+	ad_utils.adaptive_window = args.adaptive_window
+	ad_utils.window_ceiling = args.window_ceiling
+	ad_utils.watchdog = args.watchdog
+	ad_utils.stall_timeout = args.stall_timeout
+	ad_utils.checkpoint_interval = args.checkpoint_interval
+	ad_utils.resume_from = args.resume
+	if args.stop_quantile is not None:
+		ad_utils.stopping_rule = QuantileStoppingRule(args.stop_quantile, args.stop_width, args.stop_confidence, args.stop_min_packets)
+
+if __name__ == "__main__":
+	### Parse input to initialize variables ###
+
+	parser = argument_parser()
+	args = parser.parse_args()
+	if args.resume and (args.concurrent or len(args.input_files) > 1):
+		parser.error("--resume goes on with a single run: one input file, without --concurrent")
 
 	### set up parameters to feed into experiment
-	experiment_parameter_input_file = sys.argv[1]
-
-	with open(experiment_parameter_input_file) as file:
-		params = file.readlines()
-	#remove whitespace characters in each line
-	params = [x.strip() for x in params]
-	#convert string of comma separated ints to list of ints
-	params = [[int(i) for i in line.split(", ")] for line in params]
+	network_params = []
+	for experiment_parameter_input_file in args.input_files:
+		with open(experiment_parameter_input_file) as file:
+			params = file.readlines()
+		#remove whitespace characters in each line
+		params = [x.strip() for x in params]
+		#convert string of comma separated ints to list of ints
+		params = [[int(i) for i in line.split(", ")] for line in params]
+		network_params.append(params)
+	# the sampling frequency is per device
+	assert len(set(params[3][0] for params in network_params)) == 1, "every input file must have the same sampling frequency"
 	###
 
 
 	### set up dwf library to interface with AD2
-	if sys.platform.startswith("win"):
-		dwf = cdll.dwf
-	elif sys.platform.startswith("darwin"):
-		dwf = cdll.LoadLibrary("/Library/Frameworks/dwf.framework/dwf")
+	if args.replay_trace:
+		import dwf_trace
+		dwf = dwf_trace.ReplayDwf(args.replay_trace)
+	elif args.simulate:
+		import fake_dwf
+		simulated_networks = []
+		for experiment_parameter_input_file in args.input_files:
+			simulated_networks += fake_dwf.networks_from_inputs(experiment_parameter_input_file)
+		dwf = fake_dwf.FakeDwf(simulated_networks)
 	else:
-		dwf = cdll.LoadLibrary("libdwf.so")
+		dwf = load_dwf()
 
 	# print DWF version
-	version = create_string_buffer(16)
-	dwf.FDwfGetVersion(version)
-	print "DWF Version: " + version.value
+	if args.replay_trace:
+		dwf_version = "replay of " + args.replay_trace
+	else:
+		version = create_string_buffer(16)
+		dwf.FDwfGetVersion(version)
+		dwf_version = version.value
+	print "DWF Version: " + dwf_version
+
+	# the trace starts with the device being opened, so bench_acq.py can replay it too
+	if args.record_trace:
+		import dwf_trace
+		dwf = dwf_trace.RecordingDwf(dwf, args.record_trace)
+		dwf.note({"args": vars(args), "network_params": network_params, "dwf_version": dwf_version})
 	###
 
 
 	# experiment bookkeeping 
-	experiment_name = raw_input("Enter a one-string title for this experiment: ")
-	exp_dir = 'data/' + experiment_name
+	if args.resume:
+		# a resumed run goes on in the folder of its checkpoint
+		exp_dir = os.path.dirname(args.resume)
+	else:
+		experiment_name = raw_input("Enter a one-string title for this experiment: ")
+		exp_dir = 'data/' + experiment_name
 	experiment_comments = raw_input("Comments/notes: ")
 
 	try:
@@ -657,23 +2515,31 @@ if __name__ == "__main__":
 
 
 
-	initialize_network(params[0], params[1], params[2][0])
+	for params in network_params:
+		initialize_network(params[0], params[1], params[2][0])
 
-	sampling_freq_user_input = params[3][0]
+	sampling_freq_user_input = network_params[0][3][0]
 	ad_utils = AnalogDiscoveryUtils(sampling_freq_user_input)
+	apply_options(ad_utils, args)
 	ad_utils.open_device()
 
 	try:
-		for network in list_of_networks:
-			ad_utils.add_network(network)
-			experiment_datafile = ad_utils.run(exp_dir)
-			#ad_utils.test()
+		if args.concurrent:
+			experiment_datafiles = ad_utils.run_networks(exp_dir, list_of_networks)
+		else:
+			for network in list_of_networks:
+				ad_utils.add_network(network)
+				experiment_datafile = ad_utils.run(exp_dir)
+				#ad_utils.test()
 	except KeyboardInterrupt:
 		dwf.FDwfDigitalIOReset(ad_utils.interface_handler)
 		ad_utils.close_device()
 		sys.exit(1)
-
-	ad_utils.close_device()
+	else:
+		ad_utils.close_device()
+	finally:
+		if args.record_trace:
+			dwf.close()
 
 	#process_data_command = 'python process_data.py ' + experiment_datafile + ' ' + exp_dir + '/' + experiment_name
 	#os.system(process_data_command)
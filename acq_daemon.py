@@ -0,0 +1,445 @@
+"""
+	Long-lived acquisition daemon with a local control socket.
+
+	Every acq.py invocation loads libdwf, opens the AD2 and configures it from scratch, and holds
+	the device until it exits. acq_daemon.py opens the device once and keeps it open. Clients
+	start, stop and query experiments through a Unix domain socket, and can watch the packets of
+	the running experiment as they are written. One experiment runs at a time.
+
+	The protocol is one JSON object per line, each way. Every response has "ok", and "error" when
+	it is false. Requests:
+
+		{"command": "status"}                    state ("idle", "running" or "stopping"), the running
+		                                         experiment with its packet counts and latency
+		                                         quantiles so far, and the experiments run before
+		{"command": "start", "experiment": {...}} starts an experiment, given as in a queue_runner.py
+		                                         plan (input files relative to the daemon's directory)
+		{"command": "stop"}                      ends the running experiment as if it had stopped early
+		{"command": "watch", "since": N}         streams events until the client disconnects:
+		                                         "started", "packet" and "finished". Each event has a
+		                                         sequence number "seq". Events after seq N come first
+		                                         (default: only new ones)
+		{"command": "shutdown"}                  stops the running experiment, closes the device and exits
+
+	Experiments write into <data directory>/<experiment name>/ as they do with queue_runner.py.
+	The client commands below send one request each. The daemon needs AF_UNIX sockets, so it does
+	not run on Windows.
+
+	Usage:
+		python acq_daemon.py serve [--socket PATH] [--data-dir DIR] [--device SERIAL] [--simulate]
+		python acq_daemon.py start [experiment file]
+		python acq_daemon.py status | stop | shutdown
+		python acq_daemon.py watch [--since N]
+"""
+
+from sketch import LatencySketch
+import acq
+import argparse
+import collections
+import errno
+import json
+import os
+import queue_runner
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_SOCKET = "/tmp/acq_daemon.sock"
+
+class AcqDaemon:
+	"""Runs experiments, one at a time, on the device that device (an AnalogDiscoveryUtils) has open.
+
+	history: events kept for watchers that connect late
+	"""
+
+	def __init__(self, device, data_directory, simulate=False, history=10000, output=None):
+		self.device = device
+		self.data_directory = data_directory
+		self.simulate = simulate
+		# the _Output that stands in for sys.stdout, if any
+		self.output = output
+		self.started = time.time()
+
+		self._condition = threading.Condition()
+		self.state = "idle"
+		# closing: no more experiments start; closed: the last one has finished too, watchers return
+		self.closing = False
+		self.closed = False
+		# the running experiment: its metadata, AnalogDiscoveryUtils and thread
+		self._metadata = None
+		self._ad_utils = None
+		self._thread = None
+		# packet counts and latencies of the running experiment
+		self._counts = None
+		self._sketch = None
+		# metadata of the experiments run before
+		self.experiments = []
+
+		self._events = collections.deque(maxlen=history)
+		self.num_events = 0
+
+	def handle(self, request):
+		"""The response to a request other than watch."""
+		command = request.get("command")
+		if command == "status":
+			return self.status()
+		if command == "start":
+			return self.start(request.get("experiment") or {})
+		if command == "stop":
+			return self.stop("stopped by a client")
+		if command == "shutdown":
+			self.close()
+			return {"ok": True}
+		return {"ok": False, "error": "unknown command {}".format(command)}
+
+	def status(self):
+		with self._condition:
+			running = None
+			if self._metadata is not None:
+				running = {
+					"name": self._metadata["name"],
+					"directory": self._metadata["directory"],
+					"options": self._metadata["options"],
+					"started": self._metadata["started"],
+					"counts": dict(self._counts),
+					"latency_quantiles": self._sketch.quantiles() if self._sketch.count else None,
+				}
+			return {
+				"ok": True,
+				"state": self.state,
+				"uptime_s": time.time() - self.started,
+				"device_index": self.device.device_index,
+				"num_events": self.num_events,
+				"running": running,
+				"experiments": [dict((key, experiment[key]) for key in ["name", "directory", "status", "started", "finished", "duration_s"])
+					for experiment in self.experiments],
+			}
+
+	def start(self, experiment):
+		"""Starts experiment on a thread of its own."""
+		with self._condition:
+			if self.closing:
+				return {"ok": False, "error": "the daemon is shutting down"}
+			if self.state != "idle":
+				return {"ok": False, "error": "experiment {} is running".format(self._metadata["name"])}
+			try:
+				queue_runner.check_experiment(experiment, os.getcwd())
+			except (ValueError, KeyError, TypeError, IOError) as e:
+				return {"ok": False, "error": "invalid experiment: {}".format(e)}
+
+			directory = os.path.join(self.data_directory, experiment["name"])
+			queue_runner._makedirs(directory)
+			metadata, ad_utils, args = queue_runner.prepare_experiment(experiment, directory, self.device, simulate=self.simulate)
+			ad_utils.packet_listener = self._packet
+			self.state = "running"
+			self._metadata = metadata
+			self._ad_utils = ad_utils
+			self._counts = collections.Counter()
+			self._sketch = LatencySketch()
+			self._publish({"event": "started", "experiment": metadata["name"], "directory": directory})
+			self._thread = threading.Thread(target=self._run, args=(metadata, ad_utils, args), name="experiment")
+			self._thread.daemon = True
+			self._thread.start()
+		return {"ok": True, "directory": directory}
+
+	def stop(self, reason):
+		with self._condition:
+			if self.state != "running":
+				return {"ok": False, "error": "no experiment is running"}
+			self.state = "stopping"
+			self._ad_utils.stop(reason)
+		return {"ok": True}
+
+	def _run(self, metadata, ad_utils, args):
+		log = open(os.path.join(metadata["directory"], "acq.log"), "w")
+		if self.output is not None:
+			self.output.log = log
+		try:
+			queue_runner.execute_experiment(metadata, ad_utils, args, log)
+			if not queue_runner.ready_device(ad_utils, metadata):
+				metadata["error"] = (metadata["error"] or "") + "could not reopen the device"
+		except Exception:
+			metadata["status"] = "failed"
+			metadata["error"] = traceback.format_exc()
+		finally:
+			if self.output is not None:
+				self.output.log = None
+			log.close()
+		with self._condition:
+			# a recovery may have reopened the device
+			self.device = ad_utils
+			self.experiments.append(metadata)
+			self.state = "idle"
+			self._metadata = None
+			self._ad_utils = None
+			self._publish({"event": "finished", "experiment": metadata["name"], "status": metadata["status"],
+				"error": metadata["error"], "duration_s": metadata["duration_s"],
+				"stop_reasons": [run.get("stop_reason") for run in metadata["runs"]]})
+
+	def _packet(self, data_file, capture, latency):
+		"""AnalogDiscoveryUtils.packet_listener of the running experiment."""
+		with self._condition:
+			self._counts["num_packets"] += 1
+			if capture.received:
+				self._counts["num_packets_received"] += 1
+				self._sketch.add(latency)
+			else:
+				self._counts["num_packets_missed"] += 1
+				self._sketch.add_missed()
+			if capture.ack_missed:
+				self._counts["num_acks_missed"] += 1
+			self._publish({
+				"event": "packet",
+				"experiment": self._metadata["name"],
+				"data_file": data_file,
+				"packet": capture.attempt_number,
+				"received": capture.received,
+				"ack_missed": capture.ack_missed,
+				"latency_ms": latency,
+				"samples_lost": capture.buffer_info[1],
+				"samples_corrupted": capture.buffer_info[2],
+			})
+
+	def _publish(self, event):
+		"""Adds event to the history and wakes the watchers; called with the lock held."""
+		self.num_events += 1
+		event["seq"] = self.num_events
+		event["time"] = time.time()
+		self._events.append(event)
+		self._condition.notify_all()
+
+	def watch(self, since=None):
+		"""Yields the events after sequence number since (default: from now on) as they happen,
+		until the daemon is closed.
+		"""
+		with self._condition:
+			if since is None:
+				since = self.num_events
+		while True:
+			with self._condition:
+				while self.num_events <= since and not self.closed:
+					self._condition.wait(1.0)
+				if self.closed and self.num_events <= since:
+					return
+				events = [event for event in self._events if event["seq"] > since]
+			for event in events:
+				yield event
+			since = events[-1]["seq"] if events else self.num_events
+
+	def close(self):
+		"""Stops the running experiment and waits for it. The device stays open (see serve)."""
+		with self._condition:
+			self.closing = True
+			if self.state == "running":
+				self.state = "stopping"
+				self._ad_utils.stop("daemon shut down")
+			thread = self._thread
+		if thread is not None:
+			while thread.is_alive():
+				thread.join(0.1)
+		with self._condition:
+			self.closed = True
+			self._condition.notify_all()
+
+class _Output:
+	"""Stands in for sys.stdout in the daemon. What is printed goes to the log of the running
+	experiment, if any, else to stdout. acq.py prints from the experiment thread and from the
+	threads it starts (the background writer, ...), so the log is switched here rather than by
+	replacing sys.stdout on the experiment thread.
+	"""
+
+	def __init__(self, stdout):
+		self.stdout = stdout
+		self.log = None
+
+	def write(self, data):
+		(self.log or self.stdout).write(data)
+
+	def flush(self):
+		(self.log or self.stdout).flush()
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+	"""One client connection: a response line for every request line."""
+
+	def setup(self):
+		SocketServer.StreamRequestHandler.setup(self)
+		self.server.connection_opened()
+
+	def finish(self):
+		try:
+			SocketServer.StreamRequestHandler.finish(self)
+		finally:
+			self.server.connection_closed()
+
+	def handle(self):
+		daemon = self.server.acq_daemon
+		for line in iter(self.rfile.readline, ""):
+			request = {}
+			try:
+				request = json.loads(line)
+				if request.get("command") == "watch":
+					for event in daemon.watch(request.get("since")):
+						self._send(event)
+					return
+				response = daemon.handle(request)
+			except ValueError as e:
+				response = {"ok": False, "error": "invalid request: {}".format(e)}
+			except socket.error:
+				# the client went away
+				return
+			self._send(response)
+			if request.get("command") == "shutdown":
+				self.server.shutdown()
+				return
+
+	def _send(self, message):
+		self.wfile.write(json.dumps(message) + "\n")
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, socket_path, handler):
+		SocketServer.UnixStreamServer.__init__(self, socket_path, handler)
+		self._connections = 0
+		self._connections_changed = threading.Condition()
+
+	def connection_opened(self):
+		with self._connections_changed:
+			self._connections += 1
+
+	def connection_closed(self):
+		with self._connections_changed:
+			self._connections -= 1
+			self._connections_changed.notify_all()
+
+	def wait_for_connections(self, timeout):
+		"""Waits up to timeout seconds for the open connections (watchers ending, ...) to close."""
+		deadline = time.time() + timeout
+		with self._connections_changed:
+			while self._connections > 0 and time.time() < deadline:
+				self._connections_changed.wait(0.1)
+
+def serve(socket_path, device, data_directory, simulate=False):
+	"""Serves the daemon on socket_path until a client shuts it down (or Ctrl-C), then closes device."""
+	if os.path.exists(socket_path):
+		try:
+			request(socket_path, {"command": "status"})
+		except socket.error:
+			# left over by a daemon that did not shut down
+			os.remove(socket_path)
+		else:
+			raise RuntimeError("a daemon is already serving {}".format(socket_path))
+
+	# set once, before any experiment thread starts
+	stdout = sys.stdout
+	output = _Output(stdout)
+	sys.stdout = output
+	daemon = AcqDaemon(device, data_directory, simulate, output=output)
+	server = _Server(socket_path, _RequestHandler)
+	server.acq_daemon = daemon
+	print "serving {}".format(socket_path)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		daemon.close()
+		# watchers return once the daemon is closed; idle clients are not waited for long
+		server.wait_for_connections(2.0)
+		server.server_close()
+		os.remove(socket_path)
+		daemon.device.close_device()
+		sys.stdout = stdout
+
+def _connect(socket_path):
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	client.connect(socket_path)
+	return client
+
+def request(socket_path, message):
+	"""Sends one request to the daemon at socket_path and returns its response."""
+	client = _connect(socket_path)
+	try:
+		client.sendall(json.dumps(message) + "\n")
+		return json.loads(client.makefile().readline())
+	finally:
+		client.close()
+
+def watch(socket_path, since=None):
+	"""Yields the events of the daemon at socket_path (see AcqDaemon.watch) until it shuts down."""
+	client = _connect(socket_path)
+	try:
+		client.sendall(json.dumps({"command": "watch", "since": since}) + "\n")
+		for line in client.makefile():
+			yield json.loads(line)
+	finally:
+		client.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Acquisition daemon that keeps the AD2 open, controlled over a Unix socket.")
+	parser.add_argument("--socket", default=DEFAULT_SOCKET, help="socket path (default: {})".format(DEFAULT_SOCKET))
+	commands = parser.add_subparsers(dest="command")
+	serve_parser = commands.add_parser("serve", help="open the device and serve clients")
+	serve_parser.add_argument("--data-dir", default="data/daemon", help="directory of the experiment directories (default: data/daemon)")
+	serve_parser.add_argument("--device", metavar="SERIAL", help="serial number of the device to use (default: the first one)")
+	serve_parser.add_argument("--simulate", action="store_true",
+		help="run against a simulated AD2 and networks (fake_dwf.py) instead of libdwf")
+	start_parser = commands.add_parser("start", help="start the experiment of a JSON file (one experiment of a queue_runner.py plan)")
+	start_parser.add_argument("experiment_file")
+	commands.add_parser("status", help="print the daemon's state")
+	commands.add_parser("stop", help="stop the running experiment")
+	commands.add_parser("shutdown", help="stop the running experiment and the daemon")
+	watch_parser = commands.add_parser("watch", help="print events, one JSON object per line")
+	watch_parser.add_argument("--since", type=int, help="start after this event sequence number (default: new events only)")
+	args = parser.parse_args()
+
+	if args.command == "serve":
+		if args.simulate:
+			import fake_dwf
+			acq.dwf = fake_dwf.FakeDwf([])
+		else:
+			acq.dwf = acq.load_dwf()
+		device_index = -1
+		if args.device:
+			by_serial = dict((device["serial"], device) for device in acq.enumerate_devices())
+			if args.device not in by_serial:
+				print "device {} not found".format(args.device)
+				sys.exit(1)
+			device_index = by_serial[args.device]["index"]
+		try:
+			os.makedirs(args.data_dir)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+		# the sampling frequency is each experiment's own
+		device = acq.AnalogDiscoveryUtils(1)
+		device.open_device(device_index)
+		serve(args.socket, device, args.data_dir, args.simulate)
+		sys.exit(0)
+
+	try:
+		if args.command == "watch":
+			for event in watch(args.socket, args.since):
+				print json.dumps(event, sort_keys=True)
+				sys.stdout.flush()
+			sys.exit(0)
+		if args.command == "start":
+			with open(args.experiment_file) as f:
+				experiment = json.load(f)
+			# input files are relative to the experiment file, the daemon runs elsewhere
+			experiment_directory = os.path.dirname(os.path.abspath(args.experiment_file))
+			experiment["input_files"] = [os.path.join(experiment_directory, input_file) for input_file in experiment.get("input_files", [])]
+			if not experiment["input_files"]:
+				del experiment["input_files"]
+			response = request(args.socket, {"command": "start", "experiment": experiment})
+		else:
+			response = request(args.socket, {"command": args.command})
+	except socket.error as e:
+		print "no daemon at {}: {}".format(args.socket, e)
+		sys.exit(1)
+	print json.dumps(response, indent=2, sort_keys=True)
+	sys.exit(0 if response["ok"] else 1)
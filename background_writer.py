@@ -0,0 +1,86 @@
+"""
+	Background writer for the acquisition loop.
+
+	The acquisition loop hands each finished capture to a BackgroundWriter, which queues it
+	and lets a worker thread postprocess it and write it to disk. The loop only pays for
+	putting the capture on the queue; when the queue is full it waits (back-pressure)
+	instead of letting captures pile up in memory.
+"""
+
+from timeit import default_timer
+import Queue
+import sys
+import threading
+
+# put on the queue by close() to tell the worker thread to stop
+_STOP = object()
+
+class BackgroundWriter:
+	"""Runs handler(job) on a worker thread for every job passed to submit(), in order.
+
+	max_pending bounds the number of jobs waiting on the queue; submit() blocks while it is full.
+	close() waits until every submitted job has been handled.
+	If handler raises, the worker thread keeps handling later jobs, and the first exception is
+	re-raised in the submitting thread by the next submit() or close().
+	"""
+
+	def __init__(self, handler, max_pending):
+		self.handler = handler
+		self._queue = Queue.Queue(max_pending)
+		self._error = None
+
+		# hand-off statistics
+		self.num_jobs = 0
+		self.handoff_time = 0
+		self.max_handoff_time = 0
+
+		self._thread = threading.Thread(target=self._work, name="background writer")
+		self._thread.daemon = True
+		self._thread.start()
+
+	def submit(self, job):
+		"""Queues job for the worker thread, waiting while the queue is full."""
+		self._raise_error()
+		handoff_start = default_timer()
+		while True:
+			# a timeout keeps the wait interruptible by KeyboardInterrupt
+			try:
+				self._queue.put(job, timeout=0.1)
+				break
+			except Queue.Full:
+				self._raise_error()
+		handoff = default_timer() - handoff_start
+
+		self.num_jobs += 1
+		self.handoff_time += handoff
+		self.max_handoff_time = max(self.max_handoff_time, handoff)
+
+	def close(self):
+		"""Waits for every submitted job to be handled, then stops the worker thread."""
+		if self._thread.is_alive():
+			while True:
+				try:
+					self._queue.put(_STOP, timeout=0.1)
+					break
+				except Queue.Full:
+					if not self._thread.is_alive():
+						break
+			while self._thread.is_alive():
+				self._thread.join(0.1)
+		self._raise_error()
+
+	def _raise_error(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error[0], error[1], error[2]
+
+	def _work(self):
+		while True:
+			job = self._queue.get()
+			if job is _STOP:
+				return
+			try:
+				self.handler(job)
+			except Exception:
+				if self._error is None:
+					self._error = sys.exc_info()
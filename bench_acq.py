@@ -0,0 +1,347 @@
+"""
+	Benchmark of the acquisition hot path.
+
+	Drives AnalogDiscoveryUtils.run for a number of packets against the simulated AD2
+	(fake_dwf.py), once per capture mode and sampling frequency, and reports:
+		per-phase latency distributions (configuring the instruments, the press, the poll loop,
+		buffer copies, DIO reads, postprocessing and the file write),
+		packets per hour,
+		peak RSS of the process that ran the configuration.
+	Every configuration runs in its own process so peak RSS is not carried over between them.
+
+	Results can be saved as a JSON baseline and later runs compared against it; a phase, the
+	throughput or the peak RSS getting worse by more than the tolerance is reported as a
+	regression (exit status 1).
+
+	With --replay, the run recorded in a dwf trace (acq.py --record-trace, see dwf_trace.py) is
+	replayed instead, with its network, sampling frequency, packets and every acq.py option it was
+	recorded with, so a real bench capture serves as the benchmark.
+
+	Usage:
+		python bench_acq.py acq_experiment_inputs.txt [--packets N] [--rates F ...] [--modes M ...]
+			[--save baseline.json] [--compare baseline.json] [--tolerance 0.2]
+		python bench_acq.py --replay run.dwft [--save baseline.json] [--compare baseline.json]
+"""
+
+from timeit import default_timer
+import acq
+import argparse
+import dwf_trace
+import fake_dwf
+import json
+import multiprocessing
+import numpy as np
+import os
+import Queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+# (class, method, phase) timed on every call
+TIMED_METHODS = [
+	(acq.AnalogDiscoveryUtils, "_configure_DigitalIO", "configure_DigitalIO"),
+	(acq.AnalogDiscoveryUtils, "_configure_DigitalIn", "configure_DigitalIn"),
+	(acq.AnalogDiscoveryUtils, "_configure_DigitalIn_terminated", "configure_DigitalIn"),
+	(acq.AnalogDiscoveryUtils, "_copy_buffer_samples", "clear_buffer"),
+	(acq.AnalogDiscoveryUtils, "_press", "press"),
+	(acq.AnalogDiscoveryUtils, "_capture_polled", "capture"),
+	(acq.AnalogDiscoveryUtils, "_capture_terminated", "capture"),
+	(acq.AnalogDiscoveryUtils, "_capture_streaming", "capture"),
+	(acq.AnalogDiscoveryUtils, "_postprocess_capture", "postprocess"),
+	(acq.AnalogDiscoveryUtils, "_write_edges", "write"),
+	(acq.DigitalInPoller, "copy_buffer_samples", "buffer_copy"),
+	(acq.DigitalInPoller, "read_stream", "buffer_copy"),
+	(acq.DigitalInPoller, "get_DIO_values", "dio_read"),
+]
+
+# the poll loop is timed from DigitalInPoller.start_loop to end_loop
+POLL_LOOP_PHASE = "poll_loop"
+
+# phases faster than this (ms) are too noisy to report as regressions
+MIN_REGRESSION_MS = 0.05
+
+class PhaseTimer:
+	"""Wraps methods so that every call's duration is recorded under a phase name."""
+
+	def __init__(self):
+		self.durations = {}
+		self._originals = []
+		self._loop_start = None
+
+	def wrap(self, owner, name, phase):
+		original = owner.__dict__[name]
+		durations = self.durations.setdefault(phase, [])
+
+		def timed(*args, **kwargs):
+			start = default_timer()
+			try:
+				return original(*args, **kwargs)
+			finally:
+				durations.append(default_timer() - start)
+
+		self._originals.append((owner, name, original))
+		setattr(owner, name, timed)
+
+	def wrap_poll_loop(self):
+		durations = self.durations.setdefault(POLL_LOOP_PHASE, [])
+		start_loop = acq.DigitalInPoller.__dict__["start_loop"]
+		end_loop = acq.DigitalInPoller.__dict__["end_loop"]
+
+		def timed_start_loop(poller):
+			self._loop_start = default_timer()
+			return start_loop(poller)
+
+		def timed_end_loop(poller):
+			durations.append(default_timer() - self._loop_start)
+			return end_loop(poller)
+
+		self._originals.append((acq.DigitalInPoller, "start_loop", start_loop))
+		self._originals.append((acq.DigitalInPoller, "end_loop", end_loop))
+		acq.DigitalInPoller.start_loop = timed_start_loop
+		acq.DigitalInPoller.end_loop = timed_end_loop
+
+	def restore(self):
+		for owner, name, original in reversed(self._originals):
+			setattr(owner, name, original)
+		self._originals = []
+
+def summarize(durations):
+	"""Distribution (ms) of a list of durations (s)."""
+	if not durations:
+		return {"count": 0}
+	ms = np.array(durations) * 1000.0
+	return {
+		"count": len(ms),
+		"mean_ms": float(ms.mean()),
+		"p50_ms": float(np.percentile(ms, 50)),
+		"p90_ms": float(np.percentile(ms, 90)),
+		"p99_ms": float(np.percentile(ms, 99)),
+		"max_ms": float(ms.max()),
+	}
+
+def config_name(config):
+	if config.get("trace"):
+		return "{}@{}:{}".format(config["mode"], config["sampling_freq"], os.path.basename(config["trace"]))
+	return "{}@{}".format(config["mode"], config["sampling_freq"])
+
+def make_device(config):
+	"""The dwf handle a configuration runs against."""
+	networks = fake_dwf.networks_from_inputs(config["input_file"],
+		latency_model=fake_dwf.TschLatencyModel(config["active_slots"], seed=config["seed"]), seed=config["seed"])
+	return fake_dwf.FakeDwf(networks, time_scale=config["time_scale"], usb_latency=config["usb_latency"], seed=config["seed"])
+
+def replay_config(trace):
+	"""The configuration that replays the run recorded in trace (written by acq.py --record-trace).
+	Raises ValueError if the run cannot be replayed by a single run().
+	"""
+	notes = [record[1] for record in dwf_trace.read_trace(trace) if record[0] == "note"]
+	if not notes or "network_params" not in notes[0]:
+		raise ValueError("{} was not recorded by acq.py --record-trace".format(trace))
+	options = notes[0]["args"]
+	if options.get("concurrent") or len(notes[0]["network_params"]) > 1:
+		raise ValueError("{}: a run of several networks cannot be replayed".format(trace))
+	if options.get("resume"):
+		raise ValueError("{}: a resumed run cannot be replayed without its checkpoint".format(trace))
+	params = notes[0]["network_params"][0]
+	return {
+		"trace": trace,
+		"network_params": params,
+		"options": options,
+		"mode": options["capture_mode"],
+		"sampling_freq": params[3][0],
+		"packets": params[2][0],
+		"background_writer": options["background_writer"],
+		"data_format": "bin" if options["binary"] else "csv",
+		"seed": 0,
+	}
+
+def run_config(config):
+	"""Runs one configuration and returns its results. Meant to run in a process of its own."""
+	random.seed(config["seed"])
+	if config.get("trace"):
+		acq.dwf = dwf_trace.ReplayDwf(config["trace"])
+		params = config["network_params"]
+	else:
+		acq.dwf = make_device(config)
+		with open(config["input_file"]) as f:
+			params = [[int(i) for i in line.strip().split(", ")] for line in f if line.strip()]
+	del acq.list_of_networks[:]
+	acq.initialize_network(params[0], params[1], config["packets"])
+
+	ad_utils = acq.AnalogDiscoveryUtils(config["sampling_freq"])
+	ad_utils.capture_mode = config["mode"]
+	ad_utils.background_writer = config["background_writer"]
+	ad_utils.data_format = config["data_format"]
+	if config.get("options"):
+		# every option of the recorded run, the ones added after it was recorded at their defaults
+		args = acq.argument_parser().parse_args(config["options"]["input_files"])
+		vars(args).update(config["options"])
+		acq.apply_options(ad_utils, args)
+
+	timer = PhaseTimer()
+	for owner, name, phase in TIMED_METHODS:
+		timer.wrap(owner, name, phase)
+	timer.wrap_poll_loop()
+
+	experiment_directory = tempfile.mkdtemp(prefix="bench_acq_")
+	stdout = sys.stdout
+	try:
+		# keep the per-packet prints (their cost is part of the hot path) off the terminal
+		sys.stdout = open(os.devnull, "w")
+		ad_utils.open_device()
+		ad_utils.add_network(acq.list_of_networks[0])
+		run_start = default_timer()
+		ad_utils.run(experiment_directory)
+		run_time = default_timer() - run_start
+		ad_utils.close_device()
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+		timer.restore()
+		shutil.rmtree(experiment_directory, ignore_errors=True)
+
+	return {
+		"packets": config["packets"],
+		"run_time_s": run_time,
+		"packets_per_hour": 3600.0 * config["packets"] / run_time,
+		"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		"phases": dict((phase, summarize(durations)) for phase, durations in timer.durations.items()),
+	}
+
+def _run_config_process(config, results):
+	"""Target of the process of a configuration: puts (results, None) or (None, traceback) on results."""
+	try:
+		results.put((run_config(config), None))
+	except Exception:
+		results.put((None, traceback.format_exc()))
+
+def run_benchmarks(configs):
+	"""Runs every configuration in a fresh process. Returns {config name: results}."""
+	results = {}
+	for config in configs:
+		print "running {} ({} packets)".format(config_name(config), config["packets"])
+		# not a Pool worker: those are daemonic, and the background writer and the dump pool
+		# start processes of their own
+		queue = multiprocessing.Queue()
+		process = multiprocessing.Process(target=_run_config_process, args=(config, queue),
+			name="bench_" + config_name(config))
+		process.start()
+		config_results, error = None, None
+		while process.is_alive() or not queue.empty():
+			try:
+				config_results, error = queue.get(timeout=0.1)
+				break
+			except Queue.Empty:
+				pass
+		process.join()
+		if error is not None:
+			raise RuntimeError("{} failed:\n{}".format(config_name(config), error))
+		if config_results is None:
+			raise RuntimeError("{}: process exited with code {}".format(config_name(config), process.exitcode))
+		results[config_name(config)] = config_results
+	return results
+
+def compare(results, baseline, tolerance):
+	"""Returns a list of regressions of results against baseline, as strings."""
+	regressions = []
+	for name, result in sorted(results.items()):
+		if name not in baseline:
+			continue
+		base = baseline[name]
+		if result["packets_per_hour"] < base["packets_per_hour"] * (1 - tolerance):
+			regressions.append("{}: {:.0f} packets/hour, baseline {:.0f}".format(name, result["packets_per_hour"], base["packets_per_hour"]))
+		if result["peak_rss_kb"] > base["peak_rss_kb"] * (1 + tolerance):
+			regressions.append("{}: peak RSS {} kB, baseline {} kB".format(name, result["peak_rss_kb"], base["peak_rss_kb"]))
+		for phase, stats in sorted(result["phases"].items()):
+			base_stats = base["phases"].get(phase)
+			if not stats["count"] or not base_stats or not base_stats["count"]:
+				continue
+			for key in ("p50_ms",):
+				if stats[key] > max(base_stats[key] * (1 + tolerance), base_stats[key] + MIN_REGRESSION_MS):
+					regressions.append("{}: {} {} {:.4f} ms, baseline {:.4f} ms".format(name, phase, key, stats[key], base_stats[key]))
+	return regressions
+
+def print_results(results):
+	for name, result in sorted(results.items()):
+		print "\n{}: {} packets in {:.2f} s, {:.0f} packets/hour, peak RSS {} kB".format(
+			name, result["packets"], result["run_time_s"], result["packets_per_hour"], result["peak_rss_kb"])
+		print "  {:<20} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format("phase", "count", "mean ms", "p50 ms", "p90 ms", "p99 ms", "max ms")
+		for phase, stats in sorted(result["phases"].items()):
+			if not stats["count"]:
+				continue
+			print "  {:<20} {:>8} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}".format(
+				phase, stats["count"], stats["mean_ms"], stats["p50_ms"], stats["p90_ms"], stats["p99_ms"], stats["max_ms"])
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the acquisition hot path against a simulated AD2.")
+	parser.add_argument("input_file", nargs="?", help="experiment parameter file, e.g. acq_experiment_inputs.txt")
+	parser.add_argument("--packets", type=int, default=50, help="packets per configuration (default: 50)")
+	parser.add_argument("--rates", type=int, nargs="+", default=[1000000, 2000000, 5000000],
+		help="sampling frequencies (Hz) to run at")
+	parser.add_argument("--modes", nargs="+", default=["polled"], choices=["polled", "streaming", "terminated"],
+		help="capture modes to run")
+	parser.add_argument("--background-writer", action="store_true", help="run with the background writer")
+	parser.add_argument("--binary", action="store_true", help="write binary edge logs instead of csv")
+	parser.add_argument("--active-slots", type=int, default=11,
+		help="active slots per slotframe of the simulated network (default: 11, every slot)")
+	parser.add_argument("--time-scale", type=float, default=1.0,
+		help="simulated device seconds per wall clock second (default: 1, real time; 0: only calls advance the clock)")
+	parser.add_argument("--usb-latency", type=float, default=0, help="simulated seconds every dwf call takes")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--replay", metavar="TRACE", nargs="+",
+		help="replay these dwf traces (acq.py --record-trace) instead of running the simulated AD2")
+	parser.add_argument("--save", help="write the results to this JSON baseline")
+	parser.add_argument("--compare", help="compare the results to this JSON baseline")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+		help="relative slowdown tolerated before a regression is reported (default: 0.2)")
+	args = parser.parse_args()
+
+	if not args.input_file and not args.replay:
+		parser.error("an input file or --replay is required")
+	if args.time_scale == 0 and args.usb_latency == 0:
+		parser.error("--time-scale 0 needs a --usb-latency (device time only advances with calls)")
+
+	configs = []
+	if args.replay:
+		configs += [replay_config(trace) for trace in args.replay]
+	if args.input_file:
+		for mode in args.modes:
+			for sampling_freq in args.rates:
+				configs.append({
+					"input_file": args.input_file,
+					"mode": mode,
+					"sampling_freq": sampling_freq,
+					"packets": args.packets,
+					"background_writer": args.background_writer,
+					"data_format": "bin" if args.binary else "csv",
+					"active_slots": args.active_slots,
+					"time_scale": args.time_scale,
+					"usb_latency": args.usb_latency,
+					"seed": args.seed,
+				})
+
+	results = run_benchmarks(configs)
+	print_results(results)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}, f, indent=2, sort_keys=True)
+		print "\nsaved baseline to {}".format(args.save)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)["results"]
+		regressions = compare(results, baseline, args.tolerance)
+		if regressions:
+			print "\nREGRESSIONS against {}:".format(args.compare)
+			for regression in regressions:
+				print "  " + regression
+			sys.exit(1)
+		print "\nno regressions against {}".format(args.compare)
+
+	sys.exit(0)
@@ -0,0 +1,82 @@
+"""
+	Adaptive capture window.
+
+	Instead of reserving and scanning a fixed 1.5 s window for every packet, AdaptiveWindow
+	starts each packet with a window estimated from the lengths of the packets captured so far
+	(margin times their p99.9), and run() extends it chunk by chunk while the packet has not
+	been received, up to the ceiling; a packet still not received there is missed, exactly as
+	with a fixed window. A missed packet goes into the history at the ceiling, since it would
+	have taken at least that long, so the estimate grows with the misses.
+
+	Until min_packets packets were captured the window starts at initial_s.
+"""
+
+from sketch import LatencySketch
+import math
+
+class AdaptiveWindow:
+	"""Per-packet capture window (in samples) from the history of the run."""
+
+	def __init__(self, sampling_freq, ceiling_s=1.5, initial_s=0.25, chunk_s=0.05, margin=2.0,
+			quantile=0.999, min_packets=20):
+		self.ceiling = int(ceiling_s * sampling_freq)
+		self.initial = min(int(initial_s * sampling_freq), self.ceiling)
+		self.chunk = max(1, int(chunk_s * sampling_freq))
+		self.margin = margin
+		self.quantile = quantile
+		self.min_packets = min_packets
+
+		# lengths (samples) of the packets captured, the ceiling for the missed ones
+		self.history = LatencySketch()
+
+		# statistics
+		self.num_packets = 0
+		self.num_extensions = 0
+		self.max_window = 0
+
+	def _round_up(self, samples):
+		return int(math.ceil(float(samples) / self.chunk)) * self.chunk
+
+	def start(self):
+		"""Returns the window the next packet starts with."""
+		if self.history.count < self.min_packets:
+			window = self.initial
+		else:
+			estimate = self._round_up(self.margin * self.history.quantile(self.quantile))
+			window = min(max(estimate, self.chunk), self.ceiling)
+		self.num_packets += 1
+		self._note_window(window)
+		return window
+
+	def extend(self, window):
+		"""Returns the window one chunk longer than window, or None if the packet reached the ceiling."""
+		if window >= self.ceiling:
+			return None
+		window = min(window + self.chunk, self.ceiling)
+		self.num_extensions += 1
+		self._note_window(window)
+		return window
+
+	def _note_window(self, window):
+		if window > self.max_window:
+			self.max_window = window
+
+	def packet_samples(self, capture):
+		"""Samples the history takes for capture (a PacketCapture that did not break early): its
+		length if it was received, the ceiling if it was missed."""
+		if capture.received:
+			return capture.buffer_info[0]
+		return self.ceiling
+
+	def record(self, capture):
+		"""Adds capture to the history."""
+		self.history.add(self.packet_samples(capture))
+
+	def summary(self):
+		"""Counters written to summary_*.json."""
+		return {
+			"ceiling_samples": self.ceiling,
+			"num_packets": self.num_packets,
+			"max_window_samples": self.max_window,
+			"num_extensions": self.num_extensions,
+		}
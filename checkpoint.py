@@ -0,0 +1,170 @@
+"""
+	Checkpoints of a running experiment, and resuming from them.
+
+	A long run keeps its packet counts in memory for hours, and a Ctrl-C or a USB error used to
+	throw them away with the run. RunCheckpoint keeps the state of the run as of the last packet
+	written to the data file: the packet counts, the latency sketch (and the adaptive window's
+	history, see capture_window.py) and the size of the data file.
+	It is the only place a run counts its packets, so the counts, the sketch and the data file
+	cannot drift apart.
+	Every interval packets, and when the run ends however it ends, it is written to
+	checkpoint_<time>.json next to the data file. The file is written to a temporary file and
+	renamed over the previous checkpoint, so a crash leaves one of the two intact.
+
+	resume_checkpoint reads a checkpoint back for AnalogDiscoveryUtils.run (acq.py --resume).
+	It truncates the data file to its size at the checkpoint, so packets written after the
+	checkpoint are dropped and measured again. The resumed run continues the packet numbering and
+	appends to the same data file, sketch and checkpoint.
+"""
+
+import json
+import os
+import sketch as latency_sketch
+from sketch import LatencySketch
+
+CHECKPOINT_VERSION = 1
+
+class RunCheckpoint:
+	"""State of a run as of the last packet written to data_file.
+
+	path: checkpoint file
+	start_time: timestamp of the run's file names (data_<start_time>.csv, ...)
+	interval: packets between checkpoints
+	"""
+
+	def __init__(self, path, data_file, start_time, sampling_freq, data_format, interval=100, sketch=None):
+		self.path = path
+		self.data_file = data_file
+		self.start_time = start_time
+		self.sampling_freq = sampling_freq
+		self.data_format = data_format
+		self.interval = interval
+		# size of the data file right after the last packet counted
+		self.data_file_size = os.path.getsize(data_file)
+
+		# counts of the packets written so far, as in the run summary
+		self.num_tries = 0
+		self.num_packets_received = 0
+		self.num_packets_missed = 0
+		# missed packets of a one-to-many network that reached some of the receivers
+		self.num_packets_partial = 0
+		self.num_acks_missed = 0
+		self.num_samples_lost = 0
+		self.num_samples_corrupted = 0
+		self.packets_lost_samples = []
+		self.packets_missed = []
+		self.stop_reason = None
+		# latencies of the packets written so far
+		self.sketch = sketch if sketch is not None else LatencySketch()
+		# packet lengths of an adaptive window (see capture_window.py), None without one
+		self.window_history = None
+
+		# sessions of the run (1 + times it was resumed), and checkpoints written by this one
+		self.num_sessions = 1
+		self.num_saved = 0
+
+	def packet_written(self, capture, data_file_size, latency, window_samples=None):
+		"""Counts capture (a PacketCapture) once it was written to the data file, in packet order, and
+		adds its latency (ms) to the sketch, and window_samples (if given) to the window history.
+		data_file_size is the size of the data file right after the packet.
+		"""
+		self.data_file_size = data_file_size
+		self.num_tries = capture.attempt_number
+		if capture.buffer_info[1] or capture.buffer_info[2]:
+			self.num_samples_lost += capture.buffer_info[1]
+			self.num_samples_corrupted += capture.buffer_info[2]
+			self.packets_lost_samples.append([capture.attempt_number, capture.buffer_info[1], capture.buffer_info[2]])
+		if capture.received:
+			self.num_packets_received += 1
+			if capture.ack_missed:
+				self.num_acks_missed += 1
+		else:
+			self.num_packets_missed += 1
+			if capture.partial:
+				self.num_packets_partial += 1
+			self.packets_missed.append(capture.attempt_number)
+		if capture.received:
+			self.sketch.add(latency)
+		else:
+			self.sketch.add_missed()
+		if window_samples is not None:
+			self.window_history.add(window_samples)
+
+	def save_due(self):
+		"""Whether the last packet counted ends an interval."""
+		return self.interval > 0 and self.num_tries % self.interval == 0
+
+	def save(self, stop_reason=None):
+		"""Writes the checkpoint. The data file is checkpointed at its size after the last packet
+		counted, whatever was written after it. stop_reason is why the run ended for good (None
+		while it may go on); a resumed run with one stays stopped.
+		"""
+		self.stop_reason = stop_reason
+		state = {
+			"version": CHECKPOINT_VERSION,
+			"data_file": os.path.basename(self.data_file),
+			"data_file_size": self.data_file_size,
+			"start_time": self.start_time,
+			"sampling_freq": self.sampling_freq,
+			"data_format": self.data_format,
+			"num_sessions": self.num_sessions,
+			"num_tries": self.num_tries,
+			"num_packets_received": self.num_packets_received,
+			"num_packets_missed": self.num_packets_missed,
+			"num_packets_partial": self.num_packets_partial,
+			"num_acks_missed": self.num_acks_missed,
+			"num_samples_lost": self.num_samples_lost,
+			"num_samples_corrupted": self.num_samples_corrupted,
+			"packets_lost_samples": self.packets_lost_samples,
+			"packets_missed": self.packets_missed,
+			"stop_reason": self.stop_reason,
+			"sketch": self.sketch.to_dict(),
+			"window_history": self.window_history.to_dict() if self.window_history is not None else None,
+		}
+		temp_path = self.path + ".tmp"
+		with open(temp_path, "w") as f:
+			json.dump(state, f)
+			f.flush()
+			os.fsync(f.fileno())
+		if os.name == "nt" and os.path.exists(self.path):
+			# rename does not replace files on Windows
+			os.remove(self.path)
+		os.rename(temp_path, self.path)
+		self.num_saved += 1
+
+def resume_checkpoint(path, sampling_freq, data_format):
+	"""Reads the checkpoint at path for a run that goes on from it, and truncates its data file
+	(next to the checkpoint) to the packets the checkpoint holds.
+	Returns a RunCheckpoint. Raises ValueError if the run cannot be resumed with sampling_freq and
+	data_format.
+	"""
+	with open(path) as f:
+		state = json.load(f)
+	if state["version"] != CHECKPOINT_VERSION:
+		raise ValueError("{}: checkpoint version {} is not supported".format(path, state["version"]))
+	if state["sampling_freq"] != sampling_freq or state["data_format"] != data_format:
+		raise ValueError("{}: the run sampled at {} Hz into a {} data file, not at {} Hz into a {} one".format(
+			path, state["sampling_freq"], state["data_format"], sampling_freq, data_format))
+
+	data_file = os.path.join(os.path.dirname(path), state["data_file"])
+	if os.path.getsize(data_file) < state["data_file_size"]:
+		raise ValueError("{}: {} is shorter than at the checkpoint".format(path, data_file))
+	with open(data_file, "r+b") as f:
+		f.truncate(state["data_file_size"])
+
+	checkpoint = RunCheckpoint(path, data_file, state["start_time"], sampling_freq, data_format,
+		sketch=latency_sketch.from_dict(state["sketch"]))
+	checkpoint.num_sessions = state["num_sessions"] + 1
+	checkpoint.num_tries = state["num_tries"]
+	checkpoint.num_packets_received = state["num_packets_received"]
+	checkpoint.num_packets_missed = state["num_packets_missed"]
+	checkpoint.num_packets_partial = state.get("num_packets_partial", 0)
+	checkpoint.num_acks_missed = state["num_acks_missed"]
+	checkpoint.num_samples_lost = state["num_samples_lost"]
+	checkpoint.num_samples_corrupted = state["num_samples_corrupted"]
+	checkpoint.packets_lost_samples = state["packets_lost_samples"]
+	checkpoint.packets_missed = state["packets_missed"]
+	checkpoint.stop_reason = state["stop_reason"]
+	if state.get("window_history") is not None:
+		checkpoint.window_history = latency_sketch.from_dict(state["window_history"])
+	return checkpoint
@@ -0,0 +1,358 @@
+"""
+	Record and replay of dwf call traces.
+
+	RecordingDwf wraps the dwf handle of a run (libdwf, or the simulated AD2) and logs every
+	call made through it to a compact binary trace: the function, its arguments, what it
+	returned, and the memory of every reference or array argument after the call (the device
+	handle, instrument states, sample counts, DIO pins, sample buffers). ReplayDwf feeds a trace
+	back: each call returns what the recorded one returned and fills its reference and array
+	arguments in with the recorded memory, without hardware. A run that misbehaved on the bench
+	replays through run(), _copy_buffer_samples and postprocess the same way every time, so it
+	can be debugged, benchmarked (bench_acq.py --replay) and kept as a regression fixture.
+
+	A replay is exact as long as the replaying run makes the same calls in the same order, which
+	it does when it is started with the same options: the acquisition loop decides what to call
+	next from what the device returned. Runs whose calls also depend on the host clock or on
+	thread scheduling (hardware-timed presses, --concurrent, --reader-thread) may make different
+	calls on replay; ReplayDwf raises TraceMismatch at the first call that differs from the trace.
+
+	File layout (little endian): magic "DWFT", format version (uint16), then records, each
+	starting with its kind (uint8):
+		KIND_NAME: function id (uint16), name length (uint16), name; defines the id of a function
+		KIND_CALL: function id (uint16), number of arguments (uint8), then the returned value
+			and every argument as values
+		KIND_NOTE: length (uint32), JSON; what the recording run wants to remember (options, inputs)
+	A value is a tag (uint8) followed by: nothing (TAG_NONE), an int64 (TAG_INT), a float64
+	(TAG_FLOAT), length (uint32) and bytes (TAG_BYTES), or raw length (uint32), compressed
+	length (uint32) and zlib-compressed bytes (TAG_ZBYTES).
+
+	Usage:
+		python acq.py acq_experiment_inputs.txt --record-trace run.dwft
+		python acq.py acq_experiment_inputs.txt --replay-trace run.dwft
+		python dwf_trace.py run.dwft
+"""
+
+from ctypes import Array, addressof, c_void_p, cast, memmove, sizeof, string_at
+import argparse
+import collections
+import json
+import struct
+import threading
+import zlib
+
+MAGIC = "DWFT"
+VERSION = 1
+_HEADER_STRUCT = struct.Struct("<4sH")
+
+# record kinds
+KIND_NAME = 1
+KIND_CALL = 2
+KIND_NOTE = 3
+
+# value tags
+TAG_NONE = 0
+TAG_INT = 1
+TAG_FLOAT = 2
+TAG_BYTES = 3
+TAG_ZBYTES = 4
+
+# payloads at least this long (bytes) are compressed
+COMPRESS_MIN_BYTES = 64
+
+# functions that fill only part of an array argument: {name: (array argument, argument holding the bytes written)}
+PARTIAL_ARRAYS = {
+	"FDwfDigitalInStatusData": (1, 2),
+}
+
+_U8 = struct.Struct("<B")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+_NAME_STRUCT = struct.Struct("<HH")
+_CALL_STRUCT = struct.Struct("<HB")
+_ZBYTES_STRUCT = struct.Struct("<II")
+
+class TraceMismatch(Exception):
+	"""The replaying run made a call the trace does not have next."""
+
+def _referenced(arg):
+	"""(address, bytes) of the memory the call may write through arg: an array, or a byref() (with
+	its offset) of a ctypes object; None for other arguments.
+	"""
+	if isinstance(arg, Array):
+		obj = arg
+	else:
+		obj = getattr(arg, "_obj", None)
+		if obj is None:
+			return None
+	address = cast(arg, c_void_p).value
+	return address, sizeof(obj) - (address - addressof(obj))
+
+def _scalar(arg):
+	"""Python value of arg (a number, or a ctypes number), or None."""
+	value = getattr(arg, "value", arg)
+	if isinstance(value, bool):
+		return int(value)
+	if isinstance(value, (int, long, float)):
+		return value
+	return None
+
+def _encode_bytes(data):
+	if len(data) >= COMPRESS_MIN_BYTES:
+		compressed = zlib.compress(data, 1)
+		if len(compressed) < len(data):
+			return _U8.pack(TAG_ZBYTES) + _U32.pack(len(data)) + _U32.pack(len(compressed)) + compressed
+	return _U8.pack(TAG_BYTES) + _U32.pack(len(data)) + data
+
+def _encode_value(value):
+	if isinstance(value, float):
+		return _U8.pack(TAG_FLOAT) + _F64.pack(value)
+	if isinstance(value, (int, long)):
+		return _U8.pack(TAG_INT) + _I64.pack(value)
+	return _U8.pack(TAG_NONE)
+
+
+class _RecordedFunction:
+	"""What RecordingDwf returns for a function: calls it and records the call.
+	argtypes and restype are set on the wrapped function, as on a ctypes function.
+	"""
+
+	def __init__(self, recorder, name, function):
+		self.__dict__["recorder"] = recorder
+		self.__dict__["name"] = name
+		self.__dict__["function"] = function
+
+	def __setattr__(self, name, value):
+		if name in ("argtypes", "restype"):
+			setattr(self.function, name, value)
+		self.__dict__[name] = value
+
+	def __call__(self, *args):
+		return self.recorder._call(self.name, self.function, args)
+
+
+class RecordingDwf:
+	"""Drop-in wrapper of a dwf handle that records every call to the trace at path."""
+
+	def __init__(self, dwf, path):
+		self.dwf = dwf
+		self.path = path
+		self._file = open(path, "wb")
+		self._file.write(_HEADER_STRUCT.pack(MAGIC, VERSION))
+		self._ids = {}
+		self._functions = {}
+		# calls of several threads are recorded in the order they were made
+		self._lock = threading.RLock()
+		self.num_calls = 0
+
+	def __getattr__(self, name):
+		if not name.startswith("FDwf"):
+			raise AttributeError(name)
+		function = self._functions.get(name)
+		if function is None:
+			function = _RecordedFunction(self, name, getattr(self.dwf, name))
+			self._functions[name] = function
+		return function
+
+	def __getitem__(self, name):
+		# a function object of its own, like dwf[name] of a ctypes library
+		return _RecordedFunction(self, name, self.dwf[name])
+
+	def note(self, obj):
+		"""Writes obj (anything json can write) to the trace, e.g. the options of the run."""
+		data = json.dumps(obj, sort_keys=True)
+		with self._lock:
+			self._file.write(_U8.pack(KIND_NOTE) + _U32.pack(len(data)) + data)
+
+	def close(self):
+		with self._lock:
+			if not self._file.closed:
+				self._file.close()
+
+	def _id(self, name):
+		function_id = self._ids.get(name)
+		if function_id is None:
+			function_id = len(self._ids)
+			self._ids[name] = function_id
+			self._file.write(_U8.pack(KIND_NAME) + _NAME_STRUCT.pack(function_id, len(name)) + name)
+		return function_id
+
+	def _call(self, name, function, args):
+		with self._lock:
+			result = function(*args)
+
+			record = [_U8.pack(KIND_CALL), _CALL_STRUCT.pack(self._id(name), len(args)), _encode_value(_scalar(result))]
+			partial = PARTIAL_ARRAYS.get(name)
+			for i, arg in enumerate(args):
+				memory = _referenced(arg)
+				if memory is None:
+					record.append(_encode_value(_scalar(arg)))
+					continue
+				address, num_bytes = memory
+				if partial is not None and partial[0] == i:
+					num_bytes = max(0, min(num_bytes, int(_scalar(args[partial[1]]) or 0)))
+				record.append(_encode_bytes(string_at(address, num_bytes)))
+			self._file.write("".join(record))
+			self.num_calls += 1
+		return result
+
+
+def _read_value(data, pos):
+	"""Returns the value at pos of data, and the position after it."""
+	tag = ord(data[pos])
+	pos += 1
+	if tag == TAG_NONE:
+		return None, pos
+	if tag == TAG_INT:
+		return _I64.unpack_from(data, pos)[0], pos + 8
+	if tag == TAG_FLOAT:
+		return _F64.unpack_from(data, pos)[0], pos + 8
+	if tag == TAG_BYTES:
+		length = _U32.unpack_from(data, pos)[0]
+		pos += 4
+		return data[pos:pos + length], pos + length
+	if tag == TAG_ZBYTES:
+		raw_length, length = _ZBYTES_STRUCT.unpack_from(data, pos)
+		pos += _ZBYTES_STRUCT.size
+		value = zlib.decompress(data[pos:pos + length])
+		assert len(value) == raw_length
+		return value, pos + length
+	raise ValueError("unknown value tag {}".format(tag))
+
+def read_trace(path):
+	"""Yields the records of the trace at path: ("call", name, result, [arguments]) and ("note", obj).
+	Reference and array arguments are the bytes of their memory after the call.
+	"""
+	with open(path, "rb") as f:
+		data = f.read()
+	if len(data) < _HEADER_STRUCT.size:
+		raise ValueError("{} is too short to be a dwf trace".format(path))
+	magic, version = _HEADER_STRUCT.unpack_from(data, 0)
+	if magic != MAGIC:
+		raise ValueError("{} is not a dwf trace".format(path))
+	if version != VERSION:
+		raise ValueError("{} has unsupported dwf trace version {}".format(path, version))
+
+	names = {}
+	pos = _HEADER_STRUCT.size
+	try:
+		while pos < len(data):
+			kind = ord(data[pos])
+			pos += 1
+			if kind == KIND_NAME:
+				function_id, length = _NAME_STRUCT.unpack_from(data, pos)
+				pos += _NAME_STRUCT.size
+				names[function_id] = data[pos:pos + length]
+				pos += length
+			elif kind == KIND_CALL:
+				function_id, num_args = _CALL_STRUCT.unpack_from(data, pos)
+				pos += _CALL_STRUCT.size
+				result, pos = _read_value(data, pos)
+				args = []
+				for i in range(num_args):
+					arg, pos = _read_value(data, pos)
+					args.append(arg)
+				yield ("call", names[function_id], result, args)
+			elif kind == KIND_NOTE:
+				length = _U32.unpack_from(data, pos)[0]
+				pos += 4
+				yield ("note", json.loads(data[pos:pos + length]))
+				pos += length
+			else:
+				raise ValueError("unknown record kind {}".format(kind))
+	except (struct.error, IndexError):
+		# a run that was killed leaves a partly written last record
+		raise EOFError("{} ends in the middle of a record".format(path))
+
+
+class _ReplayedFunction:
+	"""What ReplayDwf returns for a function: replays the next call of the trace."""
+
+	def __init__(self, replay, name):
+		self.replay = replay
+		self.name = name
+		self.argtypes = None
+		self.restype = None
+
+	def __call__(self, *args):
+		return self.replay._call(self.name, args)
+
+
+class ReplayDwf:
+	"""Drop-in replacement for the dwf handle that replays the trace at path.
+
+	With strict, the number arguments of every call (channel masks, dividers, trigger settings...)
+	must also be the recorded ones; otherwise only the functions called are checked.
+	notes are the notes of the trace, in order.
+	"""
+
+	def __init__(self, path, strict=False):
+		self.path = path
+		self.strict = strict
+		self.notes = []
+		self._records = read_trace(path)
+		self._next_call = None
+		self.num_calls = 0
+		self._advance()
+
+	def __getattr__(self, name):
+		if not name.startswith("FDwf"):
+			raise AttributeError(name)
+		return _ReplayedFunction(self, name)
+
+	def __getitem__(self, name):
+		return _ReplayedFunction(self, name)
+
+	def done(self):
+		"""Whether every call of the trace was replayed."""
+		return self._next_call is None
+
+	def _advance(self):
+		"""Reads up to the next call, collecting the notes on the way."""
+		self._next_call = None
+		for record in self._records:
+			if record[0] == "note":
+				self.notes.append(record[1])
+			else:
+				self._next_call = record
+				return
+
+	def _call(self, name, args):
+		if self._next_call is None:
+			raise TraceMismatch("call {} ({}) after the end of the trace".format(self.num_calls + 1, name))
+		recorded_name, result, recorded_args = self._next_call[1:]
+		if name != recorded_name or len(args) != len(recorded_args):
+			raise TraceMismatch("call {} is {} with {} arguments, the trace has {} with {}".format(
+				self.num_calls + 1, name, len(args), recorded_name, len(recorded_args)))
+
+		for i, (arg, recorded) in enumerate(zip(args, recorded_args)):
+			memory = _referenced(arg)
+			if memory is not None:
+				if recorded:
+					memmove(memory[0], recorded, min(len(recorded), memory[1]))
+			elif self.strict and _scalar(arg) != recorded:
+				raise TraceMismatch("call {} ({}): argument {} is {}, the trace has {}".format(
+					self.num_calls + 1, name, i, _scalar(arg), recorded))
+
+		self.num_calls += 1
+		self._advance()
+		return result
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Summarize a dwf call trace.")
+	parser.add_argument("trace", help="trace written by acq.py --record-trace")
+	args = parser.parse_args()
+
+	counts = collections.Counter()
+	payload_bytes = 0
+	for record in read_trace(args.trace):
+		if record[0] == "note":
+			print "note: {}".format(json.dumps(record[1], sort_keys=True))
+			continue
+		counts[record[1]] += 1
+		payload_bytes += sum(len(arg) for arg in record[3] if isinstance(arg, str))
+
+	print "{} calls, {} bytes of reference and array arguments".format(sum(counts.values()), payload_bytes)
+	for name, count in counts.most_common():
+		print "  {:<36} {:>10}".format(name, count)
@@ -0,0 +1,220 @@
+"""
+	Compact binary edge log: the same information as the raw data csv written by acq.py,
+	as fixed-width records that can be memory-mapped instead of parsed.
+
+	File layout (little endian):
+		header (HEADER_SIZE bytes):
+			magic "LLEL", format version (uint16), header size (uint16),
+			sampling frequency in Hz (float64),
+			channel map as bit masks (uint16 each): button press, button press mirror,
+			packet created, packet received,
+			flags (uint16), padding
+		records (RECORD_DTYPE, 11 bytes each):
+			packet (int32, negative for packets the test harness thinks were missed),
+			sample offset (uint32), sample (uint16), flags (uint8, FLAG_ACK_MISSED)
+
+	The latency column of the csv is not stored; it is offset * 1000 / sampling frequency.
+
+	Usage:
+		python edge_log.py to-bin [data csv] [edge log] [--inputs acq_experiment_inputs.txt] [--sampling-freq F]
+		python edge_log.py to-csv [edge log] [data csv]
+"""
+
+import argparse
+import numpy as np
+import os
+import struct
+import sys
+
+EDGE_LOG_EXTENSION = ".bin"
+
+MAGIC = "LLEL"
+VERSION = 1
+HEADER_SIZE = 32
+_HEADER_STRUCT = struct.Struct("<4sHHdHHHHH")
+
+RECORD_DTYPE = np.dtype([("packet", "<i4"), ("offset", "<u4"), ("sample", "<u2"), ("flags", "u1")])
+
+# record flags
+FLAG_ACK_MISSED = 0x01
+
+# header flags
+# the csv this log was converted from had no ack_missed column (files written before it existed)
+HEADER_FLAG_NO_ACK_COLUMN = 0x0001
+
+CSV_HEADER = "Packet, Sample offset, Latency (ms), Sample, ack_missed=1\n"
+CSV_HEADER_NO_ACK_COLUMN = "Packet, Sample offset, Latency (ms), Sample\n"
+
+CHANNEL_MAP_KEYS = ("button_press_bit", "button_press_mirror_bit", "packet_created_bit", "packet_received_bits")
+
+def write_header(path, sampling_freq, channel_map, flags=0):
+	"""Creates (or truncates) the edge log at path and writes its header.
+	channel_map is a dict with the bit masks named in CHANNEL_MAP_KEYS (missing ones are stored as 0).
+	"""
+	masks = [channel_map.get(key, 0) for key in CHANNEL_MAP_KEYS]
+	header = _HEADER_STRUCT.pack(MAGIC, VERSION, HEADER_SIZE, float(sampling_freq), masks[0], masks[1], masks[2], masks[3], flags)
+	with open(path, "wb") as f:
+		f.write(header.ljust(HEADER_SIZE, "\0"))
+
+def read_header(path):
+	"""Returns the header of the edge log at path as a dict."""
+	with open(path, "rb") as f:
+		raw = f.read(HEADER_SIZE)
+	if len(raw) < _HEADER_STRUCT.size:
+		raise ValueError("{} is too short to be an edge log".format(path))
+
+	fields = _HEADER_STRUCT.unpack(raw[:_HEADER_STRUCT.size])
+	if fields[0] != MAGIC:
+		raise ValueError("{} is not an edge log".format(path))
+	if fields[1] != VERSION:
+		raise ValueError("{} has unsupported edge log version {}".format(path, fields[1]))
+
+	header = {
+		"header_size": fields[2],
+		"sampling_freq": fields[3],
+		"channel_map": dict(zip(CHANNEL_MAP_KEYS, fields[4:8])),
+		"flags": fields[8],
+	}
+	return header
+
+def append_edges(path, attempt_number, ack_missed, offsets, samples):
+	"""Appends the edges of one packet (the arrays returned by extract_edges) to the edge log at path."""
+	records = np.empty(len(offsets), dtype=RECORD_DTYPE)
+	records["packet"] = attempt_number
+	records["offset"] = offsets
+	records["sample"] = samples
+	if ack_missed:
+		records["flags"] = FLAG_ACK_MISSED
+	else:
+		records["flags"] = 0
+
+	with open(path, "ab") as f:
+		f.write(records.tostring())
+
+def read_edge_log(path):
+	"""Returns (header, records) for the edge log at path.
+	records is a read-only memory-mapped array of RECORD_DTYPE; nothing is parsed or copied.
+	"""
+	header = read_header(path)
+	num_records = (os.path.getsize(path) - header["header_size"]) // RECORD_DTYPE.itemsize
+	if num_records == 0:
+		return header, np.zeros(0, dtype=RECORD_DTYPE)
+	records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=header["header_size"], shape=(num_records,))
+	return header, records
+
+def latencies_ms(header, records):
+	"""Latency (ms) of every record."""
+	return records["offset"] * (1000.0 / header["sampling_freq"])
+
+def sample_str(sample):
+	"""Formats a sample the way acq.py writes it to the csv."""
+	num_bin_str = "{}".format(bin(sample))[2:].zfill(16)
+	return "".join(["{} ".format(num_bin_str[4*i:4*(i+1)]) for i in xrange(4)])
+
+def _infer_sampling_freq(rows):
+	"""Recovers the sampling frequency from the offset and latency columns of a data csv."""
+	for row in rows:
+		offset, latency = int(row[1]), float(row[2])
+		if offset > 0 and latency > 0:
+			return int(round(1000.0 * offset / latency))
+	raise ValueError("cannot infer the sampling frequency: no record has a nonzero offset; pass it explicitly")
+
+def csv_to_edge_log(csv_path, log_path, sampling_freq=None, channel_map=None):
+	"""Converts a raw data csv written by acq.py to an edge log.
+	If sampling_freq is not given it is inferred from the offset and latency columns.
+	Returns the number of records converted.
+	"""
+	with open(csv_path) as f:
+		lines = f.readlines()
+
+	if not lines or lines[0] not in (CSV_HEADER, CSV_HEADER_NO_ACK_COLUMN):
+		raise ValueError("{} is not a raw data csv in the format written by acq.py".format(csv_path))
+	rows = [line.strip().split(", ") for line in lines[1:] if line.strip()]
+	has_ack_column = lines[0] == CSV_HEADER
+
+	if sampling_freq is None:
+		sampling_freq = _infer_sampling_freq(rows)
+
+	flags = 0
+	if not has_ack_column:
+		flags |= HEADER_FLAG_NO_ACK_COLUMN
+	write_header(log_path, sampling_freq, channel_map or {}, flags)
+
+	records = np.empty(len(rows), dtype=RECORD_DTYPE)
+	records["packet"] = [int(row[0]) for row in rows]
+	records["offset"] = [int(row[1]) for row in rows]
+	records["sample"] = [int(row[3].replace(" ", ""), 2) for row in rows]
+	if has_ack_column:
+		records["flags"] = [int(row[4]) * FLAG_ACK_MISSED for row in rows]
+	else:
+		records["flags"] = 0
+
+	with open(log_path, "ab") as f:
+		f.write(records.tostring())
+	return len(rows)
+
+def edge_log_to_csv(log_path, csv_path):
+	"""Converts an edge log back to the raw data csv format written by acq.py.
+	Returns the number of records converted.
+	"""
+	header, records = read_edge_log(log_path)
+	period_ms = 1000.0 / header["sampling_freq"]
+	has_ack_column = not (header["flags"] & HEADER_FLAG_NO_ACK_COLUMN)
+
+	with open(csv_path, "w") as f:
+		if has_ack_column:
+			f.write(CSV_HEADER)
+		else:
+			f.write(CSV_HEADER_NO_ACK_COLUMN)
+
+		lines = []
+		for packet, offset, sample, flags in zip(records["packet"].tolist(), records["offset"].tolist(), records["sample"].tolist(), records["flags"].tolist()):
+			line = "{}, {}, {}, {}".format(packet, offset, offset * period_ms, sample_str(sample))
+			if has_ack_column:
+				line += ", {}".format(flags & FLAG_ACK_MISSED)
+			lines.append(line + "\n")
+		f.writelines(lines)
+	return len(records)
+
+def channel_map_from_inputs(input_file):
+	"""Builds a channel map from an acq_experiment_inputs.txt style file."""
+	with open(input_file) as f:
+		params = [[int(i) for i in line.strip().split(", ")] for line in f if line.strip()]
+
+	received_bits = 0
+	for ch in params[0][2:]:
+		received_bits |= 1 << ch
+	return {
+		"button_press_bit": 1 << params[1][0],
+		"button_press_mirror_bit": 1 << params[0][0],
+		"packet_created_bit": 1 << params[0][1],
+		"packet_received_bits": received_bits,
+	}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Convert between raw data csv files and binary edge logs.")
+	subparsers = parser.add_subparsers(dest="command")
+
+	to_bin = subparsers.add_parser("to-bin", help="convert a raw data csv to an edge log")
+	to_bin.add_argument("csv_file")
+	to_bin.add_argument("log_file")
+	to_bin.add_argument("--inputs", help="acq_experiment_inputs.txt the data was taken with, for the channel map")
+	to_bin.add_argument("--sampling-freq", type=int, help="sampling frequency (Hz); inferred from the csv if omitted")
+
+	to_csv = subparsers.add_parser("to-csv", help="convert an edge log to a raw data csv")
+	to_csv.add_argument("log_file")
+	to_csv.add_argument("csv_file")
+
+	args = parser.parse_args()
+
+	if args.command == "to-bin":
+		channel_map = None
+		if args.inputs:
+			channel_map = channel_map_from_inputs(args.inputs)
+		num_records = csv_to_edge_log(args.csv_file, args.log_file, args.sampling_freq, channel_map)
+	else:
+		num_records = edge_log_to_csv(args.log_file, args.csv_file)
+	print "converted {} records".format(num_records)
+
+	sys.exit(0)
@@ -0,0 +1,752 @@
+"""
+	Simulated AD2: a pure-Python stand-in for the libdwf calls made by acq.py,
+	one_to_one_acquisition.py and one_to_many_acq.py, so the acquisition loop can be run,
+	profiled and regression-tested without hardware.
+
+	The fake keeps a timeline of the 16 DIO pins. The pins driven by the AD2 (DigitalIO and
+	DigitalOut outputs) change when the script sets them; the pins driven by the motes change
+	in response to a button press, as modelled by SimulatedNetwork: the mirror channel follows
+	the press, the packet creation channel toggles, and every packet reception channel toggles
+	after a latency drawn from the TSCH model in openwsn_simulate.py (or never, if the packet is lost).
+	DigitalIn samples that timeline in record mode, with the trigger, prefill and trigger position
+	semantics acq.py relies on, through a device FIFO that overflows (cLost) when the host does not
+	read it fast enough. Extra lost and corrupted samples can be injected at random.
+
+	Device time advances with the wall clock (scaled by time_scale) and every call costs
+	usb_latency seconds of device time. With time_scale=0 only the calls advance the clock, so a
+	run is deterministic for a given seed.
+
+	Usage:
+		import acq, fake_dwf
+		acq.dwf = fake_dwf.FakeDwf(fake_dwf.networks_from_inputs("acq_experiment_inputs.txt"))
+	or
+		python acq.py acq_experiment_inputs.txt --simulate
+"""
+
+from ctypes import *
+from dwfconstants import *
+from timeit import default_timer
+import collections
+import heapq
+import numpy as np
+import openwsn_simulate
+import threading
+
+# DigitalIn internal clock; the divider counts ticks of it and the timeline is kept in ticks
+TICKS_PER_SECOND = 100000000
+
+FAKE_VERSION = "fake"
+
+# what clears a wedged DigitalIn (see FakeDwf hang_rate), weakest first
+HANG_ACTIONS = ["rearm", "reset", "reopen"]
+
+def _value(arg):
+	"""Python value of a ctypes scalar argument (or of a plain Python number)."""
+	return getattr(arg, "value", arg)
+
+def _out(ref, ctype):
+	"""The ctypes object that an out parameter (byref(...), pointer or array) points to, as ctype."""
+	return ctype.from_address(cast(ref, c_void_p).value)
+
+def _ticks(seconds):
+	return int(round(seconds * TICKS_PER_SECOND))
+
+
+class TschLatencyModel:
+	"""Packet latencies from the TSCH model in openwsn_simulate.py."""
+
+	def __init__(self, active_slots=1, pdr=openwsn_simulate.pdr, seed=None):
+		self.active_slots = active_slots
+		self.pdr = pdr
+		self.rng = np.random.RandomState(seed)
+		self._asn = -1
+
+	def next_latency(self):
+		"""Seconds from button press to packet reception, or None if the packet is lost."""
+		self._asn, latency = openwsn_simulate.simulate_packet(self._asn, self.active_slots, self.pdr, self.rng)
+		if latency is None:
+			return None
+		return latency * 0.001
+
+
+class SimulatedNetwork:
+	"""The motes of one network, as seen on the DIO pins.
+
+	On a rising edge of the button press channel, the mirror channel goes high for mirror_width
+	seconds, the packet creation channel toggles after create_delay seconds, and every packet
+	reception channel toggles after its own latency from latency_model.
+	The creation channel toggles back with the first reception (the ack), unless the ack is
+	lost (probability ack_loss).
+	"""
+
+	def __init__(self, button_channel, mirror_channel, created_channel, received_channels, latency_model=None,
+			mirror_delay=1e-6, mirror_width=90e-6, create_delay=20e-6, ack_loss=0, seed=None):
+		self.button_channel = button_channel
+		self.mirror_channel = mirror_channel
+		self.created_channel = created_channel
+		self.received_channels = list(received_channels)
+		if latency_model is None:
+			latency_model = TschLatencyModel(seed=seed)
+		self.latency_model = latency_model
+
+		self.mirror_delay = mirror_delay
+		self.mirror_width = mirror_width
+		self.create_delay = create_delay
+		self.ack_loss = ack_loss
+		self.rng = np.random.RandomState(seed)
+
+		# statistics
+		self.num_presses = 0
+		self.num_lost = 0
+		self.latencies = []
+
+	def press(self, device, tick):
+		"""Schedules the response to a button press at tick on device."""
+		self.num_presses += 1
+		mirror_bit = 1 << self.mirror_channel
+		created_bit = 1 << self.created_channel
+
+		mirror_tick = tick + max(1, _ticks(self.mirror_delay))
+		device.schedule(mirror_tick, device.set_network_pins, mirror_bit, mirror_bit)
+		device.schedule(mirror_tick + max(1, _ticks(self.mirror_width)), device.set_network_pins, mirror_bit, 0)
+		device.schedule(tick + max(1, _ticks(self.create_delay)), device.toggle_network_pins, created_bit)
+
+		reception_ticks = []
+		for channel in self.received_channels:
+			latency = self.latency_model.next_latency()
+			if latency is None:
+				self.num_lost += 1
+				continue
+			self.latencies.append(latency)
+			reception_tick = tick + max(1, _ticks(latency))
+			reception_ticks.append(reception_tick)
+			device.schedule(reception_tick, device.toggle_network_pins, 1 << channel)
+
+		if reception_ticks and self.rng.random_sample() >= self.ack_loss:
+			# scheduled before the receptions, so it lands in the same sample as the first of them
+			device.schedule(min(reception_ticks), device.toggle_network_pins, created_bit, first=True)
+
+
+class _FakeDigitalIn:
+	"""DigitalIn in record mode: samples the pin timeline into a FIFO the host drains."""
+
+	def __init__(self, fifo_samples):
+		self.fifo_samples = fifo_samples
+		self.reset()
+		self.state = DwfStateReady.value
+
+		self._fifo = collections.deque()
+		self._fifo_count = 0
+		self._lost = 0
+		self._corrupted = 0
+
+		self._fetched = []
+		self._fetched_count = 0
+		self.status_record = (0, 0, 0)
+
+	def reset(self):
+		self.acquisition_mode = acqmodeRecord.value
+		self.divider = 1
+		self.trigger_source = trigsrcNone.value
+		self.trigger_low = 0
+		self.trigger_high = 0
+		self.trigger_rise = 0
+		self.trigger_fall = 0
+		self.trigger_position = 0
+		self.trigger_prefill = 0
+		self.state = DwfStateReady.value
+
+	def arm(self, tick, word):
+		if self.acquisition_mode != acqmodeRecord.value:
+			raise NotImplementedError("the fake AD2 only simulates record acquisitions")
+		self._origin = tick
+		self._last_word = word
+		self._next_sample = 0
+		self._recorded = 0
+		self._fifo.clear()
+		self._fifo_count = 0
+		self._lost = 0
+		self._corrupted = 0
+
+		if self.trigger_source == trigsrcNone.value:
+			self._record_end = self.trigger_position
+			self.state = DwfStateTriggered.value
+		elif self.trigger_prefill > 0:
+			self.state = DwfStatePrefill.value
+		else:
+			self.state = DwfStateArmed.value
+
+	def stop(self):
+		self.state = DwfStateReady.value
+
+	def segment(self, start, end, word):
+		"""The pins held word from tick start up to (not including) tick end."""
+		if self.state in (DwfStateReady.value, DwfStateDone.value):
+			return
+		# samples k of the record are taken at ticks origin + k * divider
+		first = max(self._next_sample, -((self._origin - start) // self.divider))
+		stop = -((self._origin - end) // self.divider)
+		if stop <= first:
+			# no sample sees this segment
+			return
+		previous_word, self._last_word = self._last_word, word
+		self._next_sample = stop
+
+		if self.state == DwfStatePrefill.value:
+			self._record(word, min(stop, self.trigger_prefill) - first)
+			if stop <= self.trigger_prefill:
+				return
+			first = max(first, self.trigger_prefill)
+			# an edge at the start of the segment happened during the prefill
+			previous_word = word
+			self.state = DwfStateArmed.value
+
+		if self.state == DwfStateArmed.value:
+			edge = (word & ~previous_word & self.trigger_rise) or (~word & previous_word & self.trigger_fall)
+			level = (self.trigger_low or self.trigger_high) and (word & self.trigger_high) == self.trigger_high and (~word & self.trigger_low) == self.trigger_low
+			if not (edge or level):
+				if self.trigger_prefill > 0:
+					self._record(word, stop - first)
+				return
+
+			self.state = DwfStateTriggered.value
+			self._record_end = self._recorded + self.trigger_position
+			if self.trigger_prefill == 0 and first > 0:
+				# the record starts one sample before the trigger
+				self._record_end += 1
+				self._record(previous_word, 1)
+
+		self._record(word, stop - first)
+
+	def _record(self, word, count):
+		if self.state == DwfStateTriggered.value:
+			count = min(count, self._record_end - self._recorded)
+		if count <= 0:
+			return
+		self._fifo.append([word, count])
+		self._fifo_count += count
+		self._recorded += count
+
+		if self.state == DwfStateTriggered.value and self._recorded >= self._record_end:
+			self.state = DwfStateDone.value
+
+		# the device FIFO overflows when the host does not read it fast enough
+		while self._fifo_count > self.fifo_samples:
+			overflow = self._fifo_count - self.fifo_samples
+			run = self._fifo[0]
+			dropped = min(run[1], overflow)
+			run[1] -= dropped
+			if run[1] == 0:
+				self._fifo.popleft()
+			self._fifo_count -= dropped
+			self._lost += dropped
+
+	def fetch(self, rng, lost_rate, corrupted_rate):
+		"""Moves the FIFO contents to the host (FDwfDigitalInStatus with read data)."""
+		runs = list(self._fifo)
+		count = self._fifo_count
+		lost = self._lost
+		corrupted = self._corrupted
+		self._fifo.clear()
+		self._fifo_count = 0
+		self._lost = 0
+		self._corrupted = 0
+
+		if count > 0 and lost_rate and rng.random_sample() < lost_rate:
+			dropped = rng.randint(1, count + 1)
+			lost += dropped
+			count -= dropped
+			while dropped > 0:
+				run = runs[0]
+				n = min(run[1], dropped)
+				run[1] -= n
+				dropped -= n
+				if run[1] == 0:
+					runs.pop(0)
+		if count > 0 and corrupted_rate and rng.random_sample() < corrupted_rate:
+			corrupted += rng.randint(1, count + 1)
+
+		self._fetched = runs
+		self._fetched_count = count
+		self.status_record = (count, lost, corrupted)
+
+	def fetched_samples(self, num_samples):
+		"""The first num_samples fetched samples as a uint16 array."""
+		num_samples = min(num_samples, self._fetched_count)
+		samples = np.empty(num_samples, dtype=np.uint16)
+		index = 0
+		for word, count in self._fetched:
+			if index >= num_samples:
+				break
+			n = min(count, num_samples - index)
+			samples[index:index + n] = word
+			index += n
+		return samples
+
+
+class _FakeDigitalOut:
+	"""DigitalOut playing constant levels: every enabled channel is at its counter init level
+	for run seconds, after wait seconds, repeat times; then at its idle level."""
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.enabled = 0
+		self.idle = {}
+		self.init_high = {}
+		self.counters = {}
+		self.run = 0
+		self.wait = 0
+		self.repeat = 0
+		# playouts that are still scheduled ignore their events once this changes
+		self.generation = getattr(self, "generation", 0) + 1
+
+	def channels(self):
+		return [channel for channel in range(16) if self.enabled & (1 << channel)]
+
+	def running_bits(self):
+		bits = 0
+		for channel in self.channels():
+			if self.counters.get(channel, (0, 0)) != (0, 0):
+				raise NotImplementedError("the fake AD2 only simulates constant DigitalOut levels")
+			if self.init_high.get(channel, 0):
+				bits |= 1 << channel
+		return bits
+
+	def idle_bits(self):
+		bits = 0
+		for channel in self.channels():
+			idle = self.idle.get(channel, DwfDigitalOutIdleInit.value)
+			if idle == DwfDigitalOutIdleHigh.value or (idle == DwfDigitalOutIdleInit.value and self.init_high.get(channel, 0)):
+				bits |= 1 << channel
+		return bits
+
+
+class _BoundCall:
+	"""What dwf[name] returns for the fake: a callable that accepts argtypes/restype like a ctypes function."""
+
+	def __init__(self, function):
+		self.function = function
+		self.argtypes = None
+		self.restype = c_int
+
+	def __call__(self, *args):
+		return self.function(*args)
+
+
+class FakeDwf:
+	"""Drop-in replacement for the ctypes libdwf handle (the global dwf of the acquisition scripts).
+
+	networks: SimulatedNetwork objects wired to the device
+	time_scale: device seconds per wall clock second (0: device time only advances with calls,
+	which needs a usb_latency)
+	usb_latency: device seconds every call takes
+	fifo_samples: DigitalIn FIFO size; samples beyond it are lost if the host does not read them
+	lost_rate, corrupted_rate: probability that a data fetch reports an injected burst of lost or corrupted samples
+	num_devices: devices FDwfEnum reports; whichever is opened is the one simulated
+	hang_rate: probability that a data fetch wedges DigitalIn, which then delivers no samples and keeps
+	its state until hang_clears: "rearm" (FDwfDigitalInConfigure), "reset" (FDwfDigitalInReset) or
+	"reopen" (FDwfDeviceOpen)
+	"""
+
+	def __init__(self, networks, time_scale=1.0, usb_latency=0, fifo_samples=4096, lost_rate=0, corrupted_rate=0, seed=None, num_devices=1,
+			hang_rate=0, hang_clears="rearm"):
+		if time_scale == 0 and usb_latency == 0:
+			# device time would never advance, and every wait for a sample would spin forever
+			raise ValueError("time_scale 0 needs a usb_latency")
+		self.networks = list(networks)
+		self.num_devices = num_devices
+		self.time_scale = time_scale
+		self.usb_latency = usb_latency
+		self.lost_rate = lost_rate
+		self.corrupted_rate = corrupted_rate
+		self.hang_rate = hang_rate
+		self.hang_clears = hang_clears
+		# whether DigitalIn is wedged (see hang_rate), and the state it reports meanwhile
+		self.hung = False
+		self._hung_state = None
+		# hangs injected so far
+		self.num_hangs = 0
+		self.rng = np.random.RandomState(seed)
+
+		self.device_open = False
+		self.device_index = -1
+		self.num_calls = collections.Counter()
+
+		self._start = default_timer()
+		self._virtual_time = 0.0
+		self._last_tick = 0
+
+		# pin timeline: pending events, and the pin word since _word_tick
+		self._events = []
+		self._event_seq = 0
+		self._word = 0
+		self._word_tick = 0
+
+		self._dio_enable = 0
+		self._dio_output = 0
+		self._dio_input = 0
+		self._dout_bits = 0
+		self._network_bits = 0
+
+		self.digital_in = _FakeDigitalIn(fifo_samples)
+		self.digital_out = _FakeDigitalOut()
+		# held by every FDwf* call, so several threads may call into the fake, as they may into libdwf
+		self._lock = threading.RLock()
+
+	def __getitem__(self, name):
+		return _BoundCall(getattr(self, name))
+
+	##### device clock and pin timeline #####
+
+	def now(self):
+		"""Current device time in ticks."""
+		if self.time_scale > 0:
+			tick = _ticks((default_timer() - self._start) * self.time_scale)
+		else:
+			tick = _ticks(self._virtual_time)
+		self._last_tick = max(self._last_tick, tick)
+		return self._last_tick
+
+	def _call(self, name):
+		"""Accounts for one call: its USB latency, then brings the pin timeline up to date. Returns the tick."""
+		self.num_calls[name] += 1
+		if self.usb_latency > 0:
+			if self.time_scale > 0:
+				deadline = default_timer() + self.usb_latency / self.time_scale
+				while default_timer() < deadline:
+					pass
+			else:
+				self._virtual_time += self.usb_latency
+		tick = self.now()
+		self._advance(tick)
+		return tick
+
+	def schedule(self, tick, function, *args, **kwargs):
+		"""Calls function(*args) when the timeline reaches tick. Events at the same tick run in
+		the order they were scheduled, except that first=True ones run before the others."""
+		self._event_seq += 1
+		seq = -self._event_seq if kwargs.get("first") else self._event_seq
+		heapq.heappush(self._events, (tick, seq, function, args))
+
+	def set_network_pins(self, mask, bits):
+		self._network_bits = (self._network_bits & ~mask) | (bits & mask)
+
+	def toggle_network_pins(self, mask):
+		self._network_bits ^= mask
+
+	def _pins(self):
+		return ((self._dio_output & self._dio_enable) | self._dout_bits | self._network_bits) & 0xFFFF
+
+	def _advance(self, tick):
+		"""Applies every event up to and including tick, feeding DigitalIn the pin levels in between."""
+		while self._events and self._events[0][0] <= tick:
+			event_tick = self._events[0][0]
+			self.digital_in.segment(self._word_tick, event_tick, self._word)
+
+			previous_word = self._word
+			while self._events and self._events[0][0] == event_tick:
+				function, args = heapq.heappop(self._events)[2:]
+				function(*args)
+			self._word = self._pins()
+			self._word_tick = max(self._word_tick, event_tick)
+
+			rising = self._word & ~previous_word
+			for network in self.networks:
+				if rising & (1 << network.button_channel):
+					network.press(self, event_tick)
+
+		if tick > self._word_tick:
+			self.digital_in.segment(self._word_tick, tick, self._word)
+			self._word_tick = tick
+
+	def _host_event(self, name, function, *args):
+		"""A change the script makes to the AD2 outputs, effective now."""
+		tick = self._call(name)
+		self.schedule(tick, function, *args)
+		self._advance(tick)
+
+	##### device #####
+
+	def FDwfGetVersion(self, version):
+		self.num_calls["FDwfGetVersion"] += 1
+		version.value = FAKE_VERSION
+		return 1
+
+	def FDwfEnum(self, enum_filter, num_devices):
+		self.num_calls["FDwfEnum"] += 1
+		_out(num_devices, c_int).value = self.num_devices
+		return 1
+
+	def FDwfEnumDeviceName(self, device_index, name):
+		self.num_calls["FDwfEnumDeviceName"] += 1
+		name.value = "Analog Discovery 2 (simulated)"
+		return 1
+
+	def FDwfEnumSN(self, device_index, serial):
+		self.num_calls["FDwfEnumSN"] += 1
+		serial.value = "SN:FAKE{:04d}".format(_value(device_index))
+		return 1
+
+	def FDwfEnumDeviceIsOpened(self, device_index, in_use):
+		self.num_calls["FDwfEnumDeviceIsOpened"] += 1
+		_out(in_use, c_int).value = int(self.device_open and _value(device_index) == self.device_index)
+		return 1
+
+	def FDwfDeviceOpen(self, device_index, hdwf):
+		self._call("FDwfDeviceOpen")
+		device_index = _value(device_index)
+		if device_index == -1:
+			device_index = 0
+		if self.device_open or device_index >= self.num_devices:
+			_out(hdwf, c_int).value = 0
+			return 0
+		self.device_open = True
+		self.device_index = device_index
+		self._clear_hang("reopen")
+		_out(hdwf, c_int).value = 1
+		return 1
+
+	def FDwfDeviceClose(self, hdwf):
+		self._call("FDwfDeviceClose")
+		self.device_open = False
+		return 1
+
+	def FDwfDeviceCloseAll(self):
+		self._call("FDwfDeviceCloseAll")
+		self.device_open = False
+		return 1
+
+	##### DigitalIO #####
+
+	def FDwfDigitalIOReset(self, *hdwf):
+		self._host_event("FDwfDigitalIOReset", self._set_dio, 0, 0)
+		return 1
+
+	def _set_dio(self, enable, output):
+		self._dio_enable = enable
+		self._dio_output = output
+
+	def FDwfDigitalIOOutputEnableSet(self, hdwf, enable):
+		self._host_event("FDwfDigitalIOOutputEnableSet", self._set_dio, _value(enable) & 0xFFFF, self._dio_output)
+		return 1
+
+	def FDwfDigitalIOOutputEnableGet(self, hdwf, enable):
+		self._call("FDwfDigitalIOOutputEnableGet")
+		_out(enable, c_uint32).value = self._dio_enable
+		return 1
+
+	def FDwfDigitalIOOutputSet(self, hdwf, output):
+		self._host_event("FDwfDigitalIOOutputSet", self._set_dio, self._dio_enable, _value(output) & 0xFFFF)
+		return 1
+
+	def FDwfDigitalIOStatus(self, hdwf):
+		self._call("FDwfDigitalIOStatus")
+		self._dio_input = self._word
+		return 1
+
+	def FDwfDigitalIOInputStatus(self, hdwf, pins):
+		self.num_calls["FDwfDigitalIOInputStatus"] += 1
+		_out(pins, c_uint16).value = self._dio_input
+		return 1
+
+	##### DigitalIn #####
+
+	def FDwfDigitalInInternalClockInfo(self, hdwf, frequency):
+		self.num_calls["FDwfDigitalInInternalClockInfo"] += 1
+		_out(frequency, c_double).value = TICKS_PER_SECOND
+		return 1
+
+	def FDwfDigitalInBufferSizeInfo(self, hdwf, size):
+		self.num_calls["FDwfDigitalInBufferSizeInfo"] += 1
+		_out(size, c_int).value = self.digital_in.fifo_samples
+		return 1
+
+	def FDwfDigitalInReset(self, hdwf):
+		self._call("FDwfDigitalInReset")
+		self._clear_hang("reset")
+		self.digital_in.reset()
+		return 1
+
+	def FDwfDigitalInAcquisitionModeSet(self, hdwf, mode):
+		self._call("FDwfDigitalInAcquisitionModeSet")
+		self.digital_in.acquisition_mode = _value(mode)
+		return 1
+
+	def FDwfDigitalInDividerSet(self, hdwf, divider):
+		self._call("FDwfDigitalInDividerSet")
+		self.digital_in.divider = max(1, _value(divider))
+		return 1
+
+	def FDwfDigitalInSampleFormatSet(self, hdwf, num_bits):
+		self._call("FDwfDigitalInSampleFormatSet")
+		if _value(num_bits) != 16:
+			raise NotImplementedError("the fake AD2 only simulates 16 bit samples")
+		return 1
+
+	def FDwfDigitalInTriggerPositionSet(self, hdwf, num_samples):
+		self._call("FDwfDigitalInTriggerPositionSet")
+		self.digital_in.trigger_position = _value(num_samples)
+		return 1
+
+	def FDwfDigitalInTriggerPrefillSet(self, hdwf, num_samples):
+		self._call("FDwfDigitalInTriggerPrefillSet")
+		self.digital_in.trigger_prefill = _value(num_samples)
+		return 1
+
+	def FDwfDigitalInTriggerSourceSet(self, hdwf, source):
+		self._call("FDwfDigitalInTriggerSourceSet")
+		self.digital_in.trigger_source = _value(source)
+		return 1
+
+	def FDwfDigitalInTriggerSet(self, hdwf, level_low, level_high, edge_rise, edge_fall):
+		self._call("FDwfDigitalInTriggerSet")
+		self.digital_in.trigger_low = _value(level_low)
+		self.digital_in.trigger_high = _value(level_high)
+		self.digital_in.trigger_rise = _value(edge_rise)
+		self.digital_in.trigger_fall = _value(edge_fall)
+		return 1
+
+	def FDwfDigitalInConfigure(self, hdwf, reconfigure, start):
+		tick = self._call("FDwfDigitalInConfigure")
+		self._clear_hang("rearm")
+		if self.hung:
+			return 1
+		if _value(start):
+			self.digital_in.arm(tick, self._word)
+		else:
+			self.digital_in.stop()
+		return 1
+
+	def FDwfDigitalInStatus(self, hdwf, read_data, state):
+		self._call("FDwfDigitalInStatus")
+		if _value(read_data) and not self.hung and self.hang_rate and self.rng.random_sample() < self.hang_rate:
+			self.hung = True
+			self.num_hangs += 1
+			self._hung_state = self.digital_in.state
+			self.digital_in.status_record = (0, 0, 0)
+			self.digital_in._fetched_count = 0
+		if self.hung:
+			_out(state, c_ubyte).value = self._hung_state
+			return 1
+		if _value(read_data):
+			self.digital_in.fetch(self.rng, self.lost_rate, self.corrupted_rate)
+		_out(state, c_ubyte).value = self.digital_in.state
+		return 1
+
+	def _clear_hang(self, action):
+		"""A wedged DigitalIn recovers on its hang_clears action, or on a stronger one."""
+		if self.hung and HANG_ACTIONS.index(action) >= HANG_ACTIONS.index(self.hang_clears):
+			self.hung = False
+
+	def FDwfDigitalInStatusRecord(self, hdwf, available, lost, corrupted):
+		self.num_calls["FDwfDigitalInStatusRecord"] += 1
+		record = self.digital_in.status_record
+		_out(available, c_int).value = record[0]
+		_out(lost, c_int).value = record[1]
+		_out(corrupted, c_int).value = record[2]
+		return 1
+
+	def FDwfDigitalInStatusData(self, hdwf, data, num_bytes):
+		self.num_calls["FDwfDigitalInStatusData"] += 1
+		samples = self.digital_in.fetched_samples(_value(num_bytes) // 2)
+		if len(samples):
+			memmove(cast(data, c_void_p).value, samples.ctypes.data, 2 * len(samples))
+		return 1
+
+	##### DigitalOut #####
+
+	def FDwfDigitalOutReset(self, hdwf):
+		self._host_event("FDwfDigitalOutReset", self._set_dout_bits, None, 0)
+		self.digital_out.reset()
+		return 1
+
+	def _set_dout_bits(self, generation, bits):
+		if generation is None or generation == self.digital_out.generation:
+			self._dout_bits = bits
+
+	def FDwfDigitalOutEnableSet(self, hdwf, channel, enable):
+		self._call("FDwfDigitalOutEnableSet")
+		bit = 1 << _value(channel)
+		if _value(enable):
+			self.digital_out.enabled |= bit
+		else:
+			self.digital_out.enabled &= ~bit
+		return 1
+
+	def FDwfDigitalOutIdleSet(self, hdwf, channel, idle):
+		self._call("FDwfDigitalOutIdleSet")
+		self.digital_out.idle[_value(channel)] = _value(idle)
+		return 1
+
+	def FDwfDigitalOutCounterInitSet(self, hdwf, channel, high, counter):
+		self._call("FDwfDigitalOutCounterInitSet")
+		self.digital_out.init_high[_value(channel)] = _value(high)
+		return 1
+
+	def FDwfDigitalOutCounterSet(self, hdwf, channel, low, high):
+		self._call("FDwfDigitalOutCounterSet")
+		self.digital_out.counters[_value(channel)] = (_value(low), _value(high))
+		return 1
+
+	def FDwfDigitalOutRunSet(self, hdwf, run):
+		self._call("FDwfDigitalOutRunSet")
+		self.digital_out.run = _value(run)
+		return 1
+
+	def FDwfDigitalOutWaitSet(self, hdwf, wait):
+		self._call("FDwfDigitalOutWaitSet")
+		self.digital_out.wait = _value(wait)
+		return 1
+
+	def FDwfDigitalOutRepeatSet(self, hdwf, repeat):
+		self._call("FDwfDigitalOutRepeatSet")
+		self.digital_out.repeat = _value(repeat)
+		return 1
+
+	def FDwfDigitalOutConfigure(self, hdwf, start):
+		tick = self._call("FDwfDigitalOutConfigure")
+		digital_out = self.digital_out
+		# stop whatever is playing
+		digital_out.generation += 1
+		generation = digital_out.generation
+		idle_bits = digital_out.idle_bits()
+		self.schedule(tick, self._set_dout_bits, generation, idle_bits)
+
+		if _value(start):
+			if digital_out.repeat == 0 or digital_out.run <= 0:
+				raise NotImplementedError("the fake AD2 only simulates DigitalOut runs of finite length and repeat count")
+			running_bits = digital_out.running_bits()
+			run_start = tick
+			for i in range(digital_out.repeat):
+				run_start += _ticks(digital_out.wait)
+				self.schedule(run_start, self._set_dout_bits, generation, running_bits)
+				run_start += max(1, _ticks(digital_out.run))
+				self.schedule(run_start, self._set_dout_bits, generation, idle_bits)
+		self._advance(tick)
+		return 1
+
+def _locked(function):
+	"""function (an FDwf* method of FakeDwf), called with the fake's lock held."""
+	def call(self, *args):
+		with self._lock:
+			return function(self, *args)
+	call.__name__ = function.__name__
+	call.__doc__ = function.__doc__
+	return call
+
+for _name in dir(FakeDwf):
+	if _name.startswith("FDwf"):
+		setattr(FakeDwf, _name, _locked(getattr(FakeDwf, _name).__func__))
+
+
+def networks_from_inputs(input_file, **network_args):
+	"""SimulatedNetwork wired the way an acq_experiment_inputs.txt style file describes.
+	Returns a list with that one network; network_args go to SimulatedNetwork.
+	"""
+	with open(input_file) as f:
+		params = [[int(i) for i in line.strip().split(", ")] for line in f if line.strip()]
+
+	network = SimulatedNetwork(params[1][0], params[0][0], params[0][1], params[0][2:], **network_args)
+	return [network]
@@ -0,0 +1,255 @@
+"""
+	Runs one experiment across several AD2 units connected to this host, one worker process per device.
+
+	The networks (one input file each, in the format acq.py takes) are assigned to the devices
+	round-robin, in the order the devices are listed. Every device writes into its own subdirectory
+	of the experiment directory, data/<experiment name>/device_<serial>/, with its data files, run
+	summaries, console output (acq.log) and a device.json describing the device and what it ran.
+	manifest.json at the top of the experiment directory collects every device.json.
+
+	On Ctrl-C every worker stops its run (writing what it already captured) and closes its device,
+	and the manifest is still written.
+
+	Usage:
+		python multi_device.py [experiment name] [input file] ... [--devices SN ...] [--concurrent] [--simulate N]
+"""
+
+import acq
+import argparse
+import errno
+import multiprocessing
+import os
+import Queue
+import sys
+import time
+import traceback
+
+def assign_networks(input_files, devices):
+	"""Round-robin assignment of input files to devices. Returns [(device, [input files])], devices without networks left out."""
+	assignment = [(device, []) for device in devices]
+	for i, input_file in enumerate(input_files):
+		assignment[i % len(devices)][1].append(input_file)
+	return [(device, files) for device, files in assignment if files]
+
+def read_input_file(input_file):
+	with open(input_file) as f:
+		return [[int(i) for i in line.strip().split(", ")] for line in f if line.strip()]
+
+def run_device(job):
+	"""Runs the networks of one device (in a worker process). Returns the device's metadata."""
+	device = job["device"]
+	options = job["options"]
+	directory = job["directory"]
+
+	metadata = {
+		"device": device,
+		"input_files": job["input_files"],
+		"directory": directory,
+		"started": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"finished": None,
+		"runs": [],
+		"interrupted": False,
+		"error": None,
+	}
+
+	network_params = [read_input_file(input_file) for input_file in job["input_files"]]
+	if options["simulate"]:
+		import fake_dwf
+		simulated_networks = []
+		for input_file in job["input_files"]:
+			simulated_networks += fake_dwf.networks_from_inputs(input_file)
+		acq.dwf = fake_dwf.FakeDwf(simulated_networks, num_devices=options["simulate"])
+	else:
+		acq.dwf = acq.load_dwf()
+
+	del acq.list_of_networks[:]
+	for params in network_params:
+		acq.initialize_network(params[0], params[1], params[2][0])
+
+	ad_utils = acq.AnalogDiscoveryUtils(network_params[0][3][0])
+	ad_utils.capture_mode = options["capture_mode"]
+	ad_utils.background_writer = options["background_writer"]
+	ad_utils.poll_interval = options["poll_interval"]
+	if options["binary"]:
+		ad_utils.data_format = "bin"
+
+	# one log per device instead of interleaved console output
+	log = open(os.path.join(directory, "acq.log"), "w")
+	sys.stdout = log
+	try:
+		ad_utils.open_device(device["index"])
+		try:
+			if options["concurrent"]:
+				ad_utils.run_networks(directory, acq.list_of_networks)
+				metadata["runs"].append(ad_utils.run_summary)
+			else:
+				for network in acq.list_of_networks:
+					ad_utils.add_network(network)
+					ad_utils.run(directory)
+					metadata["runs"].append(ad_utils.run_summary)
+		finally:
+			acq.dwf.FDwfDigitalIOReset(ad_utils.interface_handler)
+			ad_utils.close_device()
+	except KeyboardInterrupt:
+		metadata["interrupted"] = True
+	except SystemExit:
+		# open_device quits when the device cannot be opened
+		metadata["error"] = "could not open device {}".format(device["serial"])
+	except Exception:
+		metadata["error"] = traceback.format_exc()
+	finally:
+		sys.stdout = sys.__stdout__
+		log.close()
+
+	metadata["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+	acq._write_json(os.path.join(directory, "device.json"), metadata)
+	return metadata
+
+def _run_device_process(index, job, results):
+	"""Target of the worker process of a device: puts (index, metadata of job) on results."""
+	try:
+		metadata = run_device(job)
+	except Exception:
+		metadata = {"device": job["device"], "input_files": job["input_files"], "directory": job["directory"],
+			"error": traceback.format_exc()}
+	results.put((index, metadata))
+
+def _enumerate_devices(simulate):
+	if simulate:
+		import fake_dwf
+		acq.dwf = fake_dwf.FakeDwf([], num_devices=simulate)
+	else:
+		acq.dwf = acq.load_dwf()
+	return acq.enumerate_devices()
+
+def find_devices(simulate):
+	"""acq.enumerate_devices, in a process of its own: the device workers are forked from this
+	process, so libdwf is never loaded into it.
+	simulate: number of simulated devices (fake_dwf.py), 0 for libdwf
+	"""
+	pool = multiprocessing.Pool(1)
+	try:
+		return pool.apply(_enumerate_devices, (simulate,))
+	finally:
+		pool.close()
+		pool.join()
+
+def run_devices(experiment_directory, assignment, options):
+	"""Runs every (device, input files) of assignment in a worker process of its own.
+	Returns the metadata of every device, in the order of assignment.
+	"""
+	jobs = []
+	for device, input_files in assignment:
+		directory = os.path.join(experiment_directory, "device_" + device["serial"].replace(":", "_"))
+		try:
+			os.makedirs(directory)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+		jobs.append({"device": device, "input_files": input_files, "directory": directory, "options": options})
+
+	# a process per device rather than a Pool: pool workers are daemonic, and daemonic processes
+	# cannot start the dump pool of the background writer
+	results = multiprocessing.Queue()
+	processes = []
+	for index, job in enumerate(jobs):
+		process = multiprocessing.Process(target=_run_device_process, args=(index, job, results),
+			name="device_" + job["device"]["serial"])
+		process.start()
+		processes.append(process)
+
+	# Ctrl-C reaches the workers too; they stop their runs and return, so keep waiting for them
+	metadata = [None] * len(jobs)
+	while any(device is None for device in metadata):
+		try:
+			index, device_metadata = results.get(timeout=0.1)
+			metadata[index] = device_metadata
+		except Queue.Empty:
+			# a worker that exited has flushed its result to the queue
+			if all(process.exitcode is not None for process in processes) and results.empty():
+				break
+		except KeyboardInterrupt:
+			print "interrupted, waiting for the devices to stop"
+	for process in processes:
+		process.join()
+
+	for index, job in enumerate(jobs):
+		if metadata[index] is None:
+			metadata[index] = {"device": job["device"], "input_files": job["input_files"], "directory": job["directory"],
+				"error": "worker process exited with code {}".format(processes[index].exitcode)}
+	return metadata
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run an experiment across several AD2 units, one process per device.")
+	parser.add_argument("experiment_name", help="one-string title; data goes to data/<experiment name>")
+	parser.add_argument("input_files", nargs="+", metavar="input_file",
+		help="experiment parameter file, e.g. acq_experiment_inputs.txt; one per network")
+	parser.add_argument("--devices", nargs="+", metavar="SERIAL",
+		help="serial numbers of the devices to use, in assignment order (default: every device not in use)")
+	parser.add_argument("--notes", default="", help="comments written to notes.txt")
+	parser.add_argument("--concurrent", action="store_true",
+		help="capture all networks of a device at once (see acq.py --concurrent)")
+	capture_mode = parser.add_mutually_exclusive_group()
+	capture_mode.add_argument("--streaming", action="store_const", dest="capture_mode", const="streaming", default="polled")
+	capture_mode.add_argument("--hardware-stop", action="store_const", dest="capture_mode", const="terminated")
+	parser.add_argument("--background-writer", action="store_true")
+	parser.add_argument("--poll-interval", type=float, default=0, help="milliseconds to sleep between polls of the device")
+	parser.add_argument("--binary", action="store_true", help="write binary edge logs instead of csv")
+	parser.add_argument("--simulate", type=int, default=0, metavar="N",
+		help="run against N simulated devices (fake_dwf.py) instead of libdwf")
+	args = parser.parse_args()
+
+	devices = [device for device in find_devices(args.simulate) if not device["in_use"]]
+	if args.devices:
+		by_serial = dict((device["serial"], device) for device in devices)
+		missing = [serial for serial in args.devices if serial not in by_serial]
+		if missing:
+			print "devices not found or in use: {}".format(", ".join(missing))
+			sys.exit(1)
+		devices = [by_serial[serial] for serial in args.devices]
+	if not devices:
+		print "no devices available"
+		sys.exit(1)
+
+	assignment = assign_networks(args.input_files, devices)
+	for device, input_files in assignment:
+		print "{} ({}): {}".format(device["serial"], device["name"], ", ".join(input_files))
+
+	experiment_directory = os.path.join("data", args.experiment_name)
+	try:
+		os.makedirs(experiment_directory)
+	except OSError as e:
+		if e.errno != errno.EEXIST:
+			raise
+	with open(os.path.join(experiment_directory, "notes.txt"), "a") as notes_file:
+		notes_file.write(args.notes)
+
+	options = {
+		"capture_mode": args.capture_mode,
+		"background_writer": args.background_writer,
+		"poll_interval": args.poll_interval * 0.001,
+		"binary": args.binary,
+		"concurrent": args.concurrent,
+		"simulate": args.simulate,
+	}
+	created = time.strftime("%Y-%m-%d %H:%M:%S")
+	metadata = run_devices(experiment_directory, assignment, options)
+
+	acq._write_json(os.path.join(experiment_directory, "manifest.json"), {
+		"experiment": args.experiment_name,
+		"created": created,
+		"notes": args.notes,
+		"options": options,
+		"devices": metadata,
+	})
+
+	failed = [device for device in metadata if device.get("error") or device.get("interrupted")]
+	for device in metadata:
+		status = "ok"
+		if device.get("error"):
+			status = "failed"
+		elif device.get("interrupted"):
+			status = "interrupted"
+		print "{}: {}".format(device["device"]["serial"], status)
+	sys.exit(1 if failed else 0)
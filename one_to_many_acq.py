@@ -12,6 +12,9 @@
     Output:
         1. Records data to [FILENAME].csv
 
+    This script stops sampling at the first reception. acq.py captures a one-to-many network
+    until every receiver got the packet and logs each receiver's latency (receivers_*.csv).
+
     Written by Alex Yang and Arvind Sundararajan
     10/27/2017.
 """
@@ -33,7 +36,7 @@ class Network:
     num_packets = 0
 
     def __init__(self, button_press_channel, mirror_channel, creation_channel, reception_channels, num_packets_to_send):
-        self.button_press_channel = button_press_mirror_channel
+        self.button_press_channel = button_press_channel
         self.mirror_channel = mirror_channel
         self.creation_channel = creation_channel
         self.reception_channels = reception_channels
@@ -111,10 +114,10 @@ class AnalogDiscoveryUtils:
         """Resets instruments and closes the connection to AD2."""
         
         # reset DigitalIO instrument
-        dwf.FDwfDigitalIOReset()
+        dwf.FDwfDigitalIOReset(self.interface_handler)
 
         #reset DigitalIn instrument
-        dwf.FDwfDigitalInReset(ad_utils.interface_handler)
+        dwf.FDwfDigitalInReset(self.interface_handler)
 
         dwf.FDwfDeviceCloseAll()
         print "device closed\n"
@@ -140,7 +143,7 @@ class AnalogDiscoveryUtils:
 
         rx_channels = network.reception_channels
         for ch in rx_channels:
-            self.packet_received_bits = self.packet_received_bit | (1 << ch)
+            self.packet_received_bits = self.packet_received_bits | (1 << ch)
 
         # when post-processing we only care about changes to these bits
         self.bits_to_monitor = self.button_press_mirror_bit | self.packet_created_bit | self.packet_received_bits
@@ -1,7 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
-print("top-level")
 pdr = 0.9
 slotframe_slots = 11
 slot_ms = 10
@@ -9,30 +7,42 @@ num_retries = 5
 latencies = []
 missed_packets = 0
 
+def simulate_packet(asn, active_slots, packet_pdr=None, rng=np.random):
+	"""Sends one packet starting after slot asn.
+	Returns (asn of the last slot used, latency in ms), with latency None if every retry failed.
+	"""
+	if packet_pdr is None:
+		packet_pdr = pdr
+	latency = 0
+	tries_remaining = num_retries + 1
+
+	while tries_remaining > 0:
+		asn = asn + 1
+		latency = latency + slot_ms
+		if asn % slotframe_slots < active_slots:
+			latency = latency + rng.random_integers(-5, 5)
+			pkt_received = rng.random_sample() < packet_pdr
+			if pkt_received:
+				return asn, latency
+			else:
+				tries_remaining = tries_remaining - 1
+
+	return asn, None
+
 def simulate(num_packets, active_slots):
 	global missed_packets
 	asn = -1
 	while num_packets > 0:
-		latency = 0
-		tries_remaining = num_retries + 1
-
-		while tries_remaining > 0:
-			asn = asn + 1
-			latency = latency + slot_ms
-			if asn % slotframe_slots < active_slots:
-				latency = latency + np.random.random_integers(-5, 5)
-				pkt_received = np.random.random() < pdr
-				if pkt_received:
-					latencies.append(latency)
-					num_packets = num_packets - 1
-					break
-				else:
-					tries_remaining = tries_remaining - 1
-
-		if not tries_remaining:
+		asn, latency = simulate_packet(asn, active_slots)
+		if latency is not None:
+			latencies.append(latency)
+			num_packets = num_packets - 1
+		else:
 			missed_packets = missed_packets + 1
 
 if __name__ == "__main__":
+	import matplotlib.pyplot as plt
+
 	num_packets = int(input("num of pkts: "))
 	active_slots = int(input("active slots: "))
 	simulate(num_packets, active_slots)
@@ -43,4 +53,3 @@ if __name__ == "__main__":
 	plt.figure("Figure 11")
 	plt.hist(latencies, bins=bins)
 	plt.show(block=True)
-
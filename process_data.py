@@ -1,8 +1,12 @@
 """Converts the csv file outputted by the acquisition into a simpler csv with just packet and latency information.
+The input may also be a binary edge log (.bin, see edge_log.py), which is memory-mapped instead of parsed.
 
 Usage: python process_data.py [input_data_file] [desired output_data_file]
 """
 
+from edge_log import EDGE_LOG_EXTENSION
+import edge_log
+import numpy as np
 import sys
 
 def write_missed_packet_samples(output_data_file, missed_packets_samples):
@@ -100,6 +104,32 @@ def parse_data(input_data_file):
 	print "done parsing input data"
 	return [missed_packets_data, output_data]
 
+def parse_edge_log(input_data_file):
+	"""Same as parse_data, for a binary edge log.
+	The latency of each packet (the last record of every run of records with a positive packet number)
+	is found with array operations on the memory-mapped records.
+	"""
+	print "reading edge log"
+	header, records = edge_log.read_edge_log(input_data_file)
+	packets = records["packet"]
+	latencies = edge_log.latencies_ms(header, records)
+
+	missed_packets_data = []
+	# like parse_data, which only starts looking for missed packets from the second data row
+	for i in (np.flatnonzero(packets[1:] < 0) + 1).tolist():
+		sample_info = [str(packets[i]), str(records["offset"][i]), str(latencies[i]), edge_log.sample_str(int(records["sample"][i]))]
+		missed_packets_data.append(sample_info)
+
+	output_data = []
+	if len(packets) > 0:
+		# last record of each packet
+		last = np.flatnonzero(np.append(packets[1:] != packets[:-1], True))
+		last = last[packets[last] > 0]
+		output_data = [[packet, latency] for packet, latency in zip(packets[last].tolist(), latencies[last].tolist())]
+
+	print "done reading edge log"
+	return [missed_packets_data, output_data]
+
 def write_new_data(output_data_file_str, data_to_write):
 	"Takes the array of arrays from parse_data and writes data in the desired format."
 
@@ -128,7 +158,10 @@ if __name__ == "__main__":
 	input_data_file = sys.argv[1]
 	output_data_file = sys.argv[2]
 
-	data_to_write = parse_data(input_data_file)
+	if input_data_file.endswith(EDGE_LOG_EXTENSION):
+		data_to_write = parse_edge_log(input_data_file)
+	else:
+		data_to_write = parse_data(input_data_file)
 	write_new_data(output_data_file, data_to_write)
 
 	sys.exit(0)
@@ -0,0 +1,320 @@
+"""
+	Runs a queue of experiments back to back on one AD2, with nobody at the keyboard.
+
+	acq.py runs one experiment per invocation: it asks for a title and notes, opens the device,
+	runs and closes it. queue_runner.py takes a plan file listing many experiments and runs them
+	one after another on a single open device handle, so a sweep (of active slots, packet counts,
+	sampling rates, ...) can run overnight. The plan is a JSON file:
+
+		{
+			"name": "slot_sweep",
+			"notes": "active slots 1 to 11",
+			"options": ["--background-writer"],
+			"experiments": [
+				{"name": "slots_1", "input_files": ["slots_1.txt"], "notes": "1 active slot"},
+				{"name": "slots_11", "input_files": ["slots_11.txt"], "num_packets": 500, "options": ["--streaming"]},
+				{"name": "inline", "networks": [{"output_channels": [8, 7, 15], "input_channels": [0]}],
+					"num_packets": 1000, "sampling_freq": 1000000}
+			]
+		}
+
+	options are acq.py command line options. The plan's options apply to every experiment, followed
+	by the experiment's own. input_files are in the format acq.py takes, relative to the plan file.
+	networks give the same channels inline. num_packets and sampling_freq override the values of
+	the input files, and are required with networks.
+
+	Every experiment writes into data/<plan name>/<experiment name>/: its data files and run
+	summaries, notes.txt, the input files it ran (inputs_<i>.txt), its console output (acq.log)
+	and experiment.json. manifest.json in data/<plan name>/ lists every experiment and its status.
+	It is written again after each experiment, so it shows how far an interrupted queue got.
+	A failed experiment is recorded, the device is reopened, and the queue goes on with the next
+	one. Ctrl-C stops the queue once the experiment in progress has written what it captured.
+
+	Usage:
+		python queue_runner.py [plan file] [--device SERIAL] [--skip-done] [--simulate]
+"""
+
+import acq
+import argparse
+import errno
+import json
+import os
+import sys
+import time
+import traceback
+
+# acq.py options that configure the device connection rather than an experiment
+QUEUE_OPTIONS = ["simulate", "record_trace", "replay_trace", "resume"]
+
+def load_plan(path):
+	"""Reads and checks the plan file at path. Returns the plan, with the network parameters of
+	every experiment (as acq.py reads them from input files) in its "params".
+	Raises ValueError if the plan is not valid.
+	"""
+	with open(path) as f:
+		plan = json.load(f)
+	plan_directory = os.path.dirname(os.path.abspath(path))
+	if not plan.get("name") or not plan.get("experiments"):
+		raise ValueError("{}: a plan needs a name and experiments".format(path))
+
+	names = set()
+	for experiment in plan["experiments"]:
+		if experiment.get("name") in names:
+			raise ValueError("{}: experiment {!r} is in the plan twice".format(path, experiment["name"]))
+		check_experiment(experiment, plan_directory, plan.get("options", []))
+		names.add(experiment["name"])
+	return plan
+
+def check_experiment(experiment, plan_directory, plan_options=()):
+	"""Checks one experiment of a plan, whose input files are relative to plan_directory, and sets
+	its "params" and its "options" (plan_options followed by its own). Raises ValueError if it is not valid.
+	"""
+	name = experiment.get("name")
+	if not name or os.sep in name:
+		raise ValueError("experiment names must be one-string titles, not {!r}".format(name))
+	experiment["params"] = experiment_params(experiment, plan_directory)
+	experiment["options"] = list(plan_options) + experiment.get("options", [])
+	args = parse_options(experiment)
+	for option in QUEUE_OPTIONS:
+		if getattr(args, option):
+			raise ValueError("{}: --{} cannot be used in a plan".format(name, option.replace("_", "-")))
+	if len(set(params[3][0] for params in experiment["params"])) != 1:
+		raise ValueError("{}: every network must have the same sampling frequency".format(name))
+
+def experiment_params(experiment, plan_directory):
+	"""The network parameters of experiment, one list per network as acq.py reads them from an input file."""
+	if "input_files" in experiment:
+		params = [read_input_file(os.path.join(plan_directory, input_file)) for input_file in experiment["input_files"]]
+	elif "networks" in experiment:
+		if "num_packets" not in experiment or "sampling_freq" not in experiment:
+			raise ValueError("{}: networks need num_packets and sampling_freq".format(experiment["name"]))
+		params = [[network["output_channels"], network["input_channels"], [0], [0]] for network in experiment["networks"]]
+	else:
+		raise ValueError("{}: an experiment needs input_files or networks".format(experiment["name"]))
+
+	for network_params in params:
+		if "num_packets" in experiment:
+			network_params[2] = [experiment["num_packets"]]
+		if "sampling_freq" in experiment:
+			network_params[3] = [experiment["sampling_freq"]]
+	return params
+
+def read_input_file(input_file):
+	with open(input_file) as f:
+		return [[int(i) for i in line.strip().split(", ")] for line in f if line.strip()]
+
+def write_input_file(path, params):
+	with open(path, "w") as f:
+		for line in params:
+			f.write(", ".join(str(i) for i in line) + "\n")
+
+def parse_options(experiment, input_files=("-",)):
+	"""The acq.py options of experiment, parsed as if given with input_files."""
+	try:
+		return acq.argument_parser().parse_args(experiment["options"] + list(input_files))
+	except SystemExit:
+		# argparse has printed what is wrong
+		raise ValueError("{}: invalid options {}".format(experiment["name"], " ".join(experiment["options"])))
+
+def run_experiment(experiment, directory, device, notes="", simulate=False):
+	"""Runs experiment on the device that device (an AnalogDiscoveryUtils) has open.
+	With simulate, acq.dwf is a fake_dwf.FakeDwf, which gets the experiment's networks.
+	Returns (metadata, AnalogDiscoveryUtils now holding the device).
+	"""
+	metadata, ad_utils, args = prepare_experiment(experiment, directory, device, notes, simulate)
+	execute_experiment(metadata, ad_utils, args)
+	return metadata, ad_utils
+
+def prepare_experiment(experiment, directory, device, notes="", simulate=False):
+	"""Sets experiment up to run on the device that device has open (see run_experiment).
+	Returns (metadata, the AnalogDiscoveryUtils that runs it, its parsed acq.py options).
+	"""
+	metadata = {
+		"name": experiment["name"],
+		"directory": directory,
+		"options": experiment["options"],
+		"input_files": [],
+		"started": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"finished": None,
+		"duration_s": None,
+		"status": None,
+		"error": None,
+		"runs": [],
+	}
+	with open(os.path.join(directory, "notes.txt"), "a") as notes_file:
+		notes_file.write("\n".join(note for note in [notes, experiment.get("notes", "")] if note))
+
+	# the experiment directory keeps the inputs it ran
+	for i, params in enumerate(experiment["params"]):
+		input_file = os.path.join(directory, "inputs_{}.txt".format(i))
+		write_input_file(input_file, params)
+		metadata["input_files"].append(input_file)
+	args = parse_options(experiment, metadata["input_files"])
+
+	if simulate:
+		# the simulated AD2 is rewired to this experiment's networks
+		import fake_dwf
+		acq.dwf.networks = []
+		for input_file in metadata["input_files"]:
+			acq.dwf.networks += fake_dwf.networks_from_inputs(input_file)
+
+	del acq.list_of_networks[:]
+	for params in experiment["params"]:
+		acq.initialize_network(params[0], params[1], params[2][0])
+
+	ad_utils = acq.AnalogDiscoveryUtils(experiment["params"][0][3][0])
+	acq.apply_options(ad_utils, args)
+	ad_utils.use_device(device)
+	return metadata, ad_utils, args
+
+def execute_experiment(metadata, ad_utils, args, log=None):
+	"""Runs an experiment set up by prepare_experiment, and fills in its metadata.
+	acq.py prints to sys.stdout. With log, the caller has routed what is printed to log, and
+	sys.stdout is left alone (acq_daemon.py runs experiments on a thread of their own). Without,
+	it goes to <directory>/acq.log: sys.stdout points at it for the run, and is given back to
+	whatever it was before.
+	"""
+	directory = metadata["directory"]
+	start = time.time()
+	own_log = log is None
+	if own_log:
+		log = open(os.path.join(directory, "acq.log"), "w")
+	stdout = sys.stdout
+	try:
+		if own_log:
+			sys.stdout = log
+		if args.concurrent:
+			ad_utils.run_networks(directory, acq.list_of_networks)
+			metadata["runs"].append(ad_utils.run_summary)
+		else:
+			for network in acq.list_of_networks:
+				ad_utils.add_network(network)
+				ad_utils.run(directory)
+				metadata["runs"].append(ad_utils.run_summary)
+		metadata["status"] = "ok"
+	except KeyboardInterrupt:
+		metadata["status"] = "interrupted"
+	except Exception:
+		metadata["status"] = "failed"
+		metadata["error"] = traceback.format_exc()
+		log.write(metadata["error"])
+	finally:
+		if own_log:
+			sys.stdout = stdout
+			log.close()
+		metadata["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+		metadata["duration_s"] = time.time() - start
+		acq._write_json(os.path.join(directory, "experiment.json"), metadata)
+
+def ready_device(ad_utils, metadata):
+	"""Leaves the device of ad_utils as the next experiment expects to find it, after the
+	experiment of metadata. Returns False if the device is gone.
+	"""
+	if metadata["status"] == "failed":
+		# whatever state the failure left the device in, the next experiment gets a fresh one
+		ad_utils.close_device()
+		return ad_utils._open_device(ad_utils.device_index)
+	acq.dwf.FDwfDigitalInReset(ad_utils.interface_handler)
+	acq.dwf.FDwfDigitalIOReset(ad_utils.interface_handler)
+	return True
+
+def _makedirs(directory):
+	try:
+		os.makedirs(directory)
+	except OSError as e:
+		if e.errno != errno.EEXIST:
+			raise
+
+def run_queue(plan, plan_file, device_index=-1, skip_done=False, simulate=False):
+	"""Runs every experiment of plan on one device, in order. Returns the manifest."""
+	queue_directory = os.path.join("data", plan["name"])
+	_makedirs(queue_directory)
+	manifest_file = os.path.join(queue_directory, "manifest.json")
+
+	done = {}
+	if skip_done and os.path.exists(manifest_file):
+		with open(manifest_file) as f:
+			done = dict((experiment["name"], experiment) for experiment in json.load(f)["experiments"]
+				if experiment["status"] == "ok")
+
+	manifest = {
+		"plan": plan["name"],
+		"plan_file": plan_file,
+		"notes": plan.get("notes", ""),
+		"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"finished": None,
+		"wall_s": None,
+		"experiment_s": 0,
+		"experiments": [],
+	}
+	queue_start = time.time()
+
+	device = acq.AnalogDiscoveryUtils(plan["experiments"][0]["params"][0][3][0])
+	device.open_device(device_index)
+	try:
+		for experiment in plan["experiments"]:
+			if experiment["name"] in done:
+				print "{}: done already".format(experiment["name"])
+				manifest["experiments"].append(done[experiment["name"]])
+				continue
+
+			directory = os.path.join(queue_directory, experiment["name"])
+			_makedirs(directory)
+			print "{}: running ({})".format(experiment["name"], " ".join(experiment["options"]) or "default options")
+			metadata, device = run_experiment(experiment, directory, device, plan.get("notes", ""), simulate)
+			manifest["experiments"].append(metadata)
+			manifest["experiment_s"] += metadata["duration_s"]
+			print "{}: {} in {:.0f} s".format(experiment["name"], metadata["status"], metadata["duration_s"])
+			acq._write_json(manifest_file, manifest)
+
+			if metadata["status"] == "interrupted":
+				break
+			if not ready_device(device, metadata):
+				print "could not reopen the device, stopping the queue"
+				break
+	finally:
+		device.close_device()
+		manifest["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+		manifest["wall_s"] = time.time() - queue_start
+		acq._write_json(manifest_file, manifest)
+	return manifest
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run the experiments of a plan file back to back on one AD2.")
+	parser.add_argument("plan_file", help="JSON plan of the experiments (see queue_runner.py)")
+	parser.add_argument("--device", metavar="SERIAL", help="serial number of the device to use (default: the first one)")
+	parser.add_argument("--skip-done", action="store_true",
+		help="skip the experiments that manifest.json already lists as ok, e.g. after an interrupted queue")
+	parser.add_argument("--simulate", action="store_true",
+		help="run against a simulated AD2 and networks (fake_dwf.py) instead of libdwf")
+	args = parser.parse_args()
+
+	try:
+		plan = load_plan(args.plan_file)
+	except ValueError as e:
+		print e
+		sys.exit(1)
+
+	if args.simulate:
+		import fake_dwf
+		acq.dwf = fake_dwf.FakeDwf([])
+	else:
+		acq.dwf = acq.load_dwf()
+
+	device_index = -1
+	if args.device:
+		by_serial = dict((device["serial"], device) for device in acq.enumerate_devices())
+		if args.device not in by_serial:
+			print "device {} not found".format(args.device)
+			sys.exit(1)
+		device_index = by_serial[args.device]["index"]
+
+	manifest = run_queue(plan, args.plan_file, device_index, args.skip_done, args.simulate)
+
+	for experiment in manifest["experiments"]:
+		print "{}: {}".format(experiment["name"], experiment["status"])
+	if manifest["wall_s"] > 0:
+		print "testbed busy {:.0f} of {:.0f} s".format(manifest["experiment_s"], manifest["wall_s"])
+	ran_all = len(manifest["experiments"]) == len(plan["experiments"])
+	sys.exit(0 if ran_all and all(experiment["status"] == "ok" for experiment in manifest["experiments"]) else 1)
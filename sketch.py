@@ -0,0 +1,216 @@
+"""
+	Streaming latency quantiles of a running experiment.
+
+	LatencySketch is a merging t-digest: latencies are buffered and, every buffer_size of them,
+	merged into a sorted set of centroids (mean, weight) whose sizes are bounded by the k1 scale
+	function, so memory stays around compression centroids however many packets a run takes,
+	and the tail quantiles (p99, p99.9) stay accurate. It also counts missed packets for the PDR.
+
+	The sketch of a run is written to a JSON file and can be loaded back (load) and merged with
+	the sketches of other runs.
+"""
+
+import json
+import math
+import numpy as np
+
+# quantiles printed by LatencySketch.summary and written to the run summary
+SUMMARY_QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+class LatencySketch:
+	"""Bounded-memory latency distribution and packet delivery ratio of a run."""
+
+	def __init__(self, compression=100, buffer_size=500):
+		self.compression = compression
+		self.buffer_size = buffer_size
+
+		self._means = np.empty(0)
+		self._weights = np.empty(0)
+		self._buffer = []
+
+		# received packets (latencies added) and missed ones
+		self.count = 0
+		self.num_missed = 0
+		self.min = float("inf")
+		self.max = float("-inf")
+
+	def add(self, latency):
+		"""Adds the latency (ms) of a received packet."""
+		self._buffer.append(latency)
+		self.count += 1
+		if latency < self.min:
+			self.min = latency
+		if latency > self.max:
+			self.max = latency
+		if len(self._buffer) >= self.buffer_size:
+			self._compress()
+
+	def add_missed(self):
+		"""Counts a missed packet."""
+		self.num_missed += 1
+
+	def pdr(self):
+		"""Packet delivery ratio so far (0 before any packet)."""
+		total = self.count + self.num_missed
+		if total == 0:
+			return 0.0
+		return float(self.count) / total
+
+	def _k(self, q):
+		"""k1 scale function: centroids are small near q = 0 and q = 1."""
+		return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+	def _compress(self):
+		"""Merges the buffered latencies into the centroids."""
+		if not self._buffer:
+			return
+		means = np.concatenate([self._means, np.array(self._buffer, dtype=float)])
+		weights = np.concatenate([self._weights, np.ones(len(self._buffer))])
+		self._buffer = []
+		self._merge_centroids(means, weights)
+
+	def _merge_centroids(self, means, weights):
+		"""Replaces the centroids by (means, weights), merged as far as the scale function allows."""
+		order = np.argsort(means, kind="mergesort")
+		means = means[order].tolist()
+		weights = weights[order].tolist()
+		total = sum(weights)
+
+		new_means, new_weights = [], []
+		mean, weight = means[0], weights[0]
+		# weight of the centroids before the one being built, and the k of its left edge
+		weight_before = 0.0
+		k_left = self._k(0)
+		for m, w in zip(means[1:], weights[1:]):
+			if self._k((weight_before + weight + w) / total) - k_left <= 1:
+				weight += w
+				mean += (m - mean) * w / weight
+			else:
+				new_means.append(mean)
+				new_weights.append(weight)
+				weight_before += weight
+				k_left = self._k(weight_before / total)
+				mean, weight = m, w
+		new_means.append(mean)
+		new_weights.append(weight)
+
+		self._means = np.array(new_means)
+		self._weights = np.array(new_weights)
+
+	def quantile(self, q):
+		"""Latency (ms) at quantile q (0 to 1), interpolated between centroids; None before any packet."""
+		self._compress()
+		if self.count == 0:
+			return None
+		centers = np.cumsum(self._weights) - self._weights / 2
+		positions = np.concatenate([[0], centers, [self._weights.sum()]])
+		values = np.concatenate([[self.min], self._means, [self.max]])
+		return float(np.interp(q * self._weights.sum(), positions, values))
+
+	def merge(self, other):
+		"""Adds every packet of other (another LatencySketch) to this one."""
+		self._compress()
+		other._compress()
+		if other.count:
+			self._merge_centroids(np.concatenate([self._means, other._means]), np.concatenate([self._weights, other._weights]))
+		self.count += other.count
+		self.num_missed += other.num_missed
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+
+	def summary(self):
+		"""One line with the packet counts, PDR and summary quantiles."""
+		if self.count == 0:
+			return "latency: {} packets missed, none received".format(self.num_missed)
+		quantiles = ", ".join("p{:g} {:.3f}".format(100 * q, self.quantile(q)) for q in SUMMARY_QUANTILES)
+		return "latency: {} received, {} missed, PDR {:.4f}; {} ms".format(self.count, self.num_missed, self.pdr(), quantiles)
+
+	def quantiles(self):
+		"""{"p50": ..., "p90": ..., ...} of the summary quantiles, as written to summary_*.json."""
+		return dict(("p{:g}".format(100 * q), self.quantile(q)) for q in SUMMARY_QUANTILES)
+
+	def to_dict(self):
+		self._compress()
+		return {
+			"compression": self.compression,
+			"count": self.count,
+			"num_missed": self.num_missed,
+			"min": self.min if self.count else None,
+			"max": self.max if self.count else None,
+			"means": self._means.tolist(),
+			"weights": self._weights.tolist(),
+		}
+
+	def save(self, path):
+		"""Writes the sketch to path as JSON (see load)."""
+		with open(path, "w") as f:
+			json.dump(self.to_dict(), f)
+
+def load(path):
+	"""Reads a sketch written by LatencySketch.save."""
+	with open(path) as f:
+		return from_dict(json.load(f))
+
+def from_dict(state):
+	"""The sketch of LatencySketch.to_dict."""
+	sketch = LatencySketch(state["compression"])
+	sketch._means = np.array(state["means"], dtype=float)
+	sketch._weights = np.array(state["weights"], dtype=float)
+	sketch.count = state["count"]
+	sketch.num_missed = state["num_missed"]
+	if state["count"]:
+		sketch.min = state["min"]
+		sketch.max = state["max"]
+	return sketch
+
+def _z_score(confidence):
+	"""Two-sided standard normal critical value of confidence (e.g. 1.96 for 0.95)."""
+	low, high = 0.0, 10.0
+	for i in range(60):
+		mid = (low + high) / 2
+		if math.erf(mid / math.sqrt(2)) < confidence:
+			low = mid
+		else:
+			high = mid
+	return (low + high) / 2
+
+class QuantileStoppingRule:
+	"""Ends an experiment once a latency quantile is known well enough.
+
+	The confidence interval of quantile q after n packets is distribution free: it lies between
+	the order statistics of rank n*q -/+ z*sqrt(n*q*(1 - q)), which are read off the sketch.
+	The rule is met once that interval is at most width ms wide, and at least min_packets
+	packets were received.
+	"""
+
+	def __init__(self, quantile, width, confidence=0.95, min_packets=100):
+		assert 0 < quantile < 1
+		self.quantile = quantile
+		self.width = width
+		self.confidence = confidence
+		self.min_packets = min_packets
+		self._z = _z_score(confidence)
+
+	def confidence_interval(self, sketch):
+		"""(low, high) latency (ms) bounds of the quantile, or None while the sketch has too few
+		packets for the upper rank to exist.
+		"""
+		n = sketch.count
+		if n == 0:
+			return None
+		spread = self._z * math.sqrt(n * self.quantile * (1 - self.quantile))
+		low_rank = math.floor(n * self.quantile - spread)
+		high_rank = math.ceil(n * self.quantile + spread) + 1
+		if low_rank < 1 or high_rank > n:
+			return None
+		return sketch.quantile((low_rank - 0.5) / n), sketch.quantile((high_rank - 0.5) / n)
+
+	def check(self, sketch):
+		"""Returns why the experiment can stop (a string), or None if it should go on."""
+		if sketch.count < self.min_packets:
+			return None
+		interval = self.confidence_interval(sketch)
+		if interval is None or interval[1] - interval[0] > self.width:
+			return None
+		return "p{:g} converged after {} packets: {:g}% confidence interval [{:.3f}, {:.3f}] ms, {:.3f} ms wide (target {:g} ms)".format(
+			100 * self.quantile, sketch.count, 100 * self.confidence, interval[0], interval[1], interval[1] - interval[0], self.width)
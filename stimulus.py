@@ -0,0 +1,94 @@
+"""
+	Hardware-timed button presses.
+
+	Instead of sleeping a random time on the host and pressing the button with two
+	FDwfDigitalIOOutputSet calls, the jitter before every press comes from a seeded,
+	reproducible schedule and the press itself is played out by the AD2 DigitalOut
+	instrument: it waits the scheduled time after being started, then drives the button
+	press channel high for a fixed pulse width.
+
+	Every press is logged (press number, packet, scheduled wait, pulse width) so the
+	analysis can line the data up against the exact schedule.
+"""
+
+from ctypes import *
+from dwfconstants import *
+import random
+
+class PressSchedule:
+	"""Seeded sequence of waits (seconds) before each button press.
+	The waits are drawn from the same range acq.py used to sleep on the host
+	(a whole number of milliseconds between min_wait_ms and max_wait_ms), so the same
+	seed always gives the same schedule.
+	"""
+
+	def __init__(self, seed, min_wait_ms=0, max_wait_ms=110):
+		self.seed = seed
+		self.min_wait_ms = min_wait_ms
+		self.max_wait_ms = max_wait_ms
+		self._rng = random.Random(seed)
+		self.waits = []
+
+	def wait(self, press_number):
+		"""Scheduled wait (s) before press number press_number (starting at 1)."""
+		while len(self.waits) < press_number:
+			self.waits.append(self._rng.randint(self.min_wait_ms, self.max_wait_ms) * 0.001)
+		return self.waits[press_number - 1]
+
+
+class PressLog:
+	"""csv of every press made during a run; open until close()."""
+
+	def __init__(self, path, seed, pulse_width):
+		self.path = path
+		self.pulse_width_ms = pulse_width * 1000.0
+		self._file = open(path, 'a')
+		self._file.write("Press, Packet, Scheduled wait (ms), Pulse width (ms), seed={}\n".format(seed))
+
+	def log(self, press_number, attempt_number, wait):
+		self._file.write("{}, {}, {}, {}\n".format(press_number, attempt_number, wait * 1000.0, self.pulse_width_ms))
+		# the presses of a run that crashes are still on disk
+		self._file.flush()
+
+	def close(self):
+		self._file.close()
+
+
+class DigitalOutStimulus:
+	"""Plays button presses out on the AD2 DigitalOut instrument.
+
+	The DigitalOut output of a pin is combined (OR) with its DigitalIO output, and the
+	DigitalIO steady state keeps the button press pin low, so the pin follows the pulse.
+	"""
+
+	def __init__(self, dwf, interface_handler, channel, pulse_width):
+		self.dwf = dwf
+		self.interface_handler = interface_handler
+		self.channel = channel
+		# seconds the button press channel is held high
+		self.pulse_width = pulse_width
+
+	def configure(self):
+		"""Sets up a single pulse on the button press channel. Call once before the first press."""
+		dwf = self.dwf
+		hdwf = self.interface_handler
+		channel = c_int(self.channel)
+
+		dwf.FDwfDigitalOutReset(hdwf)
+		dwf.FDwfDigitalOutEnableSet(hdwf, channel, c_int(1))
+		# low when not running
+		dwf.FDwfDigitalOutIdleSet(hdwf, channel, DwfDigitalOutIdleLow)
+		# start high and never toggle, so the channel is high for the whole run time
+		dwf.FDwfDigitalOutCounterInitSet(hdwf, channel, c_int(1), c_uint(0))
+		dwf.FDwfDigitalOutCounterSet(hdwf, channel, c_uint(0), c_uint(0))
+		dwf.FDwfDigitalOutRunSet(hdwf, c_double(self.pulse_width))
+		dwf.FDwfDigitalOutRepeatSet(hdwf, c_uint(1))
+
+	def press(self, wait):
+		"""Starts the instrument: after wait seconds, the button is pressed for pulse_width seconds."""
+		self.dwf.FDwfDigitalOutWaitSet(self.interface_handler, c_double(wait))
+		self.dwf.FDwfDigitalOutConfigure(self.interface_handler, c_int(1))
+
+	def stop(self):
+		self.dwf.FDwfDigitalOutConfigure(self.interface_handler, c_int(0))
+		self.dwf.FDwfDigitalOutReset(self.interface_handler)
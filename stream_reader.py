@@ -0,0 +1,179 @@
+"""
+	Reader thread for streaming acquisitions.
+
+	In streaming mode the thread that drains the AD2 buffer also presses the button, segments the
+	stream, prints and postprocesses packets; while it does any of that the device FIFO fills up,
+	and what overflows it is reported as cLost. StreamReader moves the draining to a thread of its
+	own that does nothing but read the stream (FDwfDigitalInStatus / FDwfDigitalInStatusData)
+	into a chunk of samples and copies them onto a ring buffer, as fast as the USB link allows.
+	The acquisition loop (the controller) takes the samples off the ring in order, with the same
+	read_stream call it would make on the DigitalInPoller.
+
+	Every read takes all the samples available (up to the chunk), since the device does not keep
+	the ones left unread. When the ring has no room for them the reader waits for the controller,
+	and the device reports what it drops meanwhile as cLost, as before; ring_full_waits counts how
+	often that happened.
+"""
+
+from ctypes import c_uint16, memmove, sizeof
+from dwfconstants import DwfStateDone
+from timeit import default_timer
+import collections
+import sys
+import threading
+
+class StreamReader:
+	"""Reads a running DigitalIn record on a worker thread into a ring of ring_samples samples.
+
+	poller is the DigitalInPoller of the acquisition; only the reader thread uses its read_stream,
+	which reads into a chunk of chunk_samples samples (at most ring_samples).
+	Every read that returned samples, lost or corrupted samples, or the end of the record is kept
+	as a segment (count, lost, corrupted, state) whose samples follow the previous segment's in
+	the ring. If a read raises, the reader thread stops and the exception is re-raised in the
+	controller by the next read_stream() or close().
+	"""
+
+	def __init__(self, poller, ring_samples, chunk_samples=65536):
+		self.poller = poller
+		self._ring = (c_uint16 * ring_samples)()
+		self._chunk = (c_uint16 * min(chunk_samples, ring_samples))()
+		self._segments = collections.deque()
+		# samples ever put in the ring, and taken out of it
+		self._written = 0
+		self._consumed = 0
+		self._condition = threading.Condition()
+		self._stop = False
+		self._error = None
+
+		# statistics
+		self.num_reads = 0
+		self.num_segments = 0
+		self.max_samples_ready = 0
+		self.ring_full_waits = 0
+		self.ring_full_time = 0
+
+		self._start()
+
+	def _start(self):
+		self._thread = threading.Thread(target=self._read, name="stream reader")
+		self._thread.daemon = True
+		self._thread.start()
+
+	def read_stream(self, arr, timeout=0.01):
+		"""Moves the oldest samples of the ring to the start of arr (at most len(arr) of them).
+		Returns [samples copied, cLost, cCorrupted, instrument state], the same as DigitalInPoller.read_stream.
+		Waits up to timeout seconds for the reader; if it has nothing, returns no samples and state None.
+		"""
+		self._raise_error()
+		with self._condition:
+			if not self._segments:
+				self._condition.wait(timeout)
+			if not self._segments:
+				return [0, 0, 0, None]
+
+			count, lost, corrupted, state = self._segments.popleft()
+			if count > len(arr):
+				# the rest of the segment is for the next call
+				self._segments.appendleft((count - len(arr), 0, 0, state))
+				count = len(arr)
+			# lost samples come before a segment's samples, so only segments without them are joined on
+			while (self._segments and self._segments[0][1] == 0 and state != DwfStateDone.value
+					and count + self._segments[0][0] <= len(arr)):
+				next_count, next_lost, next_corrupted, state = self._segments.popleft()
+				count += next_count
+				corrupted += next_corrupted
+			start = self._consumed % len(self._ring)
+
+		# the reader does not write over these samples until they are consumed
+		first = min(count, len(self._ring) - start)
+		memmove(arr, _offset(self._ring, start), first * sizeof(c_uint16))
+		if count > first:
+			memmove(_offset(arr, first), self._ring, (count - first) * sizeof(c_uint16))
+
+		with self._condition:
+			self._consumed += count
+			self._condition.notify()
+		return [count, lost, corrupted, state]
+
+	def rearm(self, configure):
+		"""Starts reading a new record: stops the reader thread, drops the samples still on the
+		ring, calls configure() to arm the new record (with no thread reading the device) and
+		starts the reader thread again.
+		"""
+		self.close()
+		with self._condition:
+			self._segments.clear()
+			self._consumed = self._written
+			self._stop = False
+		configure()
+		self._start()
+
+	def close(self):
+		"""Stops the reader thread. Samples still on the ring are dropped."""
+		with self._condition:
+			self._stop = True
+			self._condition.notify()
+		while self._thread.is_alive():
+			self._thread.join(0.1)
+		self._raise_error()
+
+	def summary(self):
+		"""One line describing the reads and how full the ring got."""
+		return "Reader thread: {} reads, {} segments, at most {} of {} ring samples waiting, ring full {} times ({:.1f} ms)".format(
+			self.num_reads, self.num_segments, self.max_samples_ready, len(self._ring),
+			self.ring_full_waits, 1000.0 * self.ring_full_time)
+
+	def _raise_error(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error[0], error[1], error[2]
+
+	def _free_start(self, count):
+		"""Ring index after the last sample written, once there is room for count samples after
+		it; waits while there is not. None once stopped.
+		"""
+		with self._condition:
+			free = len(self._ring) - (self._written - self._consumed)
+			if free < count:
+				self.ring_full_waits += 1
+				wait_start = default_timer()
+				while free < count and not self._stop:
+					self._condition.wait(0.01)
+					free = len(self._ring) - (self._written - self._consumed)
+				self.ring_full_time += default_timer() - wait_start
+			if self._stop:
+				return None
+			return self._written % len(self._ring)
+
+	def _read(self):
+		previous_state = None
+		try:
+			while not self._stop:
+				count, lost, corrupted, state = self.poller.read_stream(self._chunk)
+				self.num_reads += 1
+
+				record_done = state == DwfStateDone.value and previous_state != DwfStateDone.value
+				previous_state = state
+				if count > 0 or lost > 0 or corrupted > 0 or record_done:
+					start = self._free_start(count)
+					if start is None:
+						break
+					# the chunk goes on at the start of the ring when it does not fit before its end
+					first = min(count, len(self._ring) - start)
+					memmove(_offset(self._ring, start), self._chunk, first * sizeof(c_uint16))
+					if count > first:
+						memmove(self._ring, _offset(self._chunk, first), (count - first) * sizeof(c_uint16))
+					with self._condition:
+						self._segments.append((count, lost, corrupted, state))
+						self._written += count
+						self.num_segments += 1
+						self.max_samples_ready = max(self.max_samples_ready, self._written - self._consumed)
+						self._condition.notify()
+		except Exception:
+			self._error = sys.exc_info()
+
+def _offset(arr, start, count=None):
+	"""The c_uint16 array of count samples (default: to the end) of arr from index start, sharing its memory."""
+	if count is None:
+		count = len(arr) - start
+	return (c_uint16 * count).from_buffer(arr, start * sizeof(c_uint16))
@@ -0,0 +1,249 @@
+"""
+	Per-packet telemetry of the acquisition loop.
+
+	For every capture (including the ones that broke early) one line goes to a csv side file
+	next to the data file: poll loop iterations, buffer reads and their latency, host time from
+	the button press to the end of the poll loop, samples taken, cLost, cCorrupted and flags.
+
+	Host lag is the host time from press to detection minus the device time the samples cover;
+	when it grows, or cLost stops being 0, the host loop is falling behind the AD2 buffer.
+	A summary of the packets since the last one can be printed every summary_interval seconds.
+
+	Latencies are measured in AD2 samples from the button press mirror edge, which says nothing
+	about when the host actually pressed. Every capture keeps monotonic() timestamps around the
+	random wait before the press, the reconfiguration of the instruments, the press call and the
+	end of the capture loop (see PacketCapture), along with the AD2 sample index of the mirror
+	edge. The last columns of the line come from them; times are in ms, except Press, the host
+	time of the press call in seconds since the log was opened:
+
+	- Wait requested, Wait: the wait before the press, and how long the host actually slept
+	- Reconfigure: DigitalIO and DigitalIn set up for the capture (0 in streaming mode)
+	- Press call: the FDwfDigitalIOOutputSet calls of the press (the DigitalOut start with
+	  hardware-timed presses, which press Wait requested after it)
+	- Mirror sample: index of the mirror edge in the record (polled, terminated) or in the
+	  stream (streaming); -1 if there was none
+	- Press skew: device time to the mirror edge minus host time to the press call. In
+	  terminated mode both are counted from the start of the record (the end of the
+	  reconfiguration), in streaming mode from the first press into the stream record (which
+	  starts over when the stream is re-armed). Polled mode has no press skew (nan): its record
+	  starts at the mirror edge, so the device time before it is not known.
+
+	Oversleep and the press call are host loop jitter that the latencies in the data file do not
+	contain; the spread of Press skew is the jitter between the host issuing the press and the
+	AD2 seeing it. In streaming mode lost samples shift Press skew for the rest of the record.
+"""
+
+from timeit import default_timer
+import ctypes
+import ctypes.util
+import logging
+import math
+import sys
+import time
+
+TELEMETRY_HEADER = "Packet, Poll iterations, Buffer reads, Buffer read mean (us), Buffer read max (us), Press to detect (ms), Samples, Host lag (ms), cLost, cCorrupted, Broke early, Received, Ack missed, Wait requested (ms), Wait (ms), Reconfigure (ms), Press call (ms), Press (s), Mirror sample, Press skew (ms)\n"
+
+class _timespec(ctypes.Structure):
+	_fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _clock_gettime_monotonic():
+	"""Returns a monotonic() reading CLOCK_MONOTONIC with clock_gettime, or None if there is none."""
+	# CLOCK_MONOTONIC is 1 on Linux, 6 on macOS
+	clock_id = 6 if sys.platform == "darwin" else 1
+	for name in (ctypes.util.find_library("c"), ctypes.util.find_library("rt")):
+		if name is None:
+			continue
+		try:
+			clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+		except (OSError, AttributeError):
+			continue
+		clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+		t = _timespec()
+		if clock_gettime(clock_id, ctypes.byref(t)) != 0:
+			continue
+		def monotonic():
+			clock_gettime(clock_id, ctypes.byref(t))
+			return t.tv_sec + t.tv_nsec * 1e-9
+		return monotonic
+	return None
+
+if sys.platform == "win32":
+	# QueryPerformanceCounter
+	monotonic = time.clock
+else:
+	monotonic = _clock_gettime_monotonic()
+	if monotonic is None:
+		logging.warning("no monotonic clock, host timestamps use the wall clock")
+		monotonic = default_timer
+
+def _ms(start, end):
+	if start is None or end is None:
+		return 0
+	return 1000.0 * (end - start)
+
+class TelemetryLog:
+	"""Writes a telemetry line per capture to path, from the counters of a DigitalInPoller
+	and the host timestamps of the capture.
+	"""
+
+	def __init__(self, path, sampling_freq, capture_mode, summary_interval=0):
+		self.path = path
+		self.sampling_freq = sampling_freq
+		self.period_ms = 1000.0 / sampling_freq
+		self.capture_mode = capture_mode
+		# seconds between console summaries (0: none)
+		self.summary_interval = summary_interval
+
+		self._file = open(path, "w")
+		self._file.write(TELEMETRY_HEADER)
+
+		self._start = None
+		self._opened = monotonic()
+		self._last_summary = default_timer()
+		self._reset_window()
+
+		# streaming: (stream record, mirror time, host press time) of the first press into the
+		# stream record with a mirror edge
+		self._reference = None
+		self.num_packets = 0
+		self._oversleep = _Stats()
+		self._reconfigure = _Stats()
+		self._press_call = _Stats()
+		self._skew = _Stats()
+
+	def _reset_window(self):
+		self._window_packets = 0
+		self._window_broke_early = 0
+		self._window_lost = 0
+		self._window_corrupted = 0
+		self._window_max_read = 0
+		self._window_lag = 0
+		self._window_max_lag = 0
+
+	def start_packet(self, poller):
+		"""Called right before a capture; remembers the poller's counters."""
+		self._start = (poller.iterations, poller.num_buffer_reads, poller.buffer_read_time)
+		poller.max_buffer_read_time = 0
+
+	def end_packet(self, capture, poller):
+		"""Called right after a capture; writes its telemetry line."""
+		iterations = poller.iterations - self._start[0]
+		buffer_reads = poller.num_buffer_reads - self._start[1]
+		buffer_read_time = poller.buffer_read_time - self._start[2]
+
+		press_to_detect_ms = 0
+		if capture.press_time is not None and capture.detect_time is not None:
+			press_to_detect_ms = 1000.0 * (capture.detect_time - capture.press_time)
+		num_samples, lost, corrupted = capture.buffer_info
+		host_lag_ms = press_to_detect_ms - num_samples * self.period_ms
+
+		wait_ms = _ms(capture.wait_start, capture.wait_end)
+		reconfigure_ms = _ms(capture.reconfigure_start, capture.reconfigure_end)
+		press_call_ms = 0
+		press_s = 0
+		if capture.press_time is not None:
+			# a hardware-timed press happens press_wait after the call
+			press_call = capture.press_time - capture.press_wait
+			press_call_ms = _ms(press_call, capture.press_end)
+			press_s = press_call - self._opened
+		skew_ms = self._press_skew(capture)
+
+		self._file.write("{}, {}, {}, {:.1f}, {:.1f}, {:.3f}, {}, {:.3f}, {}, {}, {}, {}, {}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.6f}, {}, {:.3f}\n".format(
+			capture.attempt_number, iterations, buffer_reads,
+			1e6 * buffer_read_time / max(buffer_reads, 1), 1e6 * poller.max_buffer_read_time,
+			press_to_detect_ms, num_samples, host_lag_ms, lost, corrupted,
+			int(capture.broke_early), int(capture.received), int(capture.ack_missed),
+			1000.0 * capture.wait_requested, wait_ms, reconfigure_ms, press_call_ms, press_s,
+			capture.mirror_index, skew_ms))
+
+		self._window_packets += 1
+		self._window_broke_early += int(capture.broke_early)
+		self._window_lost += lost
+		self._window_corrupted += corrupted
+		self._window_max_read = max(self._window_max_read, poller.max_buffer_read_time)
+		if not capture.broke_early:
+			self._window_lag += host_lag_ms
+			self._window_max_lag = max(self._window_max_lag, host_lag_ms)
+
+		self.num_packets += 1
+		if capture.wait_start is not None:
+			self._oversleep.add(wait_ms - 1000.0 * capture.wait_requested)
+		if capture.reconfigure_start is not None:
+			self._reconfigure.add(reconfigure_ms)
+		self._press_call.add(press_call_ms)
+		if not math.isnan(skew_ms):
+			self._skew.add(skew_ms)
+
+		if self.summary_interval > 0 and default_timer() - self._last_summary >= self.summary_interval:
+			self.print_summary()
+
+	def _press_skew(self, capture):
+		if capture.mirror_index < 0 or capture.press_end is None:
+			return float("nan")
+		# a hardware-timed press happens press_wait after the DigitalOut start
+		press = capture.press_end + capture.press_wait
+		mirror = float(capture.mirror_index) / self.sampling_freq
+		if self.capture_mode == "terminated" and capture.reconfigure_end is not None:
+			return 1000.0 * (mirror - (press - capture.reconfigure_end))
+		if self.capture_mode == "streaming":
+			if self._reference is None or self._reference[0] != capture.stream_record:
+				self._reference = (capture.stream_record, mirror, press)
+			return 1000.0 * ((mirror - self._reference[1]) - (press - self._reference[2]))
+		# polled: the record starts at the mirror edge
+		return float("nan")
+
+	def print_summary(self):
+		"""Prints the packets since the last summary, and starts a new window."""
+		if self._window_packets > 0:
+			received = self._window_packets - self._window_broke_early
+			print "telemetry: {} captures ({} broke early), cLost {}, cCorrupted {}, buffer read max {:.1f} us, host lag mean {:.3f} ms, max {:.3f} ms".format(
+				self._window_packets, self._window_broke_early, self._window_lost, self._window_corrupted,
+				1e6 * self._window_max_read, self._window_lag / max(received, 1), self._window_max_lag)
+		self._file.flush()
+		self._last_summary = default_timer()
+		self._reset_window()
+
+	def close(self):
+		if self.summary_interval > 0:
+			self.print_summary()
+		self._file.close()
+
+	def summary(self):
+		"""Counters written to summary_*.json (ms); press_skew_ms is None in polled mode."""
+		return {
+			"telemetry_file": self.path,
+			"num_packets": self.num_packets,
+			"oversleep_ms": self._oversleep.summary(),
+			"reconfigure_ms": self._reconfigure.summary(),
+			"press_call_ms": self._press_call.summary(),
+			"press_skew_ms": self._skew.summary(),
+		}
+
+class _Stats:
+	"""Running mean, standard deviation and extremes of a series (Welford)."""
+
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self._m2 = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, x):
+		self.count += 1
+		delta = x - self.mean
+		self.mean += delta / self.count
+		self._m2 += delta * (x - self.mean)
+		self.min = x if self.min is None else min(self.min, x)
+		self.max = x if self.max is None else max(self.max, x)
+
+	def summary(self):
+		if self.count == 0:
+			return None
+		return {
+			"count": self.count,
+			"mean": self.mean,
+			"std": math.sqrt(self._m2 / self.count),
+			"min": self.min,
+			"max": self.max,
+		}
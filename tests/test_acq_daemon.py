@@ -0,0 +1,156 @@
+"""
+	Drives acq_daemon.py through its control socket, against the simulated AD2 (fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+import acq
+import acq_daemon
+import fake_dwf
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+NETWORKS = [{"output_channels": [8, 7, 15], "input_channels": [0]}]
+
+class AcqDaemonTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.socket_path = os.path.join(self.directory, "acq_daemon.sock")
+		self.data_directory = os.path.join(self.directory, "data")
+		os.makedirs(self.data_directory)
+
+		self.dwf = acq.dwf
+		acq.dwf = fake_dwf.FakeDwf([])
+		self.device = acq.AnalogDiscoveryUtils(1)
+		self.device.open_device()
+		self.stdout = sys.stdout
+		self.server = threading.Thread(target=acq_daemon.serve, args=(self.socket_path, self.device, self.data_directory, True))
+		self.server.daemon = True
+		self.server.start()
+		self._wait(lambda: os.path.exists(self.socket_path))
+
+	def tearDown(self):
+		if self.server.is_alive():
+			acq_daemon.request(self.socket_path, {"command": "shutdown"})
+			self.server.join(30)
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _wait(self, condition, timeout=60):
+		deadline = time.time() + timeout
+		while not condition():
+			self.assertLess(time.time(), deadline, "timed out")
+			time.sleep(0.05)
+
+	def _request(self, command, **fields):
+		fields["command"] = command
+		return acq_daemon.request(self.socket_path, fields)
+
+	def _state(self):
+		return self._request("status")["state"]
+
+	def test_status_idle(self):
+		status = self._request("status")
+		self.assertTrue(status["ok"])
+		self.assertEqual(status["state"], "idle")
+		self.assertIsNone(status["running"])
+		self.assertEqual(status["experiments"], [])
+
+	def test_start_runs_to_the_end(self):
+		response = self._request("start", experiment={"name": "short", "networks": NETWORKS,
+			"num_packets": 5, "sampling_freq": 1000000})
+		self.assertTrue(response["ok"], response)
+		self._wait(lambda: self._state() == "idle")
+
+		status = self._request("status")
+		self.assertEqual([experiment["name"] for experiment in status["experiments"]], ["short"])
+		self.assertEqual(status["experiments"][0]["status"], "ok")
+		directory = os.path.join(self.data_directory, "short")
+		self.assertEqual(status["experiments"][0]["directory"], directory)
+		self.assertTrue(os.path.exists(os.path.join(directory, "experiment.json")))
+		# the run's output went to its log, and stdout is the daemon's again
+		with open(os.path.join(directory, "acq.log")) as log:
+			self.assertIn("5 received", log.read())
+		self.assertIs(sys.stdout.stdout, self.stdout)
+		self.assertIsNone(sys.stdout.log)
+
+	def test_stop(self):
+		response = self._request("start", experiment={"name": "long", "networks": NETWORKS,
+			"num_packets": 100000, "sampling_freq": 1000000})
+		self.assertTrue(response["ok"], response)
+		self._wait(lambda: (self._request("status")["running"] or {}).get("counts", {}).get("num_packets", 0) > 0)
+
+		status = self._request("status")
+		self.assertEqual(status["state"], "running")
+		self.assertEqual(status["running"]["name"], "long")
+		# one experiment at a time
+		response = self._request("start", experiment={"name": "second", "networks": NETWORKS,
+			"num_packets": 5, "sampling_freq": 1000000})
+		self.assertFalse(response["ok"])
+
+		self.assertTrue(self._request("stop")["ok"])
+		self._wait(lambda: self._state() == "idle")
+		self.assertFalse(self._request("stop")["ok"])
+		status = self._request("status")
+		self.assertEqual(status["experiments"][0]["status"], "ok")
+		with open(os.path.join(self.data_directory, "long", "experiment.json")) as f:
+			runs = json.load(f)["runs"]
+		self.assertEqual(runs[0]["stop_reason"], "stopped by a client")
+
+	def test_stop_then_resume(self):
+		response = self._request("start", experiment={"name": "stopped", "networks": NETWORKS,
+			"num_packets": 30, "sampling_freq": 1000000})
+		self.assertTrue(response["ok"], response)
+		self._wait(lambda: (self._request("status")["running"] or {}).get("counts", {}).get("num_packets", 0) > 0)
+		self.assertTrue(self._request("stop")["ok"])
+		self._wait(lambda: self._state() == "idle")
+
+		directory = os.path.join(self.data_directory, "stopped")
+		checkpoint_file, = glob.glob(os.path.join(directory, "checkpoint_*.json"))
+		with open(checkpoint_file) as f:
+			checkpoint = json.load(f)
+		# the run was stopped, not finished
+		self.assertIsNone(checkpoint["stop_reason"])
+		self.assertLess(checkpoint["num_tries"], 30)
+
+		# acq.py --resume on the device the daemon is done with
+		ad_utils = acq.AnalogDiscoveryUtils(1000000)
+		ad_utils.use_device(self.device)
+		ad_utils.resume_from = checkpoint_file
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		try:
+			ad_utils.add_network(acq.list_of_networks[0])
+			data_file = ad_utils.run(directory)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+		self.assertEqual(ad_utils.run_summary["num_sessions"], 2)
+		self.assertEqual(ad_utils.run_summary["num_tries"], 30)
+		self.assertEqual(ad_utils.run_summary["stop_reason"], "sent num_packets (30)")
+		with open(data_file) as f:
+			packets = set(abs(int(line.split(",")[0])) for line in f.readlines()[1:])
+		self.assertEqual(packets, set(range(1, 31)))
+
+	def test_invalid_requests(self):
+		self.assertFalse(self._request("start", experiment={"name": "empty"})["ok"])
+		self.assertFalse(self._request("frobnicate")["ok"])
+
+	def test_shutdown(self):
+		self.assertTrue(self._request("shutdown")["ok"])
+		self.server.join(30)
+		self.assertFalse(self.server.is_alive())
+		self.assertFalse(os.path.exists(self.socket_path))
+		self.assertIs(sys.stdout, self.stdout)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,231 @@
+"""
+	Checks the packet results of the capture paths against the original one, on the simulated AD2
+	(fake_dwf.py).
+
+	The original acq.py captured in polled mode and wrote a line for every sample that differs from
+	the one before it, in a per-sample loop. The other capture modes and options must find the
+	same packets, received or missed, with the same latencies.
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+import acq
+import collections
+import ctypes
+import edge_log
+import fake_dwf
+import glob
+import numpy as np
+import os
+import shutil
+import stimulus
+import sys
+import tempfile
+import unittest
+
+NUM_PACKETS = 10
+SAMPLING_FREQ = 1000000
+
+def original_postprocess(attempt_number, ack_missed, buffer_info, data, period_ms, missed_packet=False):
+	"""The data file lines the original postprocess loop wrote for one capture buffer."""
+	if missed_packet:
+		attempt_number = -1 * attempt_number
+	lines = []
+	index, prev_sample = 0, 0
+	for sample in data:
+		if index > buffer_info[0]:
+			break
+		if (prev_sample ^ sample) != 0:
+			latency = index * period_ms
+			lines.append("{}, {}, {}, {}, {}\n".format(attempt_number, index, latency, acq.binary_num_str(sample, split=True), int(ack_missed)))
+		index += 1
+		prev_sample = sample
+	return lines
+
+def run_capture(directory, capture_mode="polled", num_packets=NUM_PACKETS, dwf_class=fake_dwf.FakeDwf,
+		dwf_options=None, network_options=None, output_channels=(8, 7, 15), **options):
+	"""Runs num_packets packets on a fresh simulated AD2 (dwf_class), with the AnalogDiscoveryUtils
+	attributes in options. dwf_options and network_options are arguments of the simulated AD2 and
+	of SimulatedNetwork over the defaults below. The network's button is on DIO 0 and its mirror,
+	creation and reception channels are output_channels, by default as in acq_experiment_inputs.txt. Returns (the data file, the run summary).
+	"""
+	dwf_args = {"time_scale": 0, "usb_latency": 50e-6, "seed": 2}
+	dwf_args.update(dwf_options or {})
+	network_args = {"seed": 1, "latency_model": fake_dwf.TschLatencyModel(11, pdr=0.2, seed=4)}
+	network_args.update(network_options or {})
+	network = fake_dwf.SimulatedNetwork(0, output_channels[0], output_channels[1], output_channels[2:], **network_args)
+	acq.dwf = dwf_class([network], **dwf_args)
+	del acq.list_of_networks[:]
+	acq.initialize_network(list(output_channels), [0], num_packets)
+	ad_utils = acq.AnalogDiscoveryUtils(SAMPLING_FREQ)
+	ad_utils.open_device()
+	try:
+		ad_utils.add_network(acq.list_of_networks[0])
+		ad_utils.capture_mode = capture_mode
+		for name, value in options.items():
+			setattr(ad_utils, name, value)
+		data_file = ad_utils.run(directory)
+	finally:
+		ad_utils.close_device()
+	return data_file, ad_utils.run_summary
+
+def packet_latencies(data_file):
+	"""{packet number: latency (ms) of its last edge}; missed packets have negative numbers."""
+	latencies = collections.OrderedDict()
+	if data_file.endswith(edge_log.EDGE_LOG_EXTENSION):
+		header, records = edge_log.read_edge_log(data_file)
+		for packet, latency in zip(records["packet"].tolist(), edge_log.latencies_ms(header, records).tolist()):
+			latencies[packet] = latency
+		return latencies
+	with open(data_file) as f:
+		for line in f.readlines()[1:]:
+			fields = line.split(",")
+			latencies[int(fields[0])] = float(fields[2])
+	return latencies
+
+class PostprocessTest(unittest.TestCase):
+	"""postprocess (extract_edges) against the original per-sample loop."""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.ad_utils = acq.AnalogDiscoveryUtils(SAMPLING_FREQ)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def _check(self, data, num_samples, missed_packet=False, ack_missed=False):
+		buffer = (ctypes.c_uint16 * len(data))(*data)
+		buffer_info = (num_samples, 0, 0)
+		data_file = os.path.join(self.directory, "data.csv")
+		if os.path.exists(data_file):
+			os.remove(data_file)
+		self.ad_utils.postprocess(7, ack_missed, buffer_info, buffer, data_file, missed_packet=missed_packet)
+		with open(data_file) as f:
+			lines = f.readlines()
+		self.assertEqual(lines, original_postprocess(7, ack_missed, buffer_info, data, self.ad_utils.period_ms, missed_packet))
+
+	def test_random_buffers(self):
+		rng = np.random.RandomState(3)
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		try:
+			for num_samples in [0, 1, 100, 4095, 4096]:
+				# runs of constant samples, as the DIO pins give
+				data = np.repeat(rng.randint(0, 1 << 16, 200), rng.randint(1, 60, 200))[:4096].tolist()
+				data += [0] * (4096 - len(data))
+				self._check(data, num_samples)
+				self._check(data, num_samples, missed_packet=True, ack_missed=True)
+			# starts high, and a buffer with no change after the first sample
+			self._check([5] * 64, 63)
+			self._check([0] * 64, 63)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+
+class CaptureModesTest(unittest.TestCase):
+	"""Every capture path against the original polled capture of the same simulated network."""
+
+	longMessage = True
+
+	@classmethod
+	def setUpClass(cls):
+		cls.dwf = acq.dwf
+		cls.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		cls.directory = tempfile.mkdtemp()
+		data_file, cls.summary = run_capture(cls._directory("original"), chunked_capture=False)
+		cls.latencies = packet_latencies(data_file)
+
+	@classmethod
+	def tearDownClass(cls):
+		sys.stdout.close()
+		sys.stdout = cls.stdout
+		acq.dwf = cls.dwf
+		shutil.rmtree(cls.directory)
+
+	@classmethod
+	def _directory(cls, name):
+		directory = os.path.join(cls.directory, name)
+		os.makedirs(directory)
+		return directory
+
+	def _check(self, name, capture_mode="polled", original=None, **options):
+		"""Runs name and checks it against original, the (data file, run summary) of the original
+		capture of the same network (by default the one of setUpClass). Returns its run summary.
+		"""
+		data_file, summary = run_capture(self._directory(name), capture_mode, **options)
+		latencies = packet_latencies(data_file)
+		original_latencies, original_summary = self.latencies, self.summary
+		if original is not None:
+			original_latencies, original_summary = packet_latencies(original[0]), original[1]
+		# the same packets, received (positive number) or missed (negative)
+		self.assertEqual(latencies.keys(), original_latencies.keys())
+		for packet, latency in original_latencies.items():
+			if packet > 0:
+				# a polled record ends a poll after the reception, so its last edge is a little later
+				self.assertAlmostEqual(latencies[packet], latency, delta=0.5, msg="packet {}".format(packet))
+		for key in ["num_tries", "num_packets_received", "num_packets_missed", "packets_missed"]:
+			self.assertEqual(summary[key], original_summary[key], key)
+		return summary
+
+	def test_original_run(self):
+		self.assertEqual(self.summary["num_tries"], NUM_PACKETS)
+		self.assertEqual(len(self.latencies), NUM_PACKETS)
+		# the simulated network loses packets
+		self.assertGreater(self.summary["num_packets_missed"], 0)
+		self.assertGreater(self.summary["num_packets_received"], 0)
+
+	def test_chunked(self):
+		self._check("chunked", chunked_capture=True)
+
+	def test_terminated(self):
+		self._check("terminated", "terminated")
+
+	def test_streaming(self):
+		self._check("streaming", "streaming")
+
+	def test_streaming_reader_thread(self):
+		self._check("streaming_reader_thread", "streaming", reader_thread=True)
+
+	def test_background_writer(self):
+		self._check("background_writer", background_writer=True)
+
+	def test_binary_edge_log(self):
+		self._check("binary", data_format="bin")
+
+	def _check_hardware_press(self, capture_mode):
+		name = "hardware_press_" + capture_mode
+		self._check(name, capture_mode, hardware_press=True, press_seed=5)
+		# one press per packet, after the wait the seed schedules
+		presses_file, = glob.glob(os.path.join(self.directory, name, "presses_*.csv"))
+		with open(presses_file) as f:
+			presses = [[round(float(field), 6) for field in line.split(",")] for line in f.readlines()[1:]]
+		schedule = stimulus.PressSchedule(5)
+		self.assertEqual(presses, [[i, i, round(1000.0 * schedule.wait(i), 6), 0.1] for i in range(1, NUM_PACKETS + 1)])
+
+	def test_hardware_press_polled(self):
+		self._check_hardware_press("polled")
+
+	def test_hardware_press_terminated(self):
+		self._check_hardware_press("terminated")
+
+	def test_hardware_press_streaming(self):
+		self._check_hardware_press("streaming")
+
+	def test_adaptive_window(self):
+		summary = self._check("adaptive_window", adaptive_window=True)
+		# the missed packets were extended up to the ceiling before they were given up on
+		window = summary["capture_window"]
+		self.assertGreater(window["num_extensions"], 0)
+		self.assertEqual(window["max_window_samples"], window["ceiling_samples"])
+
+	def test_adaptive_window_misses(self):
+		# a network that loses most packets; every run gets a fresh latency model
+		network_options = lambda: {"latency_model": fake_dwf.TschLatencyModel(11, pdr=0.05, seed=4)}
+		original = run_capture(self._directory("original_misses"), network_options=network_options(), chunked_capture=False)
+		self.assertGreater(original[1]["num_packets_missed"], NUM_PACKETS / 2)
+		self._check("adaptive_window_misses", original=original, network_options=network_options(), adaptive_window=True)
+
+if __name__ == "__main__":
+	unittest.main()
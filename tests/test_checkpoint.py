@@ -0,0 +1,101 @@
+"""
+	Resumes runs from their checkpoints (checkpoint.py, acq.py --resume) on the simulated AD2
+	(fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from test_capture_modes import SAMPLING_FREQ, packet_latencies, run_capture
+import acq
+import json
+import os
+import shutil
+import sketch
+import sys
+import tempfile
+import unittest
+
+COUNTS = ["num_tries", "num_packets_received", "num_packets_missed", "num_acks_missed", "packets_missed",
+	"num_samples_lost", "num_samples_corrupted", "packets_lost_samples"]
+
+def resume_capture(checkpoint_file, num_packets, **options):
+	"""Resumes the run of checkpoint_file on the simulated AD2 it ran on, up to num_packets packets.
+	Returns (the data file, the run summary).
+	"""
+	del acq.list_of_networks[:]
+	acq.initialize_network([8, 7, 15], [0], num_packets)
+	ad_utils = acq.AnalogDiscoveryUtils(SAMPLING_FREQ)
+	ad_utils.open_device()
+	try:
+		ad_utils.add_network(acq.list_of_networks[0])
+		for name, value in options.items():
+			setattr(ad_utils, name, value)
+		ad_utils.resume_from = checkpoint_file
+		data_file = ad_utils.run(os.path.dirname(checkpoint_file))
+	finally:
+		ad_utils.close_device()
+	return data_file, ad_utils.run_summary
+
+class ResumeTest(unittest.TestCase):
+
+	longMessage = True
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _directory(self, name):
+		directory = os.path.join(self.directory, name)
+		os.makedirs(directory)
+		return directory
+
+	def _check_resume(self, **options):
+		# the whole run in one session, and the same run cut short after 8 packets
+		data_file, summary = run_capture(self._directory("whole"), num_packets=12, **options)
+		data_file, first = run_capture(self._directory("resumed"), num_packets=8, checkpoint_interval=4, **options)
+		with open(first["checkpoint_file"]) as f:
+			checkpoint = json.load(f)
+		self.assertIsNone(checkpoint["stop_reason"])
+		self.assertEqual(checkpoint["data_file_size"], os.path.getsize(data_file))
+		for key in COUNTS:
+			self.assertEqual(checkpoint[key], first[key], key)
+
+		# the run went on past the checkpoint before it was cut short: packets nobody counted
+		with open(data_file, "ab") as f:
+			f.write("9, 0, 0.0, 0000 0000 1000 0001 , 0\n" * 3)
+
+		# the simulated AD2 goes on from the packets it was pressed for
+		resumed_data_file, resumed = resume_capture(first["checkpoint_file"], 12, **options)
+		self.assertEqual(resumed_data_file, data_file)
+		self.assertEqual(resumed["num_sessions"], 2)
+		self.assertEqual(resumed["start_time"], first["start_time"])
+		for key in COUNTS:
+			self.assertEqual(resumed[key], summary[key], key)
+		resumed_sketch = sketch.load(resumed["sketch_file"])
+		self.assertEqual(resumed_sketch.count, summary["num_packets_received"])
+		self.assertEqual(resumed_sketch.num_missed, summary["num_packets_missed"])
+		# the packets after the checkpoint were cut, and measured again
+		latencies = packet_latencies(data_file)
+		whole_latencies = packet_latencies(summary["data_file"])
+		self.assertEqual(latencies.keys(), whole_latencies.keys())
+		for packet, latency in whole_latencies.items():
+			if packet > 0:
+				self.assertAlmostEqual(latencies[packet], latency, delta=0.5, msg="packet {}".format(packet))
+
+	def test_resume_csv(self):
+		self._check_resume()
+
+	def test_resume_binary(self):
+		self._check_resume(data_format="bin")
+
+if __name__ == "__main__":
+	unittest.main()
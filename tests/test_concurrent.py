@@ -0,0 +1,94 @@
+"""
+	Runs several networks at once (AnalogDiscoveryUtils.run_networks) on the simulated AD2
+	(fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from test_capture_modes import NUM_PACKETS, SAMPLING_FREQ, packet_latencies, run_capture
+import acq
+import fake_dwf
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# (button channel, output channels) of every network; the first is wired as in run_capture
+NETWORKS = [(0, [8, 7, 15]), (1, [11, 10, 9]), (2, [14, 13, 12])]
+
+class ConcurrentTest(unittest.TestCase):
+	"""Every network of a concurrent run against the same network run on its own."""
+
+	longMessage = True
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _directory(self, name):
+		directory = os.path.join(self.directory, name)
+		os.makedirs(directory)
+		return directory
+
+	def _run_networks(self, directory, **options):
+		"""Runs NETWORKS at once, each with the latency model of run_capture. Returns the run summary."""
+		# the same packets on every network, so each one can be checked against the single run
+		networks = [fake_dwf.SimulatedNetwork(button, outputs[0], outputs[1], outputs[2:], seed=1,
+			latency_model=fake_dwf.TschLatencyModel(11, pdr=0.2, seed=4)) for button, outputs in NETWORKS]
+		acq.dwf = fake_dwf.FakeDwf(networks, time_scale=0, usb_latency=50e-6, seed=2)
+		del acq.list_of_networks[:]
+		for button, outputs in NETWORKS:
+			acq.initialize_network(outputs, [button], NUM_PACKETS)
+		ad_utils = acq.AnalogDiscoveryUtils(SAMPLING_FREQ)
+		ad_utils.open_device()
+		try:
+			for name, value in options.items():
+				setattr(ad_utils, name, value)
+			data_files = ad_utils.run_networks(directory, acq.list_of_networks)
+		finally:
+			ad_utils.close_device()
+		self.assertEqual(data_files, [network["data_file"] for network in ad_utils.run_summary["networks"]])
+		return ad_utils.run_summary
+
+	def _check(self, **options):
+		data_file, single = run_capture(self._directory("single"), chunked_capture=False)
+		single_latencies = packet_latencies(data_file)
+		summary = self._run_networks(self._directory("concurrent"), **options)
+		self.assertEqual(len(summary["networks"]), len(NETWORKS))
+		for index, network in enumerate(summary["networks"]):
+			latencies = packet_latencies(network["data_file"])
+			self.assertEqual(latencies.keys(), single_latencies.keys(), "network {}".format(index))
+			for packet, latency in single_latencies.items():
+				if packet > 0:
+					self.assertAlmostEqual(latencies[packet], latency, delta=0.5, msg="network {}, packet {}".format(index, packet))
+			for key in ["num_tries", "num_packets_received", "num_packets_missed"]:
+				self.assertEqual(network[key], single[key], "network {}: {}".format(index, key))
+
+	def test_run_networks(self):
+		self._check()
+
+	def test_reader_thread(self):
+		self._check(reader_thread=True)
+
+	def test_binary_edge_log(self):
+		self._check(data_format="bin")
+
+	def test_shared_channels(self):
+		del acq.list_of_networks[:]
+		acq.initialize_network([8, 7, 15], [0], NUM_PACKETS)
+		acq.initialize_network([11, 10, 15], [1], NUM_PACKETS)
+		ad_utils = acq.AnalogDiscoveryUtils(SAMPLING_FREQ)
+		self.assertRaises(AssertionError, ad_utils.run_networks, self.directory, acq.list_of_networks)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,54 @@
+"""
+	Runs multi_device.py against simulated AD2 units (fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+import multi_device
+import os
+import shutil
+import tempfile
+import unittest
+
+class MultiDeviceTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.input_files = []
+		for name in ["a", "b"]:
+			input_file = os.path.join(self.directory, name + ".txt")
+			with open(input_file, "w") as f:
+				f.write("8, 7, 15\n0\n5\n1000000\n")
+			self.input_files.append(input_file)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def _run(self, **options):
+		run_options = {"capture_mode": "polled", "background_writer": False, "poll_interval": 0, "binary": False,
+			"concurrent": False, "simulate": 2}
+		run_options.update(options)
+		devices = multi_device.find_devices(2)
+		self.assertEqual(len(devices), 2)
+		assignment = multi_device.assign_networks(self.input_files, devices)
+		return multi_device.run_devices(os.path.join(self.directory, "experiment"), assignment, run_options)
+
+	def _check(self, metadata):
+		self.assertEqual([device["device"]["serial"] for device in metadata], ["SN:FAKE0000", "SN:FAKE0001"])
+		for device in metadata:
+			self.assertIsNone(device["error"])
+			self.assertFalse(device["interrupted"])
+			self.assertEqual(len(device["runs"]), 1)
+			self.assertEqual(device["runs"][0]["num_tries"], 5)
+			self.assertTrue(os.path.exists(os.path.join(device["directory"], "device.json")))
+
+	def test_two_devices(self):
+		self._check(self._run())
+
+	def test_two_devices_background_writer(self):
+		# the background writer starts a process pool of its own in every device's worker
+		self._check(self._run(background_writer=True))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,99 @@
+"""
+	Captures a one-to-many network (one sender, several receivers) on the simulated AD2
+	(fake_dwf.py), in every capture mode.
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from test_capture_modes import packet_latencies, run_capture
+import acq
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# mirror, creation, and three receivers
+OUTPUT_CHANNELS = (8, 7, 15, 14, 13)
+
+def read_receivers(receivers_file):
+	"""{packet number: (latency (ms) of every receiver, -1 if it did not get it)} of a ReceiverLog."""
+	receivers = {}
+	with open(receivers_file) as f:
+		for line in f.readlines()[1:]:
+			fields = line.split(",")
+			receivers[int(fields[0])] = [float(field) for field in fields[1:-1]]
+	return receivers
+
+class OneToManyTest(unittest.TestCase):
+	"""Packet counts of every capture mode against the receivers that got each packet."""
+
+	longMessage = True
+
+	@classmethod
+	def setUpClass(cls):
+		cls.dwf = acq.dwf
+		cls.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		cls.directory = tempfile.mkdtemp()
+		cls.polled = cls._run("polled")
+
+	@classmethod
+	def tearDownClass(cls):
+		sys.stdout.close()
+		sys.stdout = cls.stdout
+		acq.dwf = cls.dwf
+		shutil.rmtree(cls.directory)
+
+	@classmethod
+	def _run(cls, capture_mode):
+		"""Returns (the data file's latencies, the receivers' latencies, the run summary)."""
+		directory = os.path.join(cls.directory, capture_mode)
+		os.makedirs(directory)
+		data_file, summary = run_capture(directory, capture_mode, output_channels=OUTPUT_CHANNELS)
+		return packet_latencies(data_file), read_receivers(summary["receivers_file"]), summary
+
+	def _check(self, run):
+		latencies, receivers, summary = run
+		self.assertEqual(sorted(receivers.keys()), sorted(abs(packet) for packet in latencies))
+		# a packet is received once every receiver got it, partial if only some did
+		received = [packet for packet, got in receivers.items() if min(got) >= 0]
+		partial = [packet for packet, got in receivers.items() if min(got) < 0 and max(got) >= 0]
+		self.assertEqual(summary["num_packets_received"], len(received))
+		self.assertEqual(summary["num_packets_partial"], len(partial))
+		self.assertEqual(summary["num_packets_missed"], len(receivers) - len(received))
+		self.assertEqual(sorted(packet for packet in latencies if packet > 0), sorted(received))
+		for packet in received:
+			# the packet's last edge is the last receiver's reception
+			self.assertAlmostEqual(latencies[packet], max(receivers[packet]), delta=0.5, msg="packet {}".format(packet))
+		for i, receiver in enumerate(summary["receivers"]):
+			self.assertEqual(receiver["channel"], OUTPUT_CHANNELS[2 + i])
+			self.assertEqual(receiver["num_packets_received"], len([got for got in receivers.values() if got[i] >= 0]))
+
+	def _check_against_polled(self, capture_mode):
+		run = self._run(capture_mode)
+		self._check(run)
+		latencies, receivers, summary = run
+		polled_latencies, polled_receivers, polled_summary = self.polled
+		for key in ["num_tries", "num_packets_received", "num_packets_missed", "num_packets_partial", "packets_missed"]:
+			self.assertEqual(summary[key], polled_summary[key], key)
+		# the same receivers got every packet
+		for packet, got in polled_receivers.items():
+			self.assertEqual([latency >= 0 for latency in receivers[packet]], [latency >= 0 for latency in got], "packet {}".format(packet))
+
+	def test_polled(self):
+		self._check(self.polled)
+		# the simulated network loses packets on some receivers but not others
+		summary = self.polled[2]
+		self.assertGreater(summary["num_packets_partial"], 0)
+		self.assertGreater(summary["num_packets_received"], 0)
+
+	def test_terminated(self):
+		self._check_against_polled("terminated")
+
+	def test_streaming(self):
+		self._check_against_polled("streaming")
+
+if __name__ == "__main__":
+	unittest.main()
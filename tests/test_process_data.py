@@ -0,0 +1,61 @@
+"""
+	Converts the data file of a run with process_data.py, from a csv and from a binary edge log.
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from test_capture_modes import run_capture
+import acq
+import os
+import process_data
+import shutil
+import sys
+import tempfile
+import unittest
+
+class ProcessDataTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _convert(self, data_format):
+		"""Captures the run in data_format and converts it. Returns the lines of (the packet latencies,
+		the missed packet samples).
+		"""
+		directory = os.path.join(self.directory, data_format)
+		os.makedirs(directory)
+		data_file, summary = run_capture(directory, data_format=data_format)
+		if data_format == "bin":
+			data = process_data.parse_edge_log(data_file)
+		else:
+			data = process_data.parse_data(data_file)
+		output = os.path.join(directory, "processed")
+		process_data.write_new_data(output, data)
+		with open(output + ".csv") as f:
+			latencies = f.readlines()
+		with open(output + "_missed_packet_samples.csv") as f:
+			missed = f.readlines()
+		return latencies, missed, summary
+
+	def test_csv_and_edge_log(self):
+		csv_latencies, csv_missed, summary = self._convert("csv")
+		bin_latencies, bin_missed, bin_summary = self._convert("bin")
+		# the simulated network starts with a missed packet, whose first row is not in the dump
+		self.assertEqual(summary["packets_missed"][0], 1)
+		self.assertEqual(bin_summary["packets_missed"], summary["packets_missed"])
+		self.assertEqual(len(csv_latencies), summary["num_packets_received"])
+		self.assertEqual(bin_latencies, csv_latencies)
+		self.assertEqual(bin_missed, csv_missed)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,125 @@
+"""
+	Runs a queue of experiments (queue_runner.py) on the simulated AD2 (fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+import acq
+import fake_dwf
+import json
+import os
+import queue_runner
+import shutil
+import sys
+import tempfile
+import unittest
+
+class FailingDwf(fake_dwf.FakeDwf):
+	"""Fails every button press of a network whose mirror is on fail_channel, while failing is set."""
+
+	fail_channel = 5
+
+	def __init__(self, *args, **kwargs):
+		fake_dwf.FakeDwf.__init__(self, *args, **kwargs)
+		self.failing = True
+
+	def FDwfDigitalIOOutputSet(self, hdwf, value):
+		if self.failing and any(network.mirror_channel == self.fail_channel for network in self.networks):
+			raise RuntimeError("simulated USB error")
+		return fake_dwf.FakeDwf.FDwfDigitalIOOutputSet(self, hdwf, value)
+
+def experiment(name, mirror_channel=8, **fields):
+	experiment = {"name": name, "networks": [{"output_channels": [mirror_channel, 7, 15], "input_channels": [0]}],
+		"num_packets": 5, "sampling_freq": 1000000}
+	experiment.update(fields)
+	return experiment
+
+class QueueRunnerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		acq.dwf = FailingDwf([])
+		self.cwd = os.getcwd()
+		self.directory = tempfile.mkdtemp()
+		# the queue writes to data/ in the working directory
+		os.chdir(self.directory)
+		self.stdout = sys.stdout
+		self.output = open(os.devnull, "w")
+		sys.stdout = self.output
+
+	def tearDown(self):
+		sys.stdout = self.stdout
+		self.output.close()
+		os.chdir(self.cwd)
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _run_queue(self, plan, skip_done=False):
+		plan_file = os.path.join(self.directory, "plan.json")
+		with open(plan_file, "w") as f:
+			json.dump(plan, f)
+		manifest = queue_runner.run_queue(queue_runner.load_plan(plan_file), plan_file, skip_done=skip_done, simulate=True)
+		# what the experiments print went to their logs, and sys.stdout is back
+		self.assertIs(sys.stdout, self.output)
+		with open(os.path.join("data", plan["name"], "manifest.json")) as f:
+			self.assertEqual(json.load(f)["experiments"], json.loads(json.dumps(manifest["experiments"])))
+		return manifest
+
+	def test_two_experiments(self):
+		manifest = self._run_queue({"name": "queue", "experiments": [
+			experiment("first"),
+			experiment("second", options=["--streaming"], num_packets=3),
+		]})
+		self.assertEqual([(e["name"], e["status"]) for e in manifest["experiments"]], [("first", "ok"), ("second", "ok")])
+		for name, capture_mode, num_packets in [("first", "polled", 5), ("second", "streaming", 3)]:
+			directory = os.path.join("data", "queue", name)
+			with open(os.path.join(directory, "experiment.json")) as f:
+				metadata = json.load(f)
+			self.assertEqual(metadata["status"], "ok")
+			self.assertIsNone(metadata["error"])
+			run, = metadata["runs"]
+			self.assertEqual(run["capture_mode"], capture_mode)
+			self.assertEqual(run["num_tries"], num_packets)
+			with open(os.path.join(directory, "acq.log")) as log:
+				self.assertIn("Number of tries: {}".format(num_packets), log.read())
+		self.assertIsNotNone(manifest["finished"])
+
+	def test_failed_experiment(self):
+		plan = {"name": "failing", "experiments": [
+			experiment("first"),
+			experiment("broken", mirror_channel=FailingDwf.fail_channel),
+			experiment("last"),
+		]}
+		manifest = self._run_queue(plan)
+		# the queue goes on after a failed experiment
+		self.assertEqual([(e["name"], e["status"]) for e in manifest["experiments"]], [("first", "ok"), ("broken", "failed"), ("last", "ok")])
+		self.assertIn("simulated USB error", manifest["experiments"][1]["error"])
+		with open(os.path.join("data", "failing", "broken", "acq.log")) as log:
+			self.assertIn("simulated USB error", log.read())
+
+		# only the failed experiment runs again
+		acq.dwf.failing = False
+		manifest = self._run_queue(plan, skip_done=True)
+		self.assertEqual([(e["name"], e["status"]) for e in manifest["experiments"]], [("first", "ok"), ("broken", "ok"), ("last", "ok")])
+		with open(os.path.join("data", "failing", "broken", "experiment.json")) as f:
+			self.assertEqual(json.load(f)["status"], "ok")
+
+	def test_execute_experiment_restores_stdout(self):
+		directory = os.path.join(self.directory, "single")
+		os.makedirs(directory)
+		for name, failing in [("single", False), ("single_broken", True)]:
+			acq.dwf.failing = failing
+			single = experiment(name, mirror_channel=FailingDwf.fail_channel)
+			queue_runner.check_experiment(single, self.directory)
+			device = acq.AnalogDiscoveryUtils(1000000)
+			device.open_device()
+			try:
+				metadata, ad_utils = queue_runner.run_experiment(single, directory, device, simulate=True)
+			finally:
+				device.close_device()
+			self.assertEqual(metadata["status"], "failed" if failing else "ok")
+			self.assertIs(sys.stdout, self.output)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,91 @@
+"""
+	Runs the stopping rule (sketch.QuantileStoppingRule) on the simulated AD2 (fake_dwf.py).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from sketch import LatencySketch, QuantileStoppingRule
+from test_capture_modes import packet_latencies, run_capture
+import acq
+import fake_dwf
+import os
+import shutil
+import sketch
+import sys
+import tempfile
+import unittest
+
+NUM_PACKETS = 100
+
+def first_stop(latencies, rule):
+	"""The packet number after which rule is met by latencies (see packet_latencies), or None."""
+	packets = LatencySketch()
+	for packet, latency in latencies.items():
+		if packet > 0:
+			packets.add(latency)
+		else:
+			packets.add_missed()
+		if rule.check(packets) is not None:
+			return abs(packet)
+	return None
+
+class StoppingRuleTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _run(self, rule, **options):
+		network_options = {"latency_model": fake_dwf.TschLatencyModel(11, pdr=0.9, seed=4)}
+		data_file, summary = run_capture(self.directory, num_packets=NUM_PACKETS, network_options=network_options,
+			stopping_rule=rule, **options)
+		latencies = packet_latencies(data_file)
+		# every packet pressed for was written and counted
+		self.assertEqual(len(latencies), summary["num_tries"])
+		self.assertEqual(sketch.load(summary["sketch_file"]).count, summary["num_packets_received"])
+		return latencies, summary
+
+	def test_stops_at_the_target_quantile(self):
+		rule = QuantileStoppingRule(0.5, 3, min_packets=20)
+		latencies, summary = self._run(rule)
+		# the run stopped right after the packet that met the rule
+		stop = first_stop(latencies, rule)
+		self.assertIsNotNone(stop)
+		self.assertEqual(summary["num_tries"], stop)
+		self.assertLess(summary["num_tries"], NUM_PACKETS)
+		self.assertTrue(summary["stop_reason"].startswith("p50 converged after"), summary["stop_reason"])
+
+	def test_min_packets(self):
+		# met as soon as it may be
+		rule = QuantileStoppingRule(0.5, 100, min_packets=20)
+		latencies, summary = self._run(rule)
+		self.assertEqual(summary["num_packets_received"], 20)
+
+	def test_not_met(self):
+		rule = QuantileStoppingRule(0.5, 0.001, min_packets=20)
+		latencies, summary = self._run(rule)
+		self.assertIsNone(first_stop(latencies, rule))
+		self.assertEqual(summary["num_tries"], NUM_PACKETS)
+		self.assertEqual(summary["stop_reason"], "sent num_packets ({})".format(NUM_PACKETS))
+
+	def test_background_writer(self):
+		rule = QuantileStoppingRule(0.5, 3, min_packets=20)
+		latencies, summary = self._run(rule, background_writer=True, writer_queue_size=2)
+		# the packets in the writer's queue (2) and the one being written when the rule was met
+		# were pressed for too
+		stop = first_stop(latencies, rule)
+		self.assertIsNotNone(stop)
+		self.assertGreaterEqual(summary["num_tries"], stop)
+		self.assertLessEqual(summary["num_tries"], stop + 3)
+
+if __name__ == "__main__":
+	unittest.main()
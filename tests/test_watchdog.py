@@ -0,0 +1,86 @@
+"""
+	Runs the stall watchdog (watchdog.py) against a simulated AD2 that wedges DigitalIn now and
+	then (fake_dwf.FakeDwf hang_rate).
+
+	Run from the repository root:
+		python -m unittest discover tests
+"""
+
+from fake_dwf import _value
+from test_capture_modes import run_capture
+import acq
+import fake_dwf
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+class ArmHangDwf(fake_dwf.FakeDwf):
+	"""Wedges DigitalIn as it is armed for the hang_arm-th time, before any sample comes."""
+
+	hang_arm = 3
+
+	def __init__(self, *args, **kwargs):
+		fake_dwf.FakeDwf.__init__(self, *args, **kwargs)
+		self.num_arms = 0
+
+	def FDwfDigitalInConfigure(self, hdwf, reconfigure, start):
+		fake_dwf.FakeDwf.FDwfDigitalInConfigure(self, hdwf, reconfigure, start)
+		if _value(start):
+			self.num_arms += 1
+			if self.num_arms == self.hang_arm:
+				self.hung = True
+				self.num_hangs += 1
+				self._hung_state = self.digital_in.state
+				self.digital_in.status_record = (0, 0, 0)
+				self.digital_in._fetched_count = 0
+		return 1
+
+class WatchdogTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dwf = acq.dwf
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		acq.dwf = self.dwf
+		shutil.rmtree(self.directory)
+
+	def _run(self, capture_mode, **options):
+		data_file, summary = run_capture(self.directory, capture_mode, num_packets=20, watchdog=True, stall_timeout=0.1,
+			network_options={"mirror_delay": 1e-3}, **options)
+		self.assertEqual(summary["num_tries"], 20)
+		return summary["watchdog"]
+
+	def _check_hang_rate(self, capture_mode):
+		watchdog = self._run(capture_mode, dwf_options={"hang_rate": 2e-5})
+		num_hangs = acq.dwf.num_hangs
+		self.assertGreater(num_hangs, 0)
+		# every hang is one stall, cleared by the first re-arm
+		self.assertEqual(sum(watchdog["stalls"].values()), num_hangs)
+		self.assertEqual(watchdog["recoveries"], {"rearm": num_hangs})
+
+	def test_hang_rate_polled(self):
+		self._check_hang_rate("polled")
+
+	def test_hang_rate_terminated(self):
+		self._check_hang_rate("terminated")
+
+	def test_hang_rate_streaming(self):
+		self._check_hang_rate("streaming")
+
+	def test_hang_before_trigger(self):
+		# the captures after the stall wait for their trigger with no samples too (the mirror edge
+		# comes a millisecond after the press); they must not be taken for the same stall
+		watchdog = self._run("polled", dwf_class=ArmHangDwf)
+		self.assertEqual(acq.dwf.num_hangs, 1)
+		self.assertEqual(watchdog["stalls"], {"trigger_never_fired": 1})
+		self.assertEqual(watchdog["recoveries"], {"rearm": 1})
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,172 @@
+"""
+	Stall watchdog of the acquisition loop.
+
+	A capture that stalls (the AD2 stops delivering samples, the trigger never fires, a DIO read
+	hangs) breaks early and is retried. When the device has wedged, a plain retry stalls again,
+	forever. StallWatchdog classifies every stall and recovers from it, escalating with the number
+	of stalls in a row: the first ones only re-arm DigitalIn, then the instruments are reset, then
+	the device is closed and opened again. Between the stalls of a streak it waits, doubling the
+	wait every time up to max_backoff seconds. A capture that does not stall ends the streak.
+
+	Every recovery goes to a csv side file next to the data file (created on the first one): the
+	packet, the stall, the action, and the testbed time it cost (the stalled capture, the backoff
+	and the recovery itself). After give_up_after stalls in a row the watchdog raises StallError,
+	which ends the run instead of letting it spin.
+"""
+
+from timeit import default_timer
+import collections
+import time
+
+# stall kinds
+STALL_NO_SAMPLES = "no_new_samples"
+STALL_NO_TRIGGER = "trigger_never_fired"
+STALL_DIO_TIMEOUT = "dio_read_timeout"
+
+# recovery actions, in the order they are escalated through
+RECOVERY_REARM = "rearm"
+RECOVERY_RESET = "reset_instruments"
+RECOVERY_REOPEN = "reopen_device"
+RECOVERY_ACTIONS = [RECOVERY_REARM, RECOVERY_RESET, RECOVERY_REOPEN]
+
+RECOVERY_HEADER = "Packet, Stall, Action, Streak, Stalled (ms), Backoff (ms), Recovery (ms), Succeeded\n"
+
+class StallError(Exception):
+	"""The device kept stalling however it was recovered."""
+
+class StallWatchdog:
+	"""Detects stalls in a capture loop and recovers from them (see recover).
+
+	sample_timeout: seconds without new samples before a capture loop is stalled
+	dio_timeout: seconds a DIO read may take before it counts as a stall
+	escalate_after: stalls in a row at each action before escalating to the next
+	initial_backoff, max_backoff: seconds waited before the second recovery of a streak, and at most
+	give_up_after: stalls in a row before StallError (None: never)
+	"""
+
+	def __init__(self, path, sample_timeout=0.5, dio_timeout=0.1, escalate_after=2,
+			initial_backoff=0.01, max_backoff=5.0, give_up_after=50):
+		self.path = path
+		self.sample_timeout = sample_timeout
+		self.dio_timeout = dio_timeout
+		self.escalate_after = escalate_after
+		self.initial_backoff = initial_backoff
+		self.max_backoff = max_backoff
+		self.give_up_after = give_up_after
+
+		self._file = None
+		# stalls since the last capture that did not stall
+		self.streak = 0
+
+		# progress of the capture loop in progress (see no_progress)
+		self._progress_samples = -1
+		self._progress_time = 0
+
+		# totals
+		self.num_stalls = collections.Counter()
+		self.num_recoveries = collections.Counter()
+		self.num_failed_recoveries = 0
+		self.longest_streak = 0
+		self.stalled_time = 0
+		self.backoff_time = 0
+		self.recovery_time = 0
+
+	def start_capture(self):
+		"""Called before a capture loop starts."""
+		self._progress_samples = -1
+		self._progress_time = default_timer()
+
+	def no_progress(self, num_samples):
+		"""Whether num_samples, the samples a capture loop has taken so far, did not grow for
+		sample_timeout seconds.
+		"""
+		now = default_timer()
+		if num_samples != self._progress_samples:
+			self._progress_samples = num_samples
+			self._progress_time = now
+			return False
+		return now - self._progress_time > self.sample_timeout
+
+	def dio_timed_out(self, read_time):
+		"""Whether a DIO read that took read_time seconds counts as a stall."""
+		return read_time > self.dio_timeout
+
+	def capture_ok(self):
+		"""Called after a capture that did not stall; ends the streak."""
+		self.streak = 0
+
+	def action(self):
+		"""The recovery action for the stall streak so far."""
+		level = min((self.streak - 1) // self.escalate_after, len(RECOVERY_ACTIONS) - 1)
+		return RECOVERY_ACTIONS[level]
+
+	def backoff(self):
+		"""Seconds to wait before the recovery of the stall streak so far."""
+		if self.streak <= 1:
+			return 0
+		return min(self.initial_backoff * 2 ** (self.streak - 2), self.max_backoff)
+
+	def recover(self, capture, perform):
+		"""Recovers from the stall of capture (a PacketCapture with broke_early and stall set).
+		perform(action) carries the action out on the device and returns whether it succeeded;
+		it may also raise, which counts as failing. Raises StallError after give_up_after stalls in a row.
+		"""
+		self.streak += 1
+		self.longest_streak = max(self.longest_streak, self.streak)
+		self.num_stalls[capture.stall] += 1
+		action = self.action()
+		backoff = self.backoff()
+
+		stalled = 0
+		if capture.press_time is not None and capture.detect_time is not None:
+			stalled = max(0, capture.detect_time - capture.press_time)
+		if backoff > 0:
+			time.sleep(backoff)
+
+		recovery_start = default_timer()
+		try:
+			succeeded = bool(perform(action))
+		except Exception as e:
+			print "recovery {} failed: {}".format(action, e)
+			succeeded = False
+		recovery = default_timer() - recovery_start
+
+		self.num_recoveries[action] += 1
+		if not succeeded:
+			self.num_failed_recoveries += 1
+		self.stalled_time += stalled
+		self.backoff_time += backoff
+		self.recovery_time += recovery
+		print "stall ({}) at packet {}, streak {}: {} after {:.0f} ms{}".format(
+			capture.stall, capture.attempt_number, self.streak, action, 1000.0 * backoff, "" if succeeded else ", FAILED")
+		self._log(capture, action, stalled, backoff, recovery, succeeded)
+
+		if self.give_up_after is not None and self.streak >= self.give_up_after:
+			raise StallError("{} stalls in a row, the last one {} at packet {}".format(self.streak, capture.stall, capture.attempt_number))
+
+	def _log(self, capture, action, stalled, backoff, recovery, succeeded):
+		if self._file is None:
+			self._file = open(self.path, "w")
+			self._file.write(RECOVERY_HEADER)
+		self._file.write("{}, {}, {}, {}, {:.3f}, {:.3f}, {:.3f}, {}\n".format(
+			capture.attempt_number, capture.stall, action, self.streak,
+			1000.0 * stalled, 1000.0 * backoff, 1000.0 * recovery, int(succeeded)))
+		self._file.flush()
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+
+	def summary(self):
+		"""Counters written to summary_*.json."""
+		return {
+			"recoveries_file": self.path if self._file is not None else None,
+			"stalls": dict(self.num_stalls),
+			"recoveries": dict(self.num_recoveries),
+			"failed_recoveries": self.num_failed_recoveries,
+			"longest_streak": self.longest_streak,
+			"stalled_s": self.stalled_time,
+			"backoff_s": self.backoff_time,
+			"recovery_s": self.recovery_time,
+			"testbed_time_lost_s": self.stalled_time + self.backoff_time + self.recovery_time,
+		}